@@ -0,0 +1,101 @@
+'''
+Content-addressed cache for enrichment stage artifacts.
+
+Each pipeline stage (enrichment.py) stores its output files as one entry,
+CACHE_DIR/<stage>/<key>/, where key is the sha256 of the stage name and
+version, the digests of the stage's inputs (input files or the keys of the
+stages it builds on) and the config fields the stage reads. A stage whose key
+is cached is not rerun, so changing e.g. the Databases mix only reruns the
+stages that read it. Entries are built in a temp dir and renamed into place,
+and each has a meta.json recording what it was built from.
+
+Input file digests are memoized by (path, size, mtime) in file_digests.json,
+so a large trace pickle is hashed once. Entries are never evicted; delete
+CACHE_DIR to reclaim the space.
+'''
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+CACHE_DIR = '.enrichment_cache'
+HASH_BLOCK = 1 << 20
+META_FILE = 'meta.json'
+DIGESTS_FILE = 'file_digests.json'
+
+
+def digest_json(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, root=CACHE_DIR, rebuild=False):
+        self.root = root
+        self.rebuild = rebuild # rerun every stage, replacing cached entries
+        os.makedirs(root, exist_ok=True)
+        self.digests_path = os.path.join(root, DIGESTS_FILE)
+        try:
+            with open(self.digests_path) as f:
+                self.file_digests = json.load(f) # key: abs path, value: [size, mtime ns, sha256]
+        except (OSError, ValueError):
+            self.file_digests = {}
+
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        memo = self.file_digests.get(path)
+        if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+            return memo[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                h.update(block)
+        self.file_digests[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        with open(self.digests_path, 'w') as f:
+            json.dump(self.file_digests, f)
+        return h.hexdigest()
+
+    def stage_key(self, stage, version, inputs, config):
+        '''inputs: name -> digest (files or upstream stage keys); config: the fields the stage reads'''
+        return digest_json({'stage': stage, 'version': version, 'inputs': inputs, 'config': config})
+
+    def entry_dir(self, stage, key):
+        return os.path.join(self.root, stage, key)
+
+    def run(self, stage, version, inputs, config, build):
+        '''
+        Returns (key, entry dir), running build(dir) to fill a new entry unless
+        one with the same key is cached.
+        '''
+        key = self.stage_key(stage, version, inputs, config)
+        entry = self.entry_dir(stage, key)
+        if os.path.exists(os.path.join(entry, META_FILE)) and not self.rebuild:
+            print(f"[cache] {stage}: hit {key[:12]}")
+            return key, entry
+        print(f"[cache] {stage}: building {key[:12]}")
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.build_', dir=os.path.dirname(entry))
+        os.chmod(tmp, 0o755)
+        try:
+            st = time.time()
+            build(tmp)
+            with open(os.path.join(tmp, META_FILE), 'w') as f:
+                json.dump({'stage': stage, 'version': version, 'inputs': inputs, 'config': config,
+                           'built_at': time.time(), 'build_seconds': time.time() - st}, f, indent=2)
+            if os.path.exists(entry):
+                shutil.rmtree(entry)
+            os.rename(tmp, entry)
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+        return key, entry
+
+
+def place(entry, name, out_dir):
+    '''
+    Copies an entry's file into out_dir. Not a hard link: the notebook and
+    users rewrite output files in place, which would change the cached entry.
+    '''
+    shutil.copyfile(os.path.join(entry, name), os.path.join(out_dir, name))
@@ -1,6 +1,12 @@
 import json
 import yaml
-import subprocess, os
+import shutil
+import subprocess, os, sys
+
+sys.path.append('./deployment_files/sl_python')
+from packet_store import build_packet_stores, build_node_peers
+from placement import place_nodes, iter_trace_packets, placement_constraint, print_report
+from sizing import size_nodes, target_rps, print_sizing
 
 # Read inputs
 def load_dict_from_json(file_path):
@@ -22,8 +28,28 @@ conts_to_setup = {
 
 config = read_yaml('enrichment_config.yaml')
 workload_name = config['ExpWorkloadName']
+packet_mode = config.get('PacketMode', 'full')
+wire_format = config.get('WireFormat', 'json')
+db_batching = config.get('DbBatching', {})
+db_pools = config.get('DbPools', {})
+request_log_cfg = config.get('RequestLog', {})
+# Per hop latencies are off by default (a ring write per hop); span analysis runs turn them on
+hop_log = 1 if request_log_cfg.get('spans', 0) else request_log_cfg.get('hop_log', 0)
+admission_cfg = config.get('Admission', {})
+service_time_cfg = config.get('ServiceTime', {})
+sl_server_cfg = config.get('SlServer', {})
+sl_implementation = sl_server_cfg.get('implementation', 'go')
+client_cfg = config.get('Client', {})
+placement_cfg = config.get('Placement', {})
 # print(workload_name)
 
+def service_time_spec(nid):
+    '''Service time distribution of an SL node: its class's spec, else the default (see service_time.py)'''
+    for node_class, class_nodes in (service_time_cfg.get('node_classes') or {}).items():
+        if nid in class_nodes:
+            return service_time_cfg['classes'][node_class]
+    return service_time_cfg.get('default') or {}
+
 node_split = load_dict_from_json(f"./enrichment_runs/{workload_name}/node_split_output.json")
 # unique_nodes = load_dict_from_json("./node_and_trace_details/500_100k_unique_nodes.json")
 # unique_nodes_str = ",".join(unique_nodes)
@@ -45,14 +71,87 @@ for service in conts_to_setup:
 
 print(conts_to_setup.keys())
 
+# Fixed limits when Sizing is off
+special_nodes = ["n2146", "n3909", "n7019", "n2562", "n652", "n8097", "n4467"]
+sf_hot_nodes = ["n4576", "n103", "n1082"] # "n744", "n9555", "n3184", "n4835", "n750"
+sizing_enabled = bool((config.get('Sizing') or {}).get('enabled', 0))
+
+def size_containers(conts_to_setup, workload_name):
+    '''Limits, SL workers and Postgres max_connections per container from its load at the target rps (see sizing.py)'''
+    sf_db = {nid: db for db in ['MongoDB', 'Redis', 'Postgres'] for nid in conts_to_setup[db]['nodes_list']}
+    sizing = size_nodes(conts_to_setup['Python']['nodes_list'], sf_db, iter_trace_packets(f"./enrichment_runs/{workload_name}"),
+                        target_rps(config), config.get('Sizing'), db_pools, sl_server_cfg.get('workers', 1))
+    print_sizing(sizing)
+    with open(f"./enrichment_runs/{workload_name}/sizing.json", 'w') as f:
+        json.dump(sizing, f, indent=2)
+    return sizing
+
+def node_limits(service, cont_name):
+    '''(cpus, memory GB) limits of a container'''
+    if sizing is None:
+        if service == 'Python':
+            return (8, 8) if cont_name in special_nodes else (6, 6)
+        return (1 if cont_name in sf_hot_nodes else 0.5), 4
+    size = sizing['nodes'][cont_name]
+    return size['cpus'], size['memory_gb']
+
+def sl_workers(cont_name):
+    workers = sl_server_cfg.get('workers', 1)
+    if workers != 'sized':
+        return workers
+    return sizing['nodes'][cont_name]['workers'] if sizing is not None else 'auto'
+
+def hot_nodes():
+    return sizing['hot_sf_nodes'] if sizing is not None else sf_hot_nodes
+
+def pg_max_connections(cont_name):
+    return sizing['nodes'][cont_name]['max_connections'] if sizing is not None else 500
+
+def place_containers(conts_to_setup, workload_name):
+    '''Slot label per container, by the traffic between them in the trace packets (see placement.py)'''
+    node_groups = [conts_to_setup[service]['nodes_list'] for service in conts_to_setup]
+    demands = {nid: node_limits(service, nid) for service in conts_to_setup for nid in conts_to_setup[service]['nodes_list']}
+    node_slots, report = place_nodes(node_groups, demands, iter_trace_packets(f"./enrichment_runs/{workload_name}"),
+                                     placement_cfg)
+    print_report(report)
+    with open(f"./enrichment_runs/{workload_name}/placement.json", 'w') as f:
+        json.dump({'slots': node_slots, 'report': report}, f, indent=2)
+    return node_slots
+
+def build_sl_packet_stores(workload_name):
+    '''Per SL node packet stores for pass-by-reference mode, baked into the SL image'''
+    store_dir = "./deployment_files/sl_python/packet_store"
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    n_stores = build_packet_stores(f"./enrichment_runs/{workload_name}/all_trace_packets.json", store_dir)
+    print(f"Built {n_stores} SL packet stores in {store_dir}")
+
+def build_sl_node_peers(workload_name):
+    '''Peers each SL node calls, read by sl_test.py at boot to pre-warm connections'''
+    peers_file = "./deployment_files/sl_python/node_peers.json"
+    n_nodes = build_node_peers(f"./enrichment_runs/{workload_name}/all_trace_packets.json", peers_file)
+    print(f"Wrote peer lists for {n_nodes} SL nodes to {peers_file}")
+
+def write_prometheus_targets(sl_nodes, targets_file="./monitoring/sl_targets.json"):
+    '''
+    Writes the SL containers' /metrics endpoints to the file_sd target file the
+    sl_service job in monitoring/prometheus.yml reads. Only the Python SL server
+    serves /metrics, so with the Go one the file holds no targets.
+    '''
+    targets = [f"{nid}:5000" for nid in sl_nodes] if sl_implementation == 'python' else []
+    with open(targets_file, 'w') as f:
+        json.dump([{'targets': targets}] if targets else [], f, indent=2)
+    print(f"Registered {len(targets)} SL metrics targets in {targets_file}")
+
 def build_images():
     # Mewbie client
     path = "./deployment_files/mewbie_client/"
     subprocess.run(["docker", "build", "-t", "mewbieregistry.com:5000/mewbie_img", path], check=True)
     subprocess.run(["docker","push","mewbieregistry.com:5000/mewbie_img:latest"])
-    # SL Python
+    # SL service: Go sltest (Dockerfile) or Python sl_test.py (Dockerfile.python)
     path = "./deployment_files/sl_python/"
-    subprocess.run(["docker", "build", "-t", "mewbieregistry.com:5000/slp_img", path], check=True)
+    dockerfile = os.path.join(path, "Dockerfile.python" if sl_implementation == 'python' else "Dockerfile")
+    subprocess.run(["docker", "build", "-t", "mewbieregistry.com:5000/slp_img", "-f", dockerfile, path], check=True)
     subprocess.run(["docker","push","mewbieregistry.com:5000/slp_img:latest"])
     # Mongo Mewbie
     path = "./deployment_files/mongo_dmix_img/"
@@ -64,7 +163,7 @@ def build_images():
     subprocess.run(["docker", "build", "-t", "mewbieregistry.com:5000/postgres_dmix_img", path], check=True)
     subprocess.run(["docker","push","mewbieregistry.com:5000/postgres_dmix_img:latest"])
 
-def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
+def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name, node_slots):
     docker_compose_data = {
         "version": "3.3",
         "services": {},
@@ -93,6 +192,7 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
     #     'container_name': 'prometheus',
     #     'volumes': [
     #         './monitoring/prometheus.yml:/etc/prometheus/prometheus.yml',
+    #         './monitoring/sl_targets.json:/etc/prometheus/sl_targets.json',
     #         'prometheus_data:/prometheus'
     #     ],
     #     'ports': [
@@ -190,6 +290,13 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
             'container_name': 'mewbie_client',
             'volumes':[
                 './enrichment_runs/{}/all_trace_packets.json:/app/all_trace_packets.json'.format(workload_name),
+                './enrichment_runs/{}/all_trace_packets.mwpk:/app/all_trace_packets.mwpk'.format(workload_name),
+                './enrichment_runs/{}/all_trace_packets.jsonl:/app/all_trace_packets.jsonl'.format(workload_name),
+                './deployment_files/mewbie_client/mewbie_client.py:/app/mewbie_client.py',
+                './deployment_files/sl_python/trace_codec.py:/app/trace_codec.py',
+                './deployment_files/sl_python/packet_source.py:/app/packet_source.py',
+                './deployment_files/sl_python/latency_histogram.py:/app/latency_histogram.py',
+                './deployment_files/sl_python/completion.py:/app/completion.py',
                 './deployment_files/mewbie_client/mewbie_client.go:/app/mewbie_client.go',
                 './deployment_files/mewbie_client/go.mod:/app/go.mod',
                 './deployment_files/mewbie_client/go.sum:/app/go.sum',
@@ -197,8 +304,26 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
             ],
             'environment': [
                 'CONTAINER_NAME=mewbie_client',
-                f'WORKLOAD_NAME={workload_name}'
-                # f'SL_NODES={unique_nodes_str}'
+                f'WORKLOAD_NAME={workload_name}',
+                f'PACKET_MODE={packet_mode}',
+                f'WIRE_FORMAT={wire_format}',
+                f"CLIENT_RPS={client_cfg.get('rps', 500)}",
+                f"ARRIVAL={client_cfg.get('arrival', 'constant')}",
+                f"MAX_INFLIGHT={client_cfg.get('max_inflight', 0)}",
+                f"CLIENT_WORKERS={client_cfg.get('workers', 1)}",
+                f"SWEEP_RATES={client_cfg.get('sweep', '')}",
+                f"SWEEP_STEP_DURATION={client_cfg.get('step_duration', 60)}",
+                f"SWEEP_DRAIN={client_cfg.get('drain', 15)}",
+                f"SWEEP_SLO_P99_MS={client_cfg.get('slo_p99_ms', 0)}",
+                f"SWEEP_MAX_ERROR_RATE={client_cfg.get('max_error_rate', 0.01)}",
+                # completions are pushed by the Python SL server only
+                f"COMPLETION_TRACKING={client_cfg.get('completion_tracking', 1) if sl_implementation == 'python' else 0}",
+                f"COLLECTOR_PORT={client_cfg.get('collector_port', 5001)}",
+                f"COMPLETION_TIMEOUT={client_cfg.get('completion_timeout', 60)}",
+                f"LIVE_INTERVAL={client_cfg.get('live_interval', 5)}",
+                f"ABORT_P99_MS={client_cfg.get('abort_p99_ms', 0)}",
+                f"ABORT_AFTER={client_cfg.get('abort_after', 3)}",
+                f'SL_NODES={",".join(total_sl_nodes_list)}'
             ],
             'command':
             'sh -c "tail -f /dev/null"',
@@ -224,8 +349,10 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
     }
     
 
-    special_nodes = ["n2146", "n3909", "n7019", "n2562", "n652", "n8097", "n4467"]
-    sf_hot_nodes = ["n4576", "n103", "n1082"] # "n744", "n9555", "n3184", "n4835", "n750"
+    db_batch_nodes = db_batching.get('nodes', '')
+    if db_batch_nodes == 'hot':
+        db_batch_nodes = ",".join(hot_nodes())
+    db_pool_sizes = ",".join(f"{db}={db_pools[db]}" for db in ['Postgres', 'Redis', 'MongoDB'] if db in db_pools)
     
     for service in conts_to_setup:
         service_node_count = conts_to_setup[service]['count']
@@ -234,8 +361,7 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
             for j in range(service_node_count):
                 service_name = f"Python-{j}_{nodes_for_service[j]}"  # e.g., Python-0_(nodeid)
                 cont_name = f"{nodes_for_service[j]}"
-                slot_index = j % 4
-                slot_label = f"slot{slot_index}"
+                cpus, memory = node_limits(service, cont_name)
                 docker_compose_data['services'][service_name] = {
                         'image': f"mewbieregistry.com:5000/slp_img:latest",
                     'container_name': cont_name,
@@ -243,7 +369,25 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
                         'ritul_logs:/app/logs/' 
                     ],
                     'environment': [
-                        f'CONTAINER_NAME={cont_name}'
+                        f'CONTAINER_NAME={cont_name}',
+                        f'DB_BATCH_NODES={db_batch_nodes}',
+                        f"DB_BATCH_WINDOW_MS={db_batching.get('window_ms', 2)}",
+                        f"DB_BATCH_MAX={db_batching.get('max_batch', 64)}",
+                        f'DB_POOL_SIZES={db_pool_sizes}',
+                        f"DB_POOL_HOT_SIZE={db_pools.get('hot_node_size', 0)}",
+                        f'DB_POOL_HOT_NODES={",".join(hot_nodes())}',
+                        f"REQUEST_LOG_FORMAT={request_log_cfg.get('format', 'csv')}",
+                        f"HOP_LOG={hop_log}",
+                        f"SPAN_LOG={request_log_cfg.get('spans', 0)}",
+                        f"ADMISSION_MAX_INFLIGHT={admission_cfg.get('max_inflight', 0)}",
+                        f"ADMISSION_QUEUE_LEN={admission_cfg.get('queue_len', 0)}",
+                        f"ADMISSION_POLICY={admission_cfg.get('policy', 'reject')}",
+                        f"ADMISSION_REJECT_STATUS={admission_cfg.get('reject_status', 429)}",
+                        f"SERVICE_TIME={json.dumps(service_time_spec(cont_name), separators=(',', ':'))}",
+                        f"SERVICE_TIME_MODE={service_time_cfg.get('mode', 'sleep')}",
+                        f"PAYLOAD_MAX_BYTES={config['WorkloadConfig'].get('max_record_size', 1 << 20)}",
+                        f"SL_WORKERS={sl_workers(cont_name)}",
+                        f"SL_EVENT_LOOP={sl_server_cfg.get('event_loop', 'asyncio')}"
                     ],
                     'networks': {
                         'mewbie_network': {
@@ -253,13 +397,13 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
                     'deploy': {
                         'placement': {
                             'constraints': [
-                                f'node.labels.slot == {slot_label}'
+                                placement_constraint(node_slots[cont_name])
                             ]
                         },
                         'resources': {
                             'limits': {
-                                'cpus': '6',  # CPU limit
-                                'memory': '6G'  # Memory limit, adjust as needed
+                                'cpus': f'{cpus:g}',  # CPU limit
+                                'memory': f'{memory:g}G'  # Memory limit
                             }
                         }
                     },
@@ -275,23 +419,12 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
                     'net.ipv4.tcp_tw_reuse=1'  # Enable TCP port reuse
                     ]
                 }
-                if cont_name in special_nodes:
-                    docker_compose_data['services'][service_name]['deploy']['resources'] = {
-                                'limits': {
-                                    'cpus': '8',  # CPU limit
-                                    'memory': '8G'  # Memory limit
-                                }
-                    }
         
         elif service == 'Redis':
             for j in range(service_node_count):
-                db_cpu = 0.5
                 service_name = f"Redis-{j}_{nodes_for_service[j]}" # eg: Redis-0_(nodeid)
                 cont_name = f"{nodes_for_service[j]}"
-                if cont_name in sf_hot_nodes:
-                    db_cpu = 1
-                slot_index = j % 4
-                slot_label = f"slot{slot_index}"
+                db_cpu, db_memory = node_limits(service, cont_name)
                 docker_compose_data['services'][service_name] = {
                     'image': f"redis:latest",
                     'container_name': cont_name,
@@ -309,26 +442,22 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
                     'deploy': {
                         'placement': {
                             'constraints': [
-                                f'node.labels.slot == {slot_label}'
+                                placement_constraint(node_slots[cont_name])
                             ]
                         },
                         'resources': {
                             'limits': {
-                                'cpus': f'{db_cpu}',
-                                'memory': '4G'  
+                                'cpus': f'{db_cpu:g}',
+                                'memory': f'{db_memory:g}G'
                             }
                         }
                     } 
                 }           
         elif service == 'MongoDB':
             for j in range(service_node_count):
-                db_cpu = 0.5
                 service_name = f"MongoDB-{j}_{nodes_for_service[j]}" # eg: MongoDB-0_(nodeid)
                 cont_name = f"{nodes_for_service[j]}"
-                if cont_name in sf_hot_nodes:
-                    db_cpu = 1
-                slot_index = j % 4
-                slot_label = f"slot{slot_index}"
+                db_cpu, db_memory = node_limits(service, cont_name)
                 docker_compose_data['services'][service_name] = {
                     'image': f"mewbieregistry.com:5000/mongo_dmix_img:latest",
                     'container_name': cont_name,
@@ -349,13 +478,13 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
                     'deploy': {
                         'placement': {
                             'constraints': [
-                                f'node.labels.slot == {slot_label}'
+                                placement_constraint(node_slots[cont_name])
                             ]
                         },
                         'resources': {
                             'limits': {
-                                'cpus': f'{db_cpu}',
-                                'memory': '4G' 
+                                'cpus': f'{db_cpu:g}',
+                                'memory': f'{db_memory:g}G'
                             }
                         }
                     }
@@ -364,13 +493,9 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
         elif service == 'Postgres':
             # cpus_per_container = calc_cpus_per_container(db_cpc)
             for j in range(service_node_count):
-                db_cpu = 0.5
                 service_name = f"Postgres-{j}_{nodes_for_service[j]}" # eg: Postgres-0_(nodeid)
                 cont_name = f"{nodes_for_service[j]}"
-                if cont_name in sf_hot_nodes:
-                    db_cpu = 1
-                slot_index = j % 4
-                slot_label = f"slot{slot_index}"
+                db_cpu, db_memory = node_limits(service, cont_name)
 
                 docker_compose_data['services'][service_name] = {
                     'image': f"mewbieregistry.com:5000/postgres_dmix_img:latest",
@@ -393,19 +518,19 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
                         'net.ipv4.ip_local_port_range=1024 65000'
                     ],
                     'command': ["postgres", 
-                                "-c", "max_connections=500"
+                                "-c", f"max_connections={pg_max_connections(cont_name)}"
                                 # "-c", "shared_buffers=800MB"
                                 ],
                     'deploy': {
                         'placement': {
                             'constraints': [
-                                f'node.labels.slot == {slot_label}'
+                                placement_constraint(node_slots[cont_name])
                             ]
                         },
                         'resources': {
                             'limits': {
-                                'cpus': f'{db_cpu}',
-                                'memory': '4G'  
+                                'cpus': f'{db_cpu:g}',
+                                'memory': f'{db_memory:g}G'
                             }
                         }
                     }
@@ -416,8 +541,14 @@ def gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name):
 
 python_cpc = 2
 db_cpc = 2
+if packet_mode == 'ref':
+    build_sl_packet_stores(workload_name)
+build_sl_node_peers(workload_name)
+write_prometheus_targets(total_sl_nodes_list)
 build_images()
-docker_compose_content = gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name)
+sizing = size_containers(conts_to_setup, workload_name) if sizing_enabled else None
+node_slots = place_containers(conts_to_setup, workload_name)
+docker_compose_content = gen_docker_compose_data(conts_to_setup, python_cpc, db_cpc, workload_name, node_slots)
 with open('docker-compose.yml', 'w') as f:
     f.write(docker_compose_content)
 
@@ -1,6 +1,10 @@
 import json
 import time
 import os
+import random
+import argparse
+import asyncio
+import aiohttp
 import requests
 import csv
 import re
@@ -10,7 +14,12 @@ import queue
 import logging
 from logging.handlers import RotatingFileHandler
 import threading
+import multiprocessing
 from concurrent.futures import ThreadPoolExecutor
+from trace_codec import JSON_CONTENT_TYPE, TID_HEADER, SEND_TS_HEADER, COLLECTOR_HEADER, ORIGIN_TS_HEADER
+from packet_source import PacketSource, open_packet_source, packet_offsets, in_shard
+from latency_histogram import LatencyHistogram
+from completion import CompletionTracker, start_collector
 
 def pkl_to_dict(pkl_file):
     with open(pkl_file, 'rb') as f:
@@ -23,104 +32,620 @@ if not os.path.exists(log_directory):
 log_file = os.path.join(log_directory, "client_log.csv")
 logger = logging.getLogger("ClientLogger")
 logger.setLevel(logging.INFO)
-handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5)
-logger.addHandler(handler)
+# Failed sends, one row per tid: tid,kind (rejected, timeout, error),detail,time us.
+# Kept out of logs/ itself so the analysis glob (logs/*.csv) does not pick it up.
+error_log_directory = os.path.join(log_directory, "errors")
+os.makedirs(error_log_directory, exist_ok=True)
+error_log_file = os.path.join(error_log_directory, "client_errors.csv")
+error_logger = logging.getLogger("ClientErrorLogger")
+error_logger.setLevel(logging.INFO)
 
-executor = ThreadPoolExecutor(max_workers=15)
+def setup_client_log(worker_id=None):
+    '''Single process: rotating client_log.csv. Workers: one part file each, merged by the parent.'''
+    for log, path in [(logger, log_file), (error_logger, error_log_file)]:
+        if worker_id is None:
+            if not log.handlers: # already set up by an earlier sweep step
+                log.addHandler(RotatingFileHandler(path, maxBytes=10*1024*1024, backupCount=5))
+        else:
+            log.handlers.clear() # drop handlers inherited over fork
+            log.addHandler(logging.FileHandler(f"{path}.w{worker_id}"))
+
+def now_us():
+    return time.time_ns() // 1000
 
 # Log function that uses the logger
-def log_entry(tid, this_nid, logged_time):
-    logger.info(f"{tid},{this_nid},{logged_time}")
+# logged_time is the intended send time (what RCT is measured from), sent_time the actual one, both in us
+def log_entry(tid, this_nid, logged_time, sent_time):
+    logger.info(f"{tid},{this_nid},{logged_time},{sent_time}")
 
+def log_error(tid, kind, detail):
+    error_logger.info(f"{tid},{kind},{detail},{now_us()}")
 
-# Read trace packets from file
-trace_packets_dict = json.load(open("./all_trace_packets.json"))
-session = requests.Session()
 
-def send_data_to_container(container_name, data, cont_type, tid):
-    log_entry(tid, "mewbie_client", time.time())
-    try:
+# full: send the whole trace packet, ref: send only the tid (SL nodes resolve it from their packet store)
+packet_mode = os.getenv('PACKET_MODE', 'full')
+# json or binary (trace_codec); binary packets are read pre-encoded from all_trace_packets.mwpk
+wire_format = os.getenv('WIRE_FORMAT', 'json')
+
+# Trace packets are streamed from disk (see packet_source.py), not loaded up front
+def outgoing_packet_file():
+    '''The packet file to stream, None if only the legacy all_trace_packets.json exists'''
+    # ref mode only needs packet headers, which the binary packets hold up front
+    if wire_format == 'binary' or (packet_mode == 'ref' and os.path.exists("./all_trace_packets.mwpk")):
+        return "./all_trace_packets.mwpk"
+    if os.path.exists("./all_trace_packets.jsonl"):
+        return "./all_trace_packets.jsonl"
+    return None
+
+def iter_outgoing_packets(shard=None, begin=0, end=None):
+    '''Yields (tid, initial node, initial node type, body, content type, logger nodes) in send order'''
+    packet_file = outgoing_packet_file()
+    if packet_file is not None:
+        return open_packet_source(packet_file, packet_mode, shard, begin, end)
+    # Enrichment runs from before the jsonl output: whole file has to be parsed
+    print("all_trace_packets.jsonl not found, loading all_trace_packets.json")
+    trace_packets = json.load(open("./all_trace_packets.json"))
+    return PacketSource((tid, t_packet['initial_node'], t_packet['initial_node_type'],
+                         json.dumps({'tid': tid} if packet_mode == 'ref' else t_packet), JSON_CONTENT_TYPE, t_packet['logger_nodes'])
+                        for position, (tid, t_packet) in enumerate(trace_packets.items())
+                        if begin <= position and (end is None or position < end) and in_shard(position, shard))
+
+def container_url(container_name, cont_type):
+    port = 5000
+    if cont_type == 'Python':
         port = 5000
-        if cont_type == 'Python':
-            port = 5000
-        elif cont_type == 'Redis':
-            port = 6379
-        elif cont_type == 'MongoDB':
-            port = 27017
-        elif cont_type == 'Postgres':
-            port = 5432
-        url = f"http://{container_name}:{port}/"
-        headers = {'Content-Type': 'application/json', 'Connection': 'close'}
-        # print("Sending data to container: ", container_name)
-        with session.post(url, json=data, headers=headers, timeout=2.5) as response:
-            # print("Done")
+    elif cont_type == 'Redis':
+        port = 6379
+    elif cont_type == 'MongoDB':
+        port = 27017
+    elif cont_type == 'Postgres':
+        port = 5432
+    return f"http://{container_name}:{port}/"
+
+
+READY_TIMEOUT = float(os.getenv('READY_TIMEOUT', '300'))
+NO_READY_ENDPOINT = (404, 405, 501) # SL images without /ready (the Go sltest): up is as ready as it gets
+def wait_for_node_ready(node, deadline):
+    '''True once node is ready, 'no_endpoint' if it serves no /ready, False at the deadline'''
+    delay = 0.5
+    while time.time() < deadline:
+        try:
+            with requests.get(f"http://{node}:5000/ready", timeout=2) as response:
+                if response.status_code == 200:
+                    return True
+                if response.status_code in NO_READY_ENDPOINT:
+                    return 'no_endpoint'
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
+    return False
+
+def wait_for_all_ready(nodes):
+    '''Blocks until every SL node reports /ready (pre-warmed) or READY_TIMEOUT passes'''
+    st = time.time()
+    deadline = st + READY_TIMEOUT
+    with ThreadPoolExecutor(max_workers=64) as ready_pool:
+        results = list(ready_pool.map(lambda node: wait_for_node_ready(node, deadline), nodes))
+    not_ready = [node for node, ok in zip(nodes, results) if not ok]
+    print(f"{len(nodes) - len(not_ready)}/{len(nodes)} SL nodes ready after {time.time() - st:.1f}s")
+    no_endpoint = sum(1 for ok in results if ok == 'no_endpoint')
+    if no_endpoint:
+        print(f"{no_endpoint} SL nodes serve no /ready endpoint, counted ready once up (not pre-warmed)")
+    if not_ready:
+        print("Nodes not ready, starting anyway:", ",".join(not_ready))
+
+
+# Fallback end of run check: concurrent /status sweeps until no node has requests alive
+STATUS_SWEEP_TIMEOUT = float(os.getenv('STATUS_SWEEP_TIMEOUT', '300'))
+def node_alive_count(node):
+    '''Alive request count of a node, -1 if it cannot be queried'''
+    try:
+        with requests.get(f"http://{node}:5000/status", timeout=2) as response:
+            response.raise_for_status()
+            match = re.search(r"Alive request count: (\d+)", response.text)
+            return int(match.group(1)) if match else 0
+    except requests.exceptions.RequestException as e:
+        print(f"Error with node {node}: {e}")
+        return -1
+
+def sweep_status(nodes, timeout=STATUS_SWEEP_TIMEOUT):
+    '''Polls every still busy node concurrently, backing off between sweeps; returns nodes still busy'''
+    deadline = time.time() + timeout
+    delay = 0.5
+    busy = list(nodes)
+    with ThreadPoolExecutor(max_workers=64) as status_pool:
+        while busy:
+            counts = dict(zip(busy, status_pool.map(node_alive_count, busy)))
+            busy = [node for node in busy if counts[node] > 0] # unreachable nodes are not waited on
+            if not busy:
+                break
+            print(f"{len(busy)} nodes with alive requests ({sum(counts[node] for node in busy)} total), "
+                  f"e.g. {', '.join(f'{node}: {counts[node]}' for node in busy[:5])}")
+            if time.time() + delay > deadline:
+                print(f"Status sweep timed out, nodes still busy: {','.join(busy)}")
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+    return busy
+
+
+##################### OPEN-LOOP LOAD GENERATOR #################################
+# Arrivals are scheduled on absolute deadlines from the start of the run and
+# never wait for earlier requests to finish, so a slow system cannot lower the
+# offered load. The intended send time is logged next to the actual one.
+rps = int(os.getenv('CLIENT_RPS', '500')) # packets per second
+arrival = os.getenv('ARRIVAL', 'constant') # constant or poisson inter-arrivals
+max_inflight = int(os.getenv('MAX_INFLIGHT', '0')) # 0: unbounded
+request_timeout = float(os.getenv('REQUEST_TIMEOUT', '2.5'))
+client_workers = int(os.getenv('CLIENT_WORKERS', '1')) # load generating processes
+# Sweep mode (see run_sweep)
+sweep_rates = os.getenv('SWEEP_RATES', '') # '' (off), START:STOP:STEP or comma separated rps
+sweep_step_duration = float(os.getenv('SWEEP_STEP_DURATION', '60'))
+sweep_drain = float(os.getenv('SWEEP_DRAIN', '15'))
+sweep_slo_p99_ms = float(os.getenv('SWEEP_SLO_P99_MS', '0'))
+sweep_max_error_rate = float(os.getenv('SWEEP_MAX_ERROR_RATE', '0.01'))
+# Completion tracking (completion.py): logger nodes push completions to a
+# collector in each load generating process (port COLLECTOR_PORT + worker id)
+completion_tracking = os.getenv('COMPLETION_TRACKING', '1') == '1'
+collector_host = os.getenv('CONTAINER_NAME', 'mewbie_client')
+collector_port = int(os.getenv('COLLECTOR_PORT', '5001'))
+completion_timeout = float(os.getenv('COMPLETION_TIMEOUT', '60')) # drain barrier, seconds after the last send returns
+# Live RCT percentiles (see LiveMonitor), needs completion tracking
+live_interval = float(os.getenv('LIVE_INTERVAL', '5')) # seconds, 0: off
+abort_p99_ms = float(os.getenv('ABORT_P99_MS', '0')) # 0: never abort
+abort_after = int(os.getenv('ABORT_AFTER', '3')) # intervals in a row past abort_p99_ms
+LIVE_MIN_COUNT = 50 # intervals with fewer completions do not count towards an abort
+
+def arrival_offsets(rate, arrival, seed=None):
+    '''Yields send offsets (seconds from start) for the given arrival process'''
+    rng = random.Random(seed)
+    offset = 0.0
+    while True:
+        yield offset
+        offset += rng.expovariate(rate) if arrival == 'poisson' else 1 / rate
+
+async def send_packet(session, url, body, headers, tid, intended_us, inflight_sem, stats, tracker=None):
+    sent_us = now_us()
+    log_entry(tid, "mewbie_client", intended_us, sent_us)
+    lag_us = sent_us - intended_us
+    stats['max_lag_us'] = max(stats['max_lag_us'], lag_us)
+    stats['total_lag_us'] += lag_us
+    # Span context for the root hop (see span_analysis.py)
+    headers[TID_HEADER] = tid
+    headers[SEND_TS_HEADER] = str(sent_us)
+    try:
+        st = time.perf_counter()
+        async with session.post(url, data=body, headers=headers) as response:
+            await response.read()
             response.raise_for_status()
+        stats['latency_hist'].record((time.perf_counter() - st) * 1e6)
+    except aiohttp.ClientResponseError as e:
+        stats['errors'] += 1
+        if e.status in (429, 503): # shed by the SL node's admission control, never processed
+            stats['rejected'] += 1
+            log_error(tid, 'rejected', e.status)
+            if tracker is not None:
+                tracker.abandon(tid)
+        else:
+            log_error(tid, 'error', e.status)
+            print("Error sending data to container: ", repr(e))
+    except asyncio.TimeoutError:
+        # The node may still process it, so it stays tracked for completion
+        stats['errors'] += 1
+        stats['timeouts'] += 1
+        log_error(tid, 'timeout', request_timeout)
     except Exception as e:
-        print("Error sending data to container: ", e)
+        stats['errors'] += 1
+        log_error(tid, 'error', type(e).__name__)
+        print("Error sending data to container: ", repr(e))
+    finally:
+        if inflight_sem is not None:
+            inflight_sem.release()
 
-def send_data_in_background(container_name, data, cont_type, tid):
-    executor.submit(send_data_to_container, container_name, data, cont_type, tid)
+class LiveMonitor:
+    '''
+    Live RCT percentiles from cumulative histogram snapshots taken every
+    live_interval: update() diffs each snapshot with the previous one, prints
+    p50/p90/p99 of the interval and of the run so far, and flags the run as
+    aborted once the interval p99 stays above abort_p99_ms for abort_after
+    intervals in a row.
+    '''
+    def __init__(self, label, abort_p99_ms=0, abort_after=3):
+        self.label = label
+        self.abort_p99_ms = abort_p99_ms
+        self.abort_after = abort_after
+        self.start = time.time()
+        self.last = LatencyHistogram()
+        self.over_threshold = 0
+        self.aborted = False
+        self.intervals = [] # interval summaries (ms) with the seconds since start, for the results file
 
+    def update(self, snapshot):
+        '''snapshot: cumulative RCT histogram, not modified afterwards; returns whether to abort'''
+        interval, self.last = snapshot.difference(self.last), snapshot
+        now, run = interval.summary_ms(), snapshot.summary_ms()
+        self.intervals.append(dict(now, elapsed=round(time.time() - self.start, 3)))
+        print(f"[live {self.label}] {now['count']} completed, p50 {now['p50']:.2f} ms, p90 {now['p90']:.2f} ms, "
+              f"p99 {now['p99']:.2f} ms | run: {run['count']} completed, p50 {run['p50']:.2f} ms, "
+              f"p90 {run['p90']:.2f} ms, p99 {run['p99']:.2f} ms")
+        if self.abort_p99_ms and interval.count >= LIVE_MIN_COUNT:
+            self.over_threshold = self.over_threshold + 1 if now['p99'] > self.abort_p99_ms else 0
+            if self.over_threshold >= self.abort_after and not self.aborted:
+                self.aborted = True
+                print(f"[live {self.label}] p99 above {self.abort_p99_ms} ms for {self.over_threshold} intervals, aborting")
+        return self.aborted
 
-rps = 500 # packets per second; USER DEFINED
-def main():
-    print(f"Running with rps: {rps}")
-    total_num_packets = len(trace_packets_dict)
-    print("Total number of packets: ", total_num_packets)
-    delay = 1/rps
-
-    total_packets_sent = 0
-    start_time = time.time()
-
-    for tid, t_packet in trace_packets_dict.items():
-        st = time.time()
-        t_ini_cont = t_packet['initial_node']
-        t_ini_type = t_packet['initial_node_type']
-        send_data_in_background(t_ini_cont, t_packet, t_ini_type, tid)
-        total_packets_sent += 1
-        elapsed_time = time.time() - st
-        if elapsed_time < delay:
-            time.sleep(delay - elapsed_time)
-
-    end_time = time.time()
-    total_exp_runtime = end_time - start_time
-    avg_req_ps = total_packets_sent / total_exp_runtime
+async def live_loop(hist, live, interval, stats):
+    '''Hands the cumulative RCT histogram to live every interval; stops sending once it returns True'''
+    while True:
+        await asyncio.sleep(interval)
+        if live(hist):
+            stats['aborted'] = True
+
+async def run_load(packets, rate, arrival, max_inflight, seed=None, start_at=None, phase=0.0, worker_id=0,
+                   live=None, live_interval=0):
+    '''
+    packets: PacketSource of (tid, initial node, initial node type, body, content type, logger nodes),
+    closed (reader thread stopped) when the run ends
+    start_at: wall clock time (s) the schedule starts from, phase: offset (s) of the first send
+    live: callable taking the cumulative RCT histogram every live_interval seconds (completion
+    tracking only); when it returns True the run is aborted: no more packets are sent.
+    With completion tracking on, returns once every tid completed or the drain barrier timed out.
+    '''
+    stats = {'sent': 0, 'errors': 0, 'rejected': 0, 'timeouts': 0, 'max_lag_us': 0, 'total_lag_us': 0,
+             'latency_hist': LatencyHistogram(), 'aborted': False}
+    tracker = collector_runner = live_task = None
+    if completion_tracking:
+        tracker = CompletionTracker()
+        collector_runner = await start_collector(tracker, collector_port + worker_id)
+        collector = f"{collector_host}:{collector_port + worker_id}"
+        if live is not None and live_interval > 0:
+            live_task = asyncio.create_task(live_loop(tracker.rct_hist, live, live_interval, stats))
+    connector = aiohttp.TCPConnector(limit=0) # no client side connection cap
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
+    inflight_sem = asyncio.Semaphore(max_inflight) if max_inflight > 0 else None
+    tasks = set()
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        if start_at is None:
+            start_at = time.time()
+        await asyncio.sleep(max(start_at - time.time(), 0))
+        start = time.perf_counter() - (time.time() - start_at)
+        start_us = int(start_at * 1e6)
+        offsets = arrival_offsets(rate, arrival, seed)
+        try:
+            async for tid, t_ini_cont, t_ini_type, body, content_type, logger_nodes in packets:
+                offset = next(offsets)
+                if stats['aborted']:
+                    break
+                offset += phase
+                # Sleep to the absolute deadline; when behind schedule, send right away (yielding once)
+                await asyncio.sleep(max(start + offset - time.perf_counter(), 0))
+                if inflight_sem is not None:
+                    await inflight_sem.acquire() # send is late if capped; intended time still logged
+                intended_us = start_us + int(offset * 1e6)
+                headers = {'Content-Type': content_type, ORIGIN_TS_HEADER: str(intended_us)}
+                if tracker is not None:
+                    tracker.register(tid, logger_nodes, intended_us)
+                    headers[COLLECTOR_HEADER] = collector
+                task = asyncio.create_task(send_packet(session, container_url(t_ini_cont, t_ini_type), body, headers,
+                                                       tid, intended_us, inflight_sem, stats, tracker))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                stats['sent'] += 1
+        finally:
+            packets.close()
+        stats['send_time'] = time.perf_counter() - start
+        if tasks:
+            await asyncio.gather(*tasks)
+    if tracker is not None:
+        # Drain barrier: RCT is end to end, so the run ends when the logger nodes say so
+        stats['incomplete'] = await tracker.wait_drained(completion_timeout)
+        stats['completed'] = tracker.completed
+        stats['rct_hist'] = tracker.rct_hist
+        if live_task is not None:
+            live_task.cancel()
+        await collector_runner.cleanup()
+    return stats
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Open-loop trace packet load generator")
+    parser.add_argument('--rps', type=int, default=rps, help="offered load, packets per second")
+    parser.add_argument('--arrival', choices=['constant', 'poisson'], default=arrival)
+    parser.add_argument('--max-inflight', type=int, default=max_inflight, help="0: unbounded")
+    parser.add_argument('--seed', type=int, default=None, help="seed for poisson inter-arrivals")
+    parser.add_argument('--workers', type=int, default=client_workers, help="load generating processes")
+    parser.add_argument('--sweep', default=sweep_rates,
+                        help="sweep offered load instead of one run: START:STOP:STEP or comma separated rps list")
+    parser.add_argument('--step-duration', type=float, default=sweep_step_duration, help="seconds of load per sweep step")
+    parser.add_argument('--drain', type=float, default=sweep_drain, help="seconds between sweep steps")
+    parser.add_argument('--slo-p99-ms', type=float, default=sweep_slo_p99_ms, help="stop sweep past this p99 (0: off)")
+    parser.add_argument('--max-error-rate', type=float, default=sweep_max_error_rate, help="stop sweep past this error rate")
+    parser.add_argument('--sweep-out', default=None, help="sweep results file (default logs/sweep_<time>.json)")
+    parser.add_argument('--live-interval', type=float, default=live_interval, help="seconds between live RCT percentiles (0: off)")
+    parser.add_argument('--abort-p99-ms', type=float, default=abort_p99_ms,
+                        help="abort the run (or sweep) once the live p99 stays above this (0: off)")
+    parser.add_argument('--abort-after', type=int, default=abort_after, help="live intervals in a row past --abort-p99-ms")
+    return parser.parse_args()
+
+
+##################### MULTI-PROCESS LOAD #################################
+# Worker i sends every N-th packet starting at i, at rps/N, on a shared start
+# time. Constant arrivals are phase shifted by i/rps so the merged stream is
+# evenly spaced; Poisson streams superpose into one Poisson stream at rps.
+# Workers put ('live', id, RCT histogram) every live interval and
+# ('done', id, stats) at the end on the result queue; the parent merges the
+# live snapshots into one LiveMonitor and sets abort_event to stop them all.
+def run_worker(worker_id, n_workers, args, rate, begin, end, start_at, result_queue, abort_event):
+    setup_client_log(worker_id)
+    seed = None if args.seed is None else args.seed + worker_id
+    worker_inflight = max(1, args.max_inflight // n_workers) if args.max_inflight > 0 else 0
+    phase = worker_id / rate if args.arrival == 'constant' else 0.0
+
+    def live(hist):
+        result_queue.put(('live', worker_id, hist.to_dict()))
+        return abort_event.is_set()
+    try:
+        stats = asyncio.run(run_load(iter_outgoing_packets((worker_id, n_workers), begin, end), rate / n_workers,
+                                     args.arrival, worker_inflight, seed, start_at, phase, worker_id,
+                                     live, args.live_interval))
+        stats['latency_hist'] = stats['latency_hist'].to_dict()
+        if 'rct_hist' in stats:
+            stats['rct_hist'] = stats['rct_hist'].to_dict()
+    except Exception as e:
+        print(f"Worker {worker_id} failed: {e}")
+        stats = None
+    result_queue.put(('done', worker_id, stats))
+
+def merge_stats(worker_stats):
+    merged = {'sent': 0, 'errors': 0, 'rejected': 0, 'timeouts': 0, 'max_lag_us': 0, 'total_lag_us': 0,
+              'send_time': 0, 'latency_hist': LatencyHistogram(), 'aborted': False}
+    for stats in worker_stats:
+        for key in ['sent', 'errors', 'rejected', 'timeouts', 'total_lag_us']:
+            merged[key] += stats[key]
+        merged['aborted'] = merged['aborted'] or stats['aborted']
+        merged['max_lag_us'] = max(merged['max_lag_us'], stats['max_lag_us'])
+        merged['send_time'] = max(merged['send_time'], stats['send_time'])
+        merged['latency_hist'].merge(LatencyHistogram.from_dict(stats['latency_hist']))
+        if 'rct_hist' in stats:
+            merged.setdefault('rct_hist', LatencyHistogram()).merge(LatencyHistogram.from_dict(stats['rct_hist']))
+            merged['completed'] = merged.get('completed', 0) + stats['completed']
+            merged['incomplete'] = merged.get('incomplete', []) + stats['incomplete']
+    return merged
+
+def merge_client_logs(n_workers):
+    '''Appends the worker part files to client_log.csv (the file the analysis reads) and errors/client_errors.csv'''
+    for path in [log_file, error_log_file]:
+        with open(path, 'a') as merged:
+            for worker_id in range(n_workers):
+                part = f"{path}.w{worker_id}"
+                if not os.path.exists(part):
+                    continue
+                with open(part, 'r') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), ''):
+                        merged.write(chunk)
+                os.remove(part)
+
+def new_live_monitor(args, rate):
+    return LiveMonitor(f"{rate} rps", args.abort_p99_ms, args.abort_after)
+
+RESULT_POLL = 1.0 # s, how often the parent checks for workers that died without a result
+def run_workers(args, rate, begin=0, end=None):
+    ctx = multiprocessing.get_context('fork')
+    result_queue = ctx.Queue()
+    abort_event = ctx.Event()
+    start_at = time.time() + 2 # time for every worker to open its packet source
+    workers = [ctx.Process(target=run_worker, args=(i, args.workers, args, rate, begin, end, start_at, result_queue,
+                                                    abort_event))
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    monitor = new_live_monitor(args, rate) if completion_tracking and args.live_interval > 0 else None
+    snapshots = {} # key: worker id, value: its latest cumulative RCT histogram (dict)
+    next_update = start_at + args.live_interval
+    results = {}
+    dead = set() # workers seen exited without a result: failed if still missing on the next poll
+    while len(results) < len(workers):
+        try:
+            timeout = max(min(next_update - time.time(), RESULT_POLL), 0.1) if monitor is not None else RESULT_POLL
+            kind, worker_id, payload = result_queue.get(timeout=timeout)
+            if kind == 'live':
+                snapshots[worker_id] = payload
+            else:
+                results[worker_id] = payload
+        except queue.Empty:
+            # A worker killed (OOM, signal, os._exit) never posts its result
+            for worker_id, worker in enumerate(workers):
+                if worker_id in results or worker.is_alive():
+                    continue
+                if worker_id in dead:
+                    print(f"Worker {worker_id} exited with code {worker.exitcode} without a result")
+                    results[worker_id] = None
+                else:
+                    dead.add(worker_id)
+        if monitor is not None and time.time() >= next_update:
+            if snapshots:
+                merged = LatencyHistogram()
+                for snapshot in snapshots.values():
+                    merged.merge(LatencyHistogram.from_dict(snapshot))
+                if monitor.update(merged):
+                    abort_event.set()
+            next_update += args.live_interval
+    for worker in workers:
+        worker.join()
+    failed = [worker_id for worker_id, stats in results.items() if stats is None]
+    if failed:
+        print(f"Workers failed: {failed}")
+    merge_client_logs(args.workers)
+    merged = merge_stats([stats for stats in results.values() if stats is not None])
+    if monitor is not None and monitor.intervals:
+        merged['live'] = monitor.intervals
+    return merged
+
+def run_single(args, rate, begin=0, end=None):
+    setup_client_log()
+    monitor = new_live_monitor(args, rate)
+    stats = asyncio.run(run_load(iter_outgoing_packets(None, begin, end), rate, args.arrival, args.max_inflight, args.seed,
+                                 live=lambda hist: monitor.update(hist.copy()), live_interval=args.live_interval))
+    if monitor.intervals:
+        stats['live'] = monitor.intervals
+    return stats
+
+def run_packets(args, rate, begin=0, end=None):
+    return run_workers(args, rate, begin, end) if args.workers > 1 else run_single(args, rate, begin, end)
+
+
+##################### SWEEP MODE #################################
+# Steps the offered load within one deployment. Each step sends rate x
+# step_duration packets (continuing through the packet file), waits for its
+# requests, reports p50/p90/p99 latency and error rate, then drains before
+# the next step. Stops at the first step past the SLO or error threshold,
+# or one aborted by the live RCT monitor.
+# Latency is the request completion time with completion tracking on (the
+# step also waits for its tids to complete), else the client observed one;
+# the metric used is recorded as slo_metric and flagged when it is the latter.
+def parse_sweep_rates(spec):
+    if ':' in spec:
+        start, stop, step = (int(x) for x in spec.split(':'))
+        return list(range(start, stop + 1, step))
+    return [int(x) for x in spec.split(',') if x]
+
+def run_sweep(args):
+    rates = parse_sweep_rates(args.sweep)
+    slo_metric = 'rct' if completion_tracking else 'send_latency'
+    if not completion_tracking:
+        print("Warning: COMPLETION_TRACKING=0, sweep latency and SLO are client send latency, "
+              "not request completion time")
+    sweep_out = args.sweep_out or os.path.join(log_directory, f"sweep_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    results = {
+        'config': {'rates': rates, 'step_duration': args.step_duration, 'drain': args.drain,
+                   'slo_p99_ms': args.slo_p99_ms, 'slo_metric': slo_metric, 'max_error_rate': args.max_error_rate,
+                   'live_interval': args.live_interval, 'abort_p99_ms': args.abort_p99_ms, 'abort_after': args.abort_after,
+                   'arrival': args.arrival, 'workers': args.workers, 'max_inflight': args.max_inflight,
+                   'wire_format': wire_format, 'packet_mode': packet_mode},
+        'steps': [],
+        'stop_reason': 'completed',
+        'max_rps_within_slo': None
+    }
+    packet_file = outgoing_packet_file()
+    if packet_file is not None and len(rates) > 1:
+        packet_offsets(packet_file) # once, before workers fork: later steps seek to their first packet
+    position = 0
+    for step_idx, rate in enumerate(rates):
+        n_packets = int(rate * args.step_duration)
+        start_us = now_us()
+        stats = run_packets(args, rate, position, position + n_packets)
+        step = {
+            'offered_rps': rate,
+            'packets': [position, position + stats['sent']], # packet positions, to cut logs per step
+            'start_us': start_us,
+            'end_us': now_us(),
+            'sent': stats['sent'],
+            'errors': stats['errors'],
+            'rejected': stats['rejected'],
+            'timeouts': stats['timeouts'],
+            'error_rate': stats['errors'] / stats['sent'] if stats['sent'] else 0,
+            'achieved_rps': stats['sent'] / stats['send_time'] if stats.get('send_time') else 0,
+            'mean_send_lag_ms': stats['total_lag_us'] / stats['sent'] / 1000 if stats['sent'] else 0,
+            'latency_ms': stats['latency_hist'].summary_ms(),
+            'latency_metric': 'send_latency'
+        }
+        if 'rct_hist' in stats:
+            step['send_latency_ms'] = step['latency_ms']
+            step['latency_ms'] = stats['rct_hist'].summary_ms()
+            step['latency_metric'] = 'rct'
+            step['completed'] = stats['completed']
+            step['incomplete'] = len(stats['incomplete'])
+        if 'live' in stats:
+            step['live_ms'] = stats['live'] # per live interval RCT summaries
+        position += stats['sent']
+        results['steps'].append(step)
+        if stats.get('incomplete'):
+            write_incomplete_tids(stats['incomplete'])
+        print(f"Step {step_idx}: offered {rate} rps, achieved {step['achieved_rps']:.1f}, {step['latency_metric']} "
+              f"p50 {step['latency_ms']['p50']:.2f} ms, p90 {step['latency_ms']['p90']:.2f} ms, "
+              f"p99 {step['latency_ms']['p99']:.2f} ms, error rate {step['error_rate']:.4f}")
+
+        if stats['aborted']:
+            results['stop_reason'] = 'aborted'
+        elif step['error_rate'] > args.max_error_rate:
+            results['stop_reason'] = 'error_rate'
+        elif args.slo_p99_ms and step['latency_ms']['p99'] > args.slo_p99_ms:
+            results['stop_reason'] = 'slo'
+        elif stats['sent'] < n_packets:
+            results['stop_reason'] = 'packets_exhausted'
+            if stats['sent']:
+                results['max_rps_within_slo'] = rate
+        else:
+            results['max_rps_within_slo'] = rate
+        if results['stop_reason'] != 'completed':
+            break
+        if step_idx < len(rates) - 1:
+            time.sleep(args.drain)
+
+    with open(sweep_out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Sweep stopped: {results['stop_reason']}, max rps within SLO ({slo_metric}): {results['max_rps_within_slo']}")
+    print(f"Sweep results written to {sweep_out}")
+    return results
+
+
+def print_run_summary(stats):
+    total_packets_sent = stats['sent']
+    total_exp_runtime = stats['send_time']
+    avg_req_ps = total_packets_sent / total_exp_runtime if total_exp_runtime else 0
     
-    print("Finished sending all packets!")
+    if stats['aborted']:
+        print("Run aborted: live p99 RCT stayed above the abort threshold")
+    else:
+        print("Finished sending all packets!")
     print(f"Total packets sent: {total_packets_sent}")
+    print(f"Send errors: {stats['errors']} (rejected by admission control: {stats['rejected']}, "
+          f"timeouts: {stats['timeouts']})")
     print(f"Total exp runtime: {total_exp_runtime}")
     print(f"Average requests per second: {avg_req_ps}")
-    #Wait for all tasks to complete
-    executor.shutdown(wait=True)
-    #Wait for log thread to complete
-    time.sleep(5)
-    # log_queue.put(None)
-    # log_thread.join()
-
-    # Query all node for status by sending http request to sl_test.py service
-    # nodes is a list of all containers running in stack
+    if total_packets_sent:
+        print(f"Send lag behind schedule (ms): mean {stats['total_lag_us'] / total_packets_sent / 1000:.3f}, "
+              f"max {stats['max_lag_us'] / 1000:.3f}")
+    latency = stats['latency_hist'].summary_ms()
+    print(f"Send latency (ms): p50 {latency['p50']:.3f}, p90 {latency['p90']:.3f}, "
+          f"p99 {latency['p99']:.3f}, max {latency['max']:.3f}")
+    if 'rct_hist' in stats:
+        rct = stats['rct_hist'].summary_ms()
+        print(f"Completed requests: {stats['completed']}, never completed: {len(stats['incomplete'])}")
+        print(f"Request completion time (ms): p50 {rct['p50']:.3f}, p90 {rct['p90']:.3f}, "
+              f"p99 {rct['p99']:.3f}, max {rct['max']:.3f}")
+
+def write_incomplete_tids(incomplete):
+    incomplete_file = os.path.join(log_directory, f"incomplete_tids_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(incomplete_file, 'w') as f:
+        f.writelines(f"{tid}\n" for tid in incomplete)
+    print(f"Tids that never completed written to {incomplete_file}")
+
+
+def main():
+    args = parse_args()
+    # nodes is a list of all SL containers running in stack
     nodes = os.getenv('SL_NODES').split(',')
-    try:
-        for i in nodes:
-            while True:
-                try:
-                    # Send a GET request to check the status of each node
-                    with requests.get(f"http://{i}:5000/status") as response:
-                        response.raise_for_status()
-                        match = re.search(r"Alive request count: (\d+)", response.text)
-                        if match:
-                            alive_request_count = int(match.group(1))
-                            # If the alive request count is greater than zero, print it
-                            if alive_request_count > 0:
-                                print(f"Node {i} has alive request count: {alive_request_count}")
-                            else:
-                                break  # Exit loop if count is zero and move to the next node
-                except requests.exceptions.RequestException as e:
-                    print(f"Error with node {i}: {e}")
-                    break  
+    wait_for_all_ready(nodes)
 
-    except Exception as e:
-        print("An error occurred:", e)
+    print(f"Running with rps: {args.rps} ({args.arrival}), max in flight: {args.max_inflight or 'unbounded'}, "
+          f"workers: {args.workers}, wire format: {wire_format}, packet mode: {packet_mode}")
+
+    drained = False
+    if args.sweep:
+        results = run_sweep(args)
+        drained = completion_tracking and all(step.get('incomplete') == 0 for step in results['steps'])
+    else:
+        stats = run_packets(args, args.rps)
+        print_run_summary(stats)
+        if stats.get('incomplete'):
+            write_incomplete_tids(stats['incomplete'])
+        drained = 'incomplete' in stats and not stats['incomplete']
+
+    # Every tid reported complete: nothing left in flight. Otherwise fall back to /status
+    if not drained:
+        sweep_status(nodes)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,126 @@
+'''
+Admission control for trace packets arriving at an SL node.
+
+At most ADMISSION_MAX_INFLIGHT packets are processed at once and up to
+ADMISSION_QUEUE_LEN more wait for a slot (FIFO). When both are full the
+policy decides what happens to a new packet:
+    reject       answered with ADMISSION_REJECT_STATUS (429 or 503), not processed
+    drop_oldest  the longest waiting packet is shed and the new one queued
+                 (the sender of the shed packet already got its 200)
+    block        the handler waits for queue space before answering, so the
+                 sender (client or upstream SL node) is slowed down instead
+
+Configured through env (set by container_setup.py):
+    ADMISSION_MAX_INFLIGHT   0 (off, every packet runs right away) or max in flight
+    ADMISSION_QUEUE_LEN      packets waiting for a slot
+    ADMISSION_POLICY         reject, drop_oldest or block
+    ADMISSION_REJECT_STATUS  status code for rejected packets
+'''
+import os
+import time
+import asyncio
+from collections import deque
+
+MAX_INFLIGHT = int(os.getenv('ADMISSION_MAX_INFLIGHT', '0'))
+QUEUE_LEN = int(os.getenv('ADMISSION_QUEUE_LEN', '0'))
+POLICY = os.getenv('ADMISSION_POLICY', 'reject')
+REJECT_STATUS = int(os.getenv('ADMISSION_REJECT_STATUS', '429'))
+POLICIES = ('reject', 'drop_oldest', 'block')
+
+
+class AdmissionController:
+    def __init__(self, max_inflight=MAX_INFLIGHT, queue_len=QUEUE_LEN, policy=POLICY):
+        if policy not in POLICIES:
+            raise ValueError(f"Unsupported admission policy: {policy}")
+        self.max_inflight = max_inflight
+        self.queue_len = queue_len
+        self.policy = policy
+        self.inflight = 0
+        self.waiting = deque() # futures of queued packets: True once given a slot, False if dropped
+        self.space = asyncio.Event() # set when a queued packet leaves the queue (block policy)
+        self.rejected = 0
+        self.dropped = 0
+        self.blocked = 0
+
+    def enabled(self):
+        return self.max_inflight > 0
+
+    def pop_waiting(self):
+        '''Oldest queued slot still waiting, skipping ones whose handler was cancelled'''
+        while self.waiting:
+            slot = self.waiting.popleft()
+            if not slot.done():
+                return slot
+        return None
+
+    def queue_full(self):
+        return self.inflight >= self.max_inflight and len(self.waiting) >= self.queue_len
+
+    async def admit(self):
+        '''
+        Returns a future resolving to True once the packet holds a slot (False
+        if it was dropped while queued), or None if the packet is rejected.
+        '''
+        slot = asyncio.get_running_loop().create_future()
+        if self.policy == 'block' and self.queue_full():
+            self.blocked += 1
+            while self.queue_full():
+                self.space.clear()
+                await self.space.wait()
+        if self.inflight < self.max_inflight and not self.waiting:
+            self.inflight += 1
+            slot.set_result(True)
+        elif len(self.waiting) < self.queue_len:
+            self.waiting.append(slot)
+        elif self.policy == 'drop_oldest':
+            self.dropped += 1
+            oldest = self.pop_waiting()
+            if oldest is not None:
+                oldest.set_result(False)
+                self.waiting.append(slot)
+            else: # no queue: the new packet is the oldest waiting one
+                slot.set_result(False)
+        else:
+            self.rejected += 1
+            return None
+        return slot
+
+    def release(self):
+        '''Frees the caller's slot and hands it to the next queued packet'''
+        self.inflight -= 1
+        slot = self.pop_waiting()
+        if slot is not None:
+            self.inflight += 1
+            slot.set_result(True)
+        self.space.set()
+
+    def abandon(self, slot):
+        '''For a handler cancelled while waiting: gives up its queue place or its slot'''
+        if slot.done() and not slot.cancelled():
+            if slot.result():
+                self.release() # granted just before the cancellation landed
+            return
+        try:
+            self.waiting.remove(slot)
+        except ValueError:
+            pass
+        self.space.set()
+
+
+async def run_admitted(admission, slot, wait_seconds, coro):
+    '''Waits for the packet's slot, then runs coro; a dropped packet's coro is closed unrun'''
+    st = time.perf_counter()
+    try:
+        admitted = await slot
+    except asyncio.CancelledError:
+        coro.close()
+        admission.abandon(slot)
+        raise
+    if not admitted:
+        coro.close()
+        return
+    wait_seconds.observe(time.perf_counter() - st)
+    try:
+        await coro
+    finally:
+        admission.release()
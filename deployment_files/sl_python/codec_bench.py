@@ -0,0 +1,87 @@
+'''
+Microbenchmark: JSON vs binary trace packet codec.
+
+Reports average bytes on the wire and encode/decode CPU per packet. Every SL
+hop decodes the packet once and (with raw forwarding) never re-encodes it,
+so size and hop decode time are the per-hop costs. A JSON hop parses the
+whole packet; a binary hop only decodes its own node view.
+
+Usage: python3 codec_bench.py [all_trace_packets.json] [max_packets]
+'''
+import sys
+import json
+import time
+import random
+
+from trace_codec import encode_packet, decode_packet, decode_node_view
+
+
+def gen_synthetic_packets(n, n_nodes=500, calls_per_packet=20, seed=50):
+    '''Packets shaped like enrichment output, for running without an enrichment run'''
+    rng = random.Random(seed)
+    packets = {}
+    for i in range(n):
+        tid = f"T{i:08d}"
+        node_calls_dict = {}
+        data_ops_dict = {}
+        op_id = 1
+        for _ in range(calls_per_packet):
+            caller = f"n{rng.randrange(n_nodes)}"
+            callee = f"n{rng.randrange(n_nodes)}"
+            if rng.random() < 0.5:
+                data_ops_dict[str(op_id)] = {'op_id': op_id, 'op_type': rng.choice(['read', 'write']),
+                                             'op_obj_id': f"key_{rng.randrange(1, 1001)}",
+                                             'db': rng.choice(['MongoDB', 'Redis', 'Postgres']),
+                                             'op_obj_size': rng.randrange(1, 1001)}
+                node_calls_dict.setdefault(caller, []).append([callee, op_id, rng.randrange(2)])
+                op_id += 1
+            else:
+                node_calls_dict.setdefault(caller, []).append([callee, -1, rng.randrange(2)])
+        packets[tid] = {'tid': tid, 'node_calls_dict': node_calls_dict, 'data_ops_dict': data_ops_dict,
+                        'initial_node': next(iter(node_calls_dict)), 'initial_node_type': 'Python',
+                        'logger_nodes': list(node_calls_dict)[:2]}
+    return packets
+
+
+def time_per_packet(fn, items, repeat=3):
+    '''Best of repeat runs, microseconds per item'''
+    best = float('inf')
+    for _ in range(repeat):
+        st = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - st)
+    return best / len(items) * 1e6
+
+
+def run_bench(packets):
+    packets = list(packets)
+    json_bufs = [json.dumps(p).encode('utf-8') for p in packets]
+    bin_bufs = [encode_packet(p) for p in packets]
+    assert all(decode_packet(b) == json.loads(j) for b, j in zip(bin_bufs[:100], json_bufs[:100]))
+
+    json_bytes = sum(len(b) for b in json_bufs) / len(packets)
+    bin_bytes = sum(len(b) for b in bin_bufs) / len(packets)
+    json_enc = time_per_packet(lambda p: json.dumps(p).encode('utf-8'), packets)
+    bin_enc = time_per_packet(encode_packet, packets)
+    json_dec = time_per_packet(json.loads, json_bufs)
+    bin_dec = time_per_packet(decode_packet, bin_bufs)
+    hop_items = [(b, p['initial_node']) for b, p in zip(bin_bufs, packets)]
+    bin_hop = time_per_packet(lambda item: decode_node_view(*item), hop_items)
+
+    print(f"Packets: {len(packets)}")
+    print(f"{'':8}{'bytes/pkt':>12}{'encode us':>12}{'decode us':>12}{'hop us':>12}")
+    print(f"{'json':8}{json_bytes:12.1f}{json_enc:12.2f}{json_dec:12.2f}{json_dec:12.2f}")
+    print(f"{'binary':8}{bin_bytes:12.1f}{bin_enc:12.2f}{bin_dec:12.2f}{bin_hop:12.2f}")
+    print(f"Per hop saved: {json_bytes - bin_bytes:.1f} bytes ({1 - bin_bytes / json_bytes:.1%}), "
+          f"{json_dec - bin_hop:.2f} us decode")
+
+
+if __name__ == '__main__':
+    max_packets = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    if len(sys.argv) > 1 and sys.argv[1]:
+        with open(sys.argv[1], 'r') as f:
+            packets = list(json.load(f).values())[:max_packets]
+    else:
+        packets = gen_synthetic_packets(max_packets).values()
+    run_bench(packets)
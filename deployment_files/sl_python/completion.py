@@ -0,0 +1,136 @@
+'''
+Push-based request completion tracking.
+
+The client sends each packet with X-Mewbie-Collector (host:port of its
+collector); SL hops forward it with the span headers. A logger node that
+finishes a tid queues (tid, nid, time us) on its CompletionReporter, which
+POSTs batches to the collector. On the client, CompletionTracker knows each
+sent tid's logger nodes and intended send time; a tid is complete once all
+of its logger nodes reported, with RCT = last report - intended send time
+(same definition as the analysis notebook). wait_drained() is the end of run
+barrier and returns the tids that never completed.
+'''
+import asyncio
+import logging
+
+from aiohttp import web
+
+from latency_histogram import LatencyHistogram
+
+COMPLETIONS_PATH = '/completions'
+REPORT_BATCH = 256 # completions per POST
+REPORT_INTERVAL = 0.1 # seconds a completion may wait for its batch
+
+
+##################### SL side #################################
+class CompletionReporter:
+    def __init__(self, session, batch=REPORT_BATCH, interval=REPORT_INTERVAL):
+        self.session = session
+        self.batch = batch
+        self.interval = interval
+        self.pending = {} # key: collector host:port, value: list of [tid, nid, ts_us]
+        self.n_pending = 0
+        self.reported = 0
+        self.failed = 0
+        self.wake = asyncio.Event()
+        self.closing = False
+        self.task = None
+
+    def add(self, collector, tid, nid, ts_us):
+        self.pending.setdefault(collector, []).append([tid, nid, ts_us])
+        self.n_pending += 1
+        if self.n_pending >= self.batch:
+            self.wake.set()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def post(self, collector, completions):
+        try:
+            async with self.session.post(f"http://{collector}{COMPLETIONS_PATH}", json=completions) as response:
+                await response.read()
+                response.raise_for_status()
+            self.reported += len(completions)
+        except Exception as e:
+            self.failed += len(completions)
+            logging.error(f"Failed to report {len(completions)} completions to {collector}: {e}")
+
+    async def flush(self):
+        pending, self.pending, self.n_pending = self.pending, {}, 0
+        if pending:
+            await asyncio.gather(*[self.post(collector, completions) for collector, completions in pending.items()])
+
+    async def run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush()
+
+    async def close(self):
+        self.closing = True
+        if self.task is not None:
+            self.wake.set()
+            await self.task
+        await self.flush()
+
+
+##################### Client side #################################
+class CompletionTracker:
+    def __init__(self):
+        self.expected = {} # key: tid, value: [logger nodes still to report, intended send us, last report us]
+        self.rct_hist = LatencyHistogram()
+        self.completed = 0
+        self.unexpected = 0 # reports for unknown tids or logger nodes (duplicates, other runs)
+        self.drained = asyncio.Event()
+        self.drained.set()
+
+    def register(self, tid, logger_nodes, intended_us):
+        if not logger_nodes:
+            return
+        self.expected[tid] = [set(logger_nodes), intended_us, 0]
+        self.drained.clear()
+
+    def abandon(self, tid):
+        '''Stops waiting for a tid that can never complete (its packet was rejected)'''
+        if self.expected.pop(tid, None) is not None and not self.expected:
+            self.drained.set()
+
+    def complete(self, tid, nid, ts_us):
+        entry = self.expected.get(tid)
+        if entry is None or nid not in entry[0]:
+            self.unexpected += 1
+            return
+        entry[0].discard(nid)
+        entry[2] = max(entry[2], ts_us)
+        if not entry[0]:
+            del self.expected[tid]
+            self.completed += 1
+            self.rct_hist.record(entry[2] - entry[1])
+            if not self.expected:
+                self.drained.set()
+
+    async def wait_drained(self, timeout):
+        '''Waits until every registered tid completed or timeout (s) passes; returns incomplete tids'''
+        try:
+            await asyncio.wait_for(self.drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return sorted(self.expected)
+
+
+async def start_collector(tracker, port):
+    '''Serves POST /completions for the tracker; returns the runner (cleanup() to stop)'''
+    async def completions_handler(request):
+        for tid, nid, ts_us in await request.json():
+            tracker.complete(tid, nid, ts_us)
+        return web.Response(text="ok", status=200)
+
+    app = web.Application()
+    app.router.add_post(COMPLETIONS_PATH, completions_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    return runner
@@ -0,0 +1,193 @@
+'''
+Per SF node micro-batching for the datastore shims.
+
+Ops for the same (db, SF node, op type) arriving within a short window are
+coalesced into one round trip:
+    Redis:    pipelined SET / MGET
+    Postgres: executemany (COPY for large batches) / SELECT ... WHERE key = ANY($1)
+    MongoDB:  bulk_write / find with $in per field
+Every caller awaits its own future and gets back its own result.
+
+Configured through env (set by container_setup.py):
+    DB_BATCH_NODES      '' (off), 'all' or comma separated SF node ids
+    DB_BATCH_WINDOW_MS  max time an op waits for its batch to fill
+    DB_BATCH_MAX        batch is flushed as soon as it reaches this size
+'''
+import os
+import time
+import asyncio
+import logging
+from pymongo import InsertOne
+
+BATCH_NODES = os.getenv('DB_BATCH_NODES', '')
+BATCH_WINDOW = float(os.getenv('DB_BATCH_WINDOW_MS', '2')) / 1000
+BATCH_MAX = int(os.getenv('DB_BATCH_MAX', '64'))
+PG_COPY_MIN_BATCH = 32 # COPY beats executemany past this many rows
+PG_TABLE = "mewbie_table"
+
+batch_node_set = set(n for n in BATCH_NODES.split(',') if n)
+
+
+def batching_enabled(sf_node):
+    return BATCH_NODES == 'all' or sf_node in batch_node_set
+
+
+class OpStats:
+    '''Running count/sum/max of a value (ms or ops), cheap enough for the hot path.'''
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else 0.0, 'max': self.max}
+
+
+# key: "db:op", value: dict of OpStats. Batched and direct paths are tracked side by side.
+batch_stats = {}
+direct_stats = {}
+
+
+def get_stats(stats_map, db_name, op):
+    key = f"{db_name}:{op}"
+    if key not in stats_map:
+        stats_map[key] = {'batch_size': OpStats(), 'queue_delay_ms': OpStats(), 'op_latency_ms': OpStats()}
+    return stats_map[key]
+
+
+def record_direct_op(db_name, op, latency_ms):
+    get_stats(direct_stats, db_name, op)['op_latency_ms'].add(latency_ms)
+
+
+def stats_snapshot():
+    return {
+        'batched': {k: {name: s.to_dict() for name, s in v.items()} for k, v in batch_stats.items()},
+        'direct': {k: {name: s.to_dict() for name, s in v.items()} for k, v in direct_stats.items()}
+    }
+
+
+class OpBatcher:
+    '''Collects ops for one (db, SF node, op type) and flushes them as one round trip.'''
+    def __init__(self, db_name, op, flush_func):
+        self.flush_func = flush_func # async (client, items) -> list of per item results
+        self.stats = get_stats(batch_stats, db_name, op)
+        self.pending = [] # (item, future, enqueue time)
+        self.flush_timer = None
+        self.flush_tasks = set()
+
+    async def submit(self, client, item):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.pending.append((item, fut, time.perf_counter()))
+        if len(self.pending) >= BATCH_MAX:
+            self.flush(client)
+        elif self.flush_timer is None:
+            self.flush_timer = loop.call_later(BATCH_WINDOW, self.flush, client)
+        return await fut
+
+    def flush(self, client):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self.run_batch(client, batch))
+            self.flush_tasks.add(task)
+            task.add_done_callback(self.flush_tasks.discard)
+
+    async def run_batch(self, client, batch):
+        flush_start = time.perf_counter()
+        self.stats['batch_size'].add(len(batch))
+        for _, _, enqueued in batch:
+            self.stats['queue_delay_ms'].add((flush_start - enqueued) * 1000)
+        try:
+            results = await self.flush_func(client, [item for item, _, _ in batch])
+        except Exception as e:
+            logging.error(f"Batch flush failed ({len(batch)} ops): {e}")
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        done = time.perf_counter()
+        for (_, fut, enqueued), result in zip(batch, results):
+            self.stats['op_latency_ms'].add((done - enqueued) * 1000)
+            if not fut.done():
+                fut.set_result(result)
+
+
+##################### Batch flush funcs #################################
+# items are (key, value) pairs; results line up with items
+
+async def redis_write_batch(client, items):
+    pipe = client.pipeline(transaction=False)
+    for key, value in items:
+        pipe.set(key, value)
+    return await pipe.execute()
+
+
+async def redis_read_batch(client, items):
+    return await client.mget([key for key, _ in items])
+
+
+async def postgres_write_batch(client, items):
+    if len(items) >= PG_COPY_MIN_BATCH:
+        await client.copy_records_to_table(PG_TABLE, records=items, columns=['key', 'value'])
+    else:
+        await client.executemany(f"INSERT INTO {PG_TABLE} (key, value) VALUES ($1, $2)", items)
+    return [True] * len(items)
+
+
+async def postgres_read_batch(client, items):
+    keys = list(set(key for key, _ in items))
+    rows = await client.fetch(f"SELECT * FROM {PG_TABLE} WHERE key = ANY($1::text[])", keys)
+    first_row = {}
+    for row in rows:
+        first_row.setdefault(row['key'], row)
+    return [first_row.get(key) for key, _ in items]
+
+
+async def mongo_write_batch(collection, items):
+    docs = [{key: value} for key, value in items]
+    await collection.bulk_write([InsertOne(doc) for doc in docs], ordered=False)
+    return [doc.get('_id') for doc in docs]
+
+
+async def mongo_read_batch(collection, items):
+    # Each read matches {key: value}; group values per field so each field is one $in
+    values_by_key = {}
+    for key, value in items:
+        values_by_key.setdefault(key, set()).add(value)
+    query = {'$or': [{key: {'$in': list(values)}} for key, values in values_by_key.items()]}
+    found = {}
+    async for doc in collection.find(query):
+        for key, values in values_by_key.items():
+            if doc.get(key) in values:
+                found.setdefault((key, doc[key]), doc)
+    return [found.get((key, value)) for key, value in items]
+
+
+FLUSH_FUNCS = {
+    ('Redis', 'write'): redis_write_batch,
+    ('Redis', 'read'): redis_read_batch,
+    ('Postgres', 'write'): postgres_write_batch,
+    ('Postgres', 'read'): postgres_read_batch,
+    ('MongoDB', 'write'): mongo_write_batch,
+    ('MongoDB', 'read'): mongo_read_batch,
+}
+
+batchers = {} # key: (db, sf node, op), value: OpBatcher
+
+
+async def submit_batched(db_name, sf_node, op, client, key, value):
+    '''Queues one op on the SF node's batcher and returns its own result.'''
+    batcher_key = (db_name, sf_node, op)
+    batcher = batchers.get(batcher_key)
+    if batcher is None:
+        batcher = batchers[batcher_key] = OpBatcher(db_name, op, FLUSH_FUNCS[(db_name, op)])
+    return await batcher.submit(client, (key, value))
@@ -0,0 +1,173 @@
+'''
+Pooled datastore clients for the SL shims, with pool-wait statistics.
+
+    Postgres: asyncpg pool (TimedPgPool times every acquire)
+    Redis:    BlockingConnectionPool capped at the pool size (TimedRedisPool)
+    MongoDB:  Motor client with maxPoolSize/minPoolSize set; checkout waits
+              come from a pymongo ConnectionPoolListener
+
+Pool sizes come from env (set by container_setup.py):
+    DB_POOL_SIZES      e.g. 'Postgres=4,Redis=8,MongoDB=8'
+    DB_POOL_HOT_SIZE   pool size towards nodes in DB_POOL_HOT_NODES
+    DB_POOL_HOT_NODES  comma separated SF node ids
+'''
+import os
+import time
+import threading
+
+import asyncpg
+import motor.motor_asyncio
+import redis.asyncio as redis
+from pymongo import monitoring
+
+from db_batcher import OpStats
+
+DEFAULT_POOL_SIZES = {'Postgres': 4, 'Redis': 8, 'MongoDB': 8}
+POOL_ACQUIRE_TIMEOUT = float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+
+def parse_pool_sizes(spec):
+    sizes = dict(DEFAULT_POOL_SIZES)
+    for entry in spec.split(','):
+        if '=' in entry:
+            db_name, size = entry.split('=')
+            sizes[db_name.strip()] = int(size)
+    return sizes
+
+POOL_SIZES = parse_pool_sizes(os.getenv('DB_POOL_SIZES', ''))
+HOT_POOL_SIZE = int(os.getenv('DB_POOL_HOT_SIZE', '0'))
+HOT_NODES = set(n for n in os.getenv('DB_POOL_HOT_NODES', '').split(',') if n)
+
+
+def pool_size_for(db_name, sf_node):
+    if sf_node in HOT_NODES and HOT_POOL_SIZE > 0:
+        return HOT_POOL_SIZE
+    return POOL_SIZES[db_name]
+
+
+##################### Pool wait stats #################################
+pool_wait_stats = {} # key: "db:sf_node", value: OpStats of wait time in ms
+pool_sizes_in_use = {} # key: "db:sf_node", value: configured pool size
+stats_lock = threading.Lock() # Mongo checkouts are reported from Motor's worker threads
+
+def record_pool_wait(db_name, sf_node, wait_ms):
+    key = f"{db_name}:{sf_node}"
+    with stats_lock:
+        if key not in pool_wait_stats:
+            pool_wait_stats[key] = OpStats()
+        pool_wait_stats[key].add(wait_ms)
+
+def pool_stats_snapshot():
+    with stats_lock:
+        return {key: dict(stats.to_dict(), size=pool_sizes_in_use.get(key))
+                for key, stats in pool_wait_stats.items()}
+
+
+##################### Postgres #################################
+class TimedPgPool:
+    '''asyncpg pool exposing the connection methods the shims use, timing each acquire.'''
+    def __init__(self, pool, sf_node):
+        self.pool = pool
+        self.sf_node = sf_node
+
+    async def _run(self, method, *args, **kwargs):
+        st = time.perf_counter()
+        async with self.pool.acquire(timeout=POOL_ACQUIRE_TIMEOUT) as con:
+            record_pool_wait("Postgres", self.sf_node, (time.perf_counter() - st) * 1000)
+            return await getattr(con, method)(*args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        return await self._run('execute', *args, **kwargs)
+
+    async def executemany(self, *args, **kwargs):
+        return await self._run('executemany', *args, **kwargs)
+
+    async def fetch(self, *args, **kwargs):
+        return await self._run('fetch', *args, **kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        return await self._run('fetchrow', *args, **kwargs)
+
+    async def copy_records_to_table(self, *args, **kwargs):
+        return await self._run('copy_records_to_table', *args, **kwargs)
+
+    async def close(self):
+        await self.pool.close()
+
+
+async def create_pg_client(sf_node, dm_ip, dm_port):
+    size = pool_size_for("Postgres", sf_node)
+    pool_sizes_in_use[f"Postgres:{sf_node}"] = size
+    pool = await asyncpg.create_pool(
+        user="pguser",
+        password="pgpass",
+        host=dm_ip,
+        port=dm_port,
+        database="pg_db",
+        min_size=1,
+        max_size=size
+    )
+    return TimedPgPool(pool, sf_node)
+
+
+##################### Redis #################################
+class TimedRedisPool(redis.BlockingConnectionPool):
+    '''Blocks (up to POOL_ACQUIRE_TIMEOUT) instead of opening extra connections, timing each wait.'''
+    def __init__(self, sf_node, **kwargs):
+        super().__init__(**kwargs)
+        self.sf_node = sf_node
+
+    async def get_connection(self, *args, **kwargs):
+        st = time.perf_counter()
+        connection = await super().get_connection(*args, **kwargs)
+        record_pool_wait("Redis", self.sf_node, (time.perf_counter() - st) * 1000)
+        return connection
+
+
+def create_redis_client(sf_node, dm_ip, dm_port):
+    size = pool_size_for("Redis", sf_node)
+    pool_sizes_in_use[f"Redis:{sf_node}"] = size
+    pool = TimedRedisPool(sf_node, host=dm_ip, port=dm_port, max_connections=size,
+                          timeout=POOL_ACQUIRE_TIMEOUT)
+    return redis.Redis(connection_pool=pool)
+
+
+##################### MongoDB #################################
+class MongoPoolWaitListener(monitoring.ConnectionPoolListener):
+    '''Check-out start and end are reported on the same Motor worker thread.'''
+    def __init__(self, sf_node):
+        self.sf_node = sf_node
+        self.local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self.local, 'started', None)
+        if started is not None:
+            record_pool_wait("MongoDB", self.sf_node, (time.perf_counter() - started) * 1000)
+            self.local.started = None
+
+    def connection_check_out_failed(self, event):
+        self.local.started = None
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_checked_in(self, event): pass
+
+
+def create_mongo_client(sf_node, dm_ip, dm_port):
+    size = pool_size_for("MongoDB", sf_node)
+    pool_sizes_in_use[f"MongoDB:{sf_node}"] = size
+    return motor.motor_asyncio.AsyncIOMotorClient(
+        dm_ip, dm_port,
+        maxPoolSize=size,
+        minPoolSize=min(2, size),
+        maxConnecting=min(4, size),
+        waitQueueTimeoutMS=int(POOL_ACQUIRE_TIMEOUT * 1000),
+        event_listeners=[MongoPoolWaitListener(sf_node)]
+    )
@@ -0,0 +1,115 @@
+'''
+Mergeable log-linear latency histogram (HDR style).
+
+Values (integer microseconds) below 128 get their own bucket; above that every
+power of two is split into 64 buckets, so any recorded value is reported
+within ~1.6% while memory only grows with the log of the largest value.
+Histograms from different processes merge exactly by adding bucket counts,
+and to_dict()/from_dict() carry them across processes or into JSON files.
+Live percentiles come from cumulative snapshots: difference() of two
+snapshots of the same histogram is the histogram of the values recorded in
+between, so a poller needs no reset on the recording side and memory stays
+constant however long the run.
+'''
+SUB_BITS = 7
+SUB_COUNT = 1 << SUB_BITS # values below this are exact
+HALF_COUNT = SUB_COUNT >> 1
+
+
+def bucket_index(value):
+    if value < SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return (shift << (SUB_BITS - 1)) + (value >> shift)
+
+
+def bucket_bounds(idx):
+    '''(lowest, highest) value falling into bucket idx'''
+    if idx < SUB_COUNT:
+        return idx, idx
+    shift = (idx >> (SUB_BITS - 1)) - 1
+    low = (idx - (shift << (SUB_BITS - 1))) << shift
+    return low, low + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = {} # key: bucket index, value: count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value_us):
+        value_us = max(int(value_us), 0)
+        idx = bucket_index(value_us)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.total += value_us
+        if self.min is None or value_us < self.min:
+            self.min = value_us
+        if self.max is None or value_us > self.max:
+            self.max = value_us
+
+    def merge(self, other):
+        for idx, n in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def copy(self):
+        return LatencyHistogram().merge(self)
+
+    def difference(self, earlier):
+        '''Values recorded since the earlier snapshot of this histogram; min/max are bucket bounds'''
+        diff = LatencyHistogram()
+        for idx, n in self.counts.items():
+            n -= earlier.counts.get(idx, 0)
+            if n > 0:
+                diff.counts[idx] = n
+        diff.count = self.count - earlier.count
+        diff.total = self.total - earlier.total
+        if diff.counts:
+            diff.min = max(bucket_bounds(min(diff.counts))[0], self.min)
+            diff.max = min(bucket_bounds(max(diff.counts))[1], self.max)
+        return diff
+
+    def percentile(self, pct):
+        '''Value at percentile pct (0-100), as the midpoint of its bucket clamped to [min, max]'''
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * pct // 100)) # ceil without floats
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                low, high = bucket_bounds(idx)
+                return min(max((low + high) // 2, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def summary_ms(self):
+        return {'count': self.count, 'mean': self.mean() / 1000,
+                'p50': self.percentile(50) / 1000, 'p90': self.percentile(90) / 1000,
+                'p99': self.percentile(99) / 1000, 'max': (self.max or 0) / 1000}
+
+    def to_dict(self):
+        return {'counts': {str(idx): n for idx, n in self.counts.items()}, 'count': self.count,
+                'total': self.total, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls()
+        hist.counts = {int(idx): n for idx, n in data['counts'].items()}
+        hist.count = data['count']
+        hist.total = data['total']
+        hist.min = data['min']
+        hist.max = data['max']
+        return hist
@@ -0,0 +1,186 @@
+'''
+Minimal Prometheus metrics for the SL service (text exposition format 0.0.4).
+
+Hand-rolled instead of prometheus_client to keep the hot path to a bisect and
+two increments per observation, with no locks (everything runs on the event
+loop). Label cardinality is bounded: past MAX_LABEL_SETS distinct label values
+a metric folds new ones into a single 'other' series.
+
+With SL worker processes (sl_workers.py) every worker keeps its own registry;
+snapshot() exports one as JSON and render() merges sibling snapshots in:
+counters and histograms add up, gauges add up or take the max (merge='max').
+'''
+import time
+import asyncio
+from bisect import bisect_left
+
+MAX_LABEL_SETS = 256
+# Seconds; 250us .. 10s, covers shim ops through saturated RCT hops
+DEFAULT_BUCKETS = (0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, labelvalues, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.series = {} # key: label values tuple
+
+    def _series_key(self, labelvalues):
+        if labelvalues in self.series or len(self.series) < MAX_LABEL_SETS:
+            return labelvalues
+        return ('other',) * len(self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+    def collect(self):
+        '''key: label values tuple, value: current value'''
+        return dict(self.series)
+
+    def merge_value(self, a, b):
+        return a + b
+
+    def merged(self, peer_series):
+        '''This metric's series merged with peers' snapshot series ([[labels, value], ...] lists)'''
+        series = self.collect()
+        for peer in peer_series:
+            for labelvalues, value in peer:
+                key = tuple(labelvalues)
+                series[key] = self.merge_value(series[key], value) if key in series else value
+        return series
+
+    def render(self, series):
+        lines = self.header()
+        for labelvalues, value in series.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    '''Either inc() explicitly or backed by a callback returning a running total, read at scrape time.'''
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=(), func=None):
+        super().__init__(name, help_text, labelnames)
+        self.func = func
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._series_key(labelvalues)
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def collect(self):
+        series = dict(self.series)
+        if self.func is not None:
+            series[()] = self.func()
+        return series
+
+
+class Gauge(Metric):
+    '''Either set() explicitly or backed by a callback read at scrape time.'''
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=(), func=None, merge='sum'):
+        super().__init__(name, help_text, labelnames)
+        self.func = func
+        self.merge = merge
+
+    def set(self, value, *labelvalues):
+        self.series[self._series_key(labelvalues)] = value
+
+    def collect(self):
+        series = dict(self.series)
+        if self.func is not None:
+            series[()] = self.func()
+        return series
+
+    def merge_value(self, a, b):
+        return max(a, b) if self.merge == 'max' else a + b
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        key = self._series_key(labelvalues)
+        series = self.series.get(key)
+        if series is None:
+            # per bucket (non cumulative) counts, last slot is +Inf; then sum
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def merge_value(self, a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1]]
+
+    def render(self, series):
+        lines = self.header()
+        for labelvalues, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def snapshot(self):
+        '''JSON-able {metric name: [[label values, value], ...]}'''
+        return {metric.name: [[list(labelvalues), value] for labelvalues, value in metric.collect().items()]
+                for metric in self.metrics}
+
+    def render(self, peer_snapshots=()):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(metric.merged([peer.get(metric.name, []) for peer in peer_snapshots])))
+        return '\n'.join(lines) + '\n'
+
+
+async def monitor_loop_lag(gauge, histogram=None, interval=0.5):
+    '''Event loop lag: how late a timer scheduled interval seconds ahead actually fires.'''
+    while True:
+        st = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(time.perf_counter() - st - interval, 0.0)
+        gauge.set(lag)
+        if histogram is not None:
+            histogram.observe(lag)
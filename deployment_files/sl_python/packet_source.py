@@ -0,0 +1,229 @@
+'''
+Streaming trace packet source for the client.
+
+Packets are read lazily from one of two on-disk formats written by enrichment:
+    all_trace_packets.jsonl  one JSON packet per line
+    all_trace_packets.mwpk   length-prefixed binary packets (trace_codec)
+A reader thread parses ahead into a bounded queue of batches, so memory stays
+flat however many traces there are and the first packet goes out right away.
+The sender consumes it with `async for`, which never blocks the event loop.
+Each item is (tid, initial node, initial node type, body, content type,
+logger nodes); with jsonl the line itself is sent as the body, without
+re-encoding, and only its header fields are parsed (peek_jsonl_header). Logger
+nodes let the client track completions (completion.py).
+
+shard=(index, count) keeps every count-th packet starting at index, and
+begin/end restrict the stream to a range of packet positions; both are
+applied before parsing, so worker processes (and sweep steps) can each
+stream a disjoint set of tids cheaply. A range starting past 0 seeks to the
+nearest entry of a sparse byte offset index (packet_offsets, one pass over
+the file per process) instead of reading every earlier packet.
+'''
+import json
+import queue
+import asyncio
+import functools
+import threading
+
+from trace_codec import CONTENT_TYPE, JSON_CONTENT_TYPE, PACKET_FILE_MAGIC, U8, U32, \
+    peek_header, peek_logger_nodes, read_packet_file
+
+READ_BATCH = 256 # packets per queue item
+READ_AHEAD = 64 # batches buffered ahead of the sender
+STOP_POLL = 0.1 # s, how often blocked reader/consumer waits check for close()
+OFFSET_STRIDE = 4096 # packets between entries of the seek index
+
+
+def write_packet_lines(file_path, trace_packets):
+    '''trace_packets: iterable of packet dicts. Returns number of packets written.'''
+    count = 0
+    with open(file_path, 'w') as f:
+        for trace_packet in trace_packets:
+            f.write(json.dumps(trace_packet, separators=(',', ':')))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def in_shard(position, shard):
+    return shard is None or position % shard[1] == shard[0]
+
+
+@functools.lru_cache(maxsize=None)
+def packet_offsets(file_path):
+    '''Byte offsets of packets 0, OFFSET_STRIDE, 2 x OFFSET_STRIDE, ... of a .jsonl or .mwpk packet file'''
+    offsets = []
+    position = 0
+    with open(file_path, 'rb') as f:
+        if file_path.endswith('.mwpk'):
+            offset = f.seek(len(PACKET_FILE_MAGIC) + U8.size)
+            while True:
+                size_bytes = f.read(U32.size)
+                if len(size_bytes) < U32.size:
+                    break
+                if position % OFFSET_STRIDE == 0:
+                    offsets.append(offset)
+                position += 1
+                offset = f.seek(U32.unpack(size_bytes)[0], 1)
+        else:
+            offset = 0
+            for line in f:
+                if line.rstrip(b'\n'):
+                    if position % OFFSET_STRIDE == 0:
+                        offsets.append(offset)
+                    position += 1
+                offset += len(line)
+    return offsets
+
+
+def seek_point(file_path, begin):
+    '''(packet position, byte offset) of the indexed packet closest at or before begin, offset None for the start'''
+    if begin < OFFSET_STRIDE:
+        return 0, None
+    offsets = packet_offsets(file_path)
+    if not offsets:
+        return 0, None
+    idx = min(begin // OFFSET_STRIDE, len(offsets) - 1)
+    return idx * OFFSET_STRIDE, offsets[idx]
+
+
+HEADER_TAIL_KEY = b',"initial_node":'
+
+
+def peek_jsonl_header(line):
+    '''
+    (tid, initial node, initial node type, logger nodes) of a compact jsonl packet
+    without parsing its calls and data ops: enrichment writes tid first and these
+    three fields last. Falls back to a full parse for any other layout.
+    '''
+    tail = line.rfind(HEADER_TAIL_KEY)
+    if line.startswith(b'{"tid":') and tail > 0:
+        try:
+            tid = json.JSONDecoder().raw_decode(line[7:tail].decode('utf-8'))[0]
+            header = json.loads(b'{' + line[tail + 1:])
+            return tid, header['initial_node'], header['initial_node_type'], header['logger_nodes']
+        except (ValueError, KeyError):
+            pass
+    t_packet = json.loads(line)
+    return t_packet['tid'], t_packet['initial_node'], t_packet['initial_node_type'], t_packet['logger_nodes']
+
+
+def iter_jsonl_packets(file_path, packet_mode='full', shard=None, begin=0, end=None):
+    start, offset = seek_point(file_path, begin)
+    with open(file_path, 'rb') as f:
+        if offset is not None:
+            f.seek(offset)
+        position = start - 1
+        for line in f:
+            line = line.rstrip(b'\n')
+            if not line:
+                continue
+            position += 1
+            if end is not None and position >= end:
+                return
+            if position < begin or not in_shard(position, shard):
+                continue
+            tid, initial_node, initial_node_type, logger_nodes = peek_jsonl_header(line)
+            body = json.dumps({'tid': tid}) if packet_mode == 'ref' else line
+            yield tid, initial_node, initial_node_type, body, JSON_CONTENT_TYPE, logger_nodes
+
+
+def iter_binary_packets(file_path, packet_mode='full', shard=None, begin=0, end=None):
+    start, offset = seek_point(file_path, begin)
+    for position, buf in enumerate(read_packet_file(file_path, offset), start):
+        if end is not None and position >= end:
+            return
+        if position < begin or not in_shard(position, shard):
+            continue
+        tid, t_ini_cont, t_ini_type = peek_header(buf)
+        logger_nodes = peek_logger_nodes(buf)
+        if packet_mode == 'ref':
+            yield tid, t_ini_cont, t_ini_type, json.dumps({'tid': tid}), JSON_CONTENT_TYPE, logger_nodes
+        else:
+            yield tid, t_ini_cont, t_ini_type, buf, CONTENT_TYPE, logger_nodes
+
+
+class PacketSource:
+    '''
+    Iterates outgoing packets, parsed ahead by a reader thread into a bounded queue.
+    From an event loop use `async for`: batches are taken off the queue without
+    blocking the loop (waiting for the reader runs in the default executor).
+    close() stops the reader thread and joins it; call it when a run ends early.
+    '''
+    def __init__(self, packet_iter, read_batch=READ_BATCH, read_ahead=READ_AHEAD):
+        self.packet_iter = packet_iter
+        self.read_batch = read_batch
+        self.batches = queue.Queue(maxsize=read_ahead)
+        self.error = None
+        self.stopped = threading.Event()
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
+
+    def put(self, batch):
+        '''Blocks while the queue is full; False once the source is closed'''
+        while not self.stopped.is_set():
+            try:
+                self.batches.put(batch, timeout=STOP_POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read_loop(self):
+        batch = []
+        try:
+            for item in self.packet_iter:
+                batch.append(item)
+                if len(batch) >= self.read_batch:
+                    if not self.put(batch):
+                        return
+                    batch = []
+        except Exception as e:
+            self.error = e
+        if batch and not self.put(batch):
+            return
+        self.put(None) # end of stream
+
+    def get(self):
+        '''Next batch, None at end of stream or once the source is closed'''
+        while not self.stopped.is_set():
+            try:
+                batch = self.batches.get(timeout=STOP_POLL)
+            except queue.Empty:
+                continue
+            if batch is None and self.error is not None:
+                raise self.error
+            return batch
+        return None
+
+    def __iter__(self):
+        while True:
+            batch = self.get()
+            if batch is None:
+                return
+            yield from batch
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                batch = self.batches.get_nowait() # usually ready: the reader runs ahead
+                if batch is None and self.error is not None:
+                    raise self.error
+            except queue.Empty:
+                batch = await loop.run_in_executor(None, self.get)
+            if batch is None:
+                return
+            for item in batch:
+                yield item
+
+    def close(self):
+        self.stopped.set()
+        self.reader.join()
+
+
+def open_packet_source(file_path, packet_mode='full', shard=None, begin=0, end=None):
+    '''Picks the reader from the file extension (.jsonl or .mwpk).'''
+    if file_path.endswith('.mwpk'):
+        return PacketSource(iter_binary_packets(file_path, packet_mode, shard, begin, end))
+    return PacketSource(iter_jsonl_packets(file_path, packet_mode, shard, begin, end))
@@ -0,0 +1,206 @@
+'''
+Tid-indexed packet store for pass-by-reference trace packets.
+
+At deploy time build_packet_stores() splits all_trace_packets.json into one
+store file per SL node. A node's file only holds its slice of each packet:
+its own downstream calls, the data ops those calls reference and whether it
+is a logger node. SL containers mmap their file and resolve the bare tid
+sent on the wire instead of parsing the full packet at every hop.
+
+File layout (little endian):
+    header: magic b'MWPS', version u16, record count u32, tid width u16
+    index:  per record, sorted by tid -> tid bytes NUL padded to the tid width,
+            data offset u64, data len u32
+    data:   per record -> compact JSON slice {"calls": [...], "ops": {...}, "logger": 0/1}
+The index entries are fixed width, so lookups binary search them in the
+mapped file; nothing per tid is loaded into memory.
+'''
+import os
+import json
+import mmap
+import struct
+
+STORE_MAGIC = b'MWPS'
+STORE_VERSION = 2
+HEADER = struct.Struct('<4sHIH')
+INDEX_ENTRY = struct.Struct('<QI')
+
+
+def store_path(store_dir, nid):
+    return os.path.join(store_dir, f"{nid}.pstore")
+
+
+##################### Build (deploy time) #################################
+def slice_packet(trace_packet, nid):
+    '''Returns the part of a trace packet that node nid needs, or None if nid has nothing to do.'''
+    calls = trace_packet['node_calls_dict'].get(nid, [])
+    is_logger = nid in trace_packet['logger_nodes']
+    if not calls and not is_logger:
+        return None
+    data_ops_dict = trace_packet['data_ops_dict']
+    ops = {}
+    for call in calls:
+        if call[1] != -1:
+            ops[str(call[1])] = data_ops_dict[str(call[1])]
+    return {'calls': calls, 'ops': ops, 'logger': 1 if is_logger else 0}
+
+
+def get_sl_nodes(trace_packet):
+    '''SL nodes taking part in a trace: callers plus SL callees (op id -1).'''
+    sl_nodes = set(trace_packet['node_calls_dict'].keys())
+    for calls in trace_packet['node_calls_dict'].values():
+        for call in calls:
+            if call[1] == -1:
+                sl_nodes.add(call[0])
+    return sl_nodes
+
+
+def write_store(path, records):
+    '''records: list of (tid, slice_bytes)'''
+    records = sorted((tid.encode('utf-8'), data) for tid, data in records)
+    tid_width = max((len(tid_bytes) for tid_bytes, _ in records), default=0)
+    index = bytearray()
+    offset = 0
+    for tid_bytes, data in records:
+        index += tid_bytes.ljust(tid_width, b'\0')
+        index += INDEX_ENTRY.pack(offset, len(data))
+        offset += len(data)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, len(records), tid_width))
+        f.write(index)
+        for _, data in records:
+            f.write(data)
+
+
+def build_packet_stores(trace_packets_file, store_dir):
+    '''Splits all_trace_packets.json into per SL node store files. Returns number of stores written.'''
+    with open(trace_packets_file, 'r') as f:
+        all_trace_packets = json.load(f)
+    os.makedirs(store_dir, exist_ok=True)
+
+    node_records = {} # key: nid, value: list of (tid, slice_bytes)
+    for tid, trace_packet in all_trace_packets.items():
+        for nid in get_sl_nodes(trace_packet):
+            pkt_slice = slice_packet(trace_packet, nid)
+            if pkt_slice is None:
+                continue
+            data = json.dumps(pkt_slice, separators=(',', ':')).encode('utf-8')
+            node_records.setdefault(nid, []).append((tid, data))
+
+    for nid, records in node_records.items():
+        write_store(store_path(store_dir, nid), records)
+    return len(node_records)
+
+
+def build_node_peers(trace_packets_file, peers_file):
+    '''
+    Writes which peers each SL node calls across the whole packet set, used by
+    SL containers to pre-open connections at boot.
+    peers = {nid: {'sl': [SL nids], 'sf': {SF nid: db name}}}
+    '''
+    with open(trace_packets_file, 'r') as f:
+        all_trace_packets = json.load(f)
+    peers = {}
+    for trace_packet in all_trace_packets.values():
+        data_ops_dict = trace_packet['data_ops_dict']
+        for nid, calls in trace_packet['node_calls_dict'].items():
+            node_peers = peers.setdefault(nid, {'sl': set(), 'sf': {}})
+            for dm_nid, op_id, _ in calls:
+                if op_id == -1:
+                    node_peers['sl'].add(dm_nid)
+                else:
+                    node_peers['sf'][dm_nid] = data_ops_dict[str(op_id)]['db']
+    peers = {nid: {'sl': sorted(p['sl']), 'sf': p['sf']} for nid, p in peers.items()}
+    with open(peers_file, 'w') as f:
+        json.dump(peers, f)
+    return len(peers)
+
+
+def load_node_peers(peers_file, nid):
+    if not os.path.exists(peers_file):
+        return {'sl': [], 'sf': {}}
+    with open(peers_file, 'r') as f:
+        return json.load(f).get(nid, {'sl': [], 'sf': {}})
+
+
+##################### Lookup (SL container) #################################
+class PacketStore:
+    '''Read-only mmap view of one node's store file.'''
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._read_header()
+
+    def _read_header(self):
+        magic, version, count, tid_width = HEADER.unpack_from(self._mm, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"Unsupported packet store {self.path}: {magic}, v{version}")
+        self._count = count
+        self._tid_width = tid_width
+        self._entry_size = tid_width + INDEX_ENTRY.size
+        self._data_start = HEADER.size + count * self._entry_size
+
+    def __len__(self):
+        return self._count
+
+    def _find(self, tid):
+        '''(abs offset, length) of tid's slice, binary searching the sorted index in place'''
+        tid_bytes = tid.encode('utf-8')
+        if len(tid_bytes) > self._tid_width:
+            return None
+        key = tid_bytes.ljust(self._tid_width, b'\0')
+        width = self._tid_width
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            pos = HEADER.size + mid * self._entry_size
+            if self._mm[pos:pos + width] < key:
+                low = mid + 1
+            else:
+                high = mid
+        pos = HEADER.size + low * self._entry_size
+        if low == self._count or self._mm[pos:pos + width] != key:
+            return None
+        offset, length = INDEX_ENTRY.unpack_from(self._mm, pos + width)
+        return self._data_start + offset, length
+
+    def get_slice(self, tid):
+        entry = self._find(tid)
+        if entry is None:
+            return None
+        offset, length = entry
+        return json.loads(self._mm[offset:offset + length])
+
+    def get_packet(self, tid, nid):
+        '''Rebuilds a trace packet in the usual shape, restricted to node nid.'''
+        pkt_slice = self.get_slice(tid)
+        if pkt_slice is None:
+            return {'tid': tid, 'node_calls_dict': {}, 'data_ops_dict': {}, 'logger_nodes': []}
+        return {
+            'tid': tid,
+            'node_calls_dict': {nid: pkt_slice['calls']},
+            'data_ops_dict': pkt_slice['ops'],
+            'logger_nodes': [nid] if pkt_slice['logger'] else []
+        }
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+def open_packet_store(store_dir, nid):
+    '''Returns the PacketStore for nid, or None if no store was deployed.'''
+    path = store_path(store_dir, nid)
+    if not os.path.exists(path):
+        return None
+    return PacketStore(path)
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python3 packet_store.py <all_trace_packets.json> <store_dir>")
+        sys.exit(1)
+    n_stores = build_packet_stores(sys.argv[1], sys.argv[2])
+    print(f"Wrote {n_stores} packet stores to {sys.argv[2]}")
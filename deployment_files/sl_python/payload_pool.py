@@ -0,0 +1,52 @@
+'''
+Write payloads for the datastore shims, cut from one pre-generated buffer.
+
+At start the SL service fills PAYLOAD_POOL_BYTES + PAYLOAD_MAX_BYTES of
+random base64 text once. A payload of n bytes is a slice of that buffer at a
+rolling offset, so a write costs the same Python work whatever its size:
+    Redis             memoryview slice, no copy (sent straight from the pool)
+    Postgres/MongoDB  str slice (TEXT column / BSON string), one memcpy in C
+Sizes come from op_obj_size in the op packet (enrichment, Wl_config record
+sizes); ops from older packets without it get DEFAULT_PAYLOAD_SIZE bytes.
+'''
+import os
+import base64
+import random
+
+POOL_BYTES = int(os.getenv('PAYLOAD_POOL_BYTES', str(2 << 20)))
+MAX_PAYLOAD_BYTES = int(os.getenv('PAYLOAD_MAX_BYTES', str(1 << 20)))
+DEFAULT_PAYLOAD_SIZE = 100
+OFFSET_STEP = 4099 # prime, so consecutive payloads start at different offsets
+
+
+class PayloadPool:
+    def __init__(self, pool_bytes=POOL_BYTES, max_payload=MAX_PAYLOAD_BYTES, seed=None):
+        self.pool_bytes = pool_bytes
+        self.max_payload = max_payload
+        total = pool_bytes + max_payload
+        self.buf = base64.b64encode(random.Random(seed).randbytes(total * 3 // 4 + 3))[:total]
+        self.view = memoryview(self.buf)
+        self.text = None # str copy of buf, made on first text payload
+        self.cursor = 0
+
+    def next_offset(self):
+        offset = self.cursor
+        self.cursor = (self.cursor + OFFSET_STEP) % self.pool_bytes
+        return offset
+
+    def payload_view(self, size):
+        '''size bytes as a memoryview into the pool (valid for the life of the pool)'''
+        offset = self.next_offset()
+        return self.view[offset:offset + min(size, self.max_payload)]
+
+    def payload_text(self, size):
+        if self.text is None:
+            self.text = self.buf.decode('ascii')
+        offset = self.next_offset()
+        return self.text[offset:offset + min(size, self.max_payload)]
+
+    def payload_for(self, db_name, size):
+        '''Payload in the type the db's driver takes without converting it again'''
+        if db_name == "Redis":
+            return self.payload_view(size)
+        return self.payload_text(size)
@@ -0,0 +1,204 @@
+'''
+Low-overhead request log for the SL service.
+
+record() packs a fixed-width record into a preallocated ring buffer on the
+event loop; no file I/O, formatting or locking on the hot path. A single
+writer task drains the ring in large batches and appends them from one
+background thread, either as CSV or as the raw fixed-width records. If the
+ring fills up faster than it drains, new records are dropped and counted
+rather than blocking requests. close() flushes everything on shutdown.
+Records with a string longer than its fixed-width field (which struct would
+silently truncate, breaking joins on tid/nid) are dropped and logged instead.
+
+Record (little endian): tid 64s, nid 16s, timestamp us q, type u8, db u8,
+target nid 16s, latency us q
+CSV columns: tid, nid, timestamp_us, type, db, target, latency_us
+
+SpanLog writes span records through the same pipeline (see SPAN_RECORD):
+one Hop span per SL node visit plus one span per downstream call.
+'''
+import os
+import re
+import time
+import struct
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+RECORD = struct.Struct('<64s16sqBB16sq')
+# tid, span (hop id), parent hop id, nid, type, db, target, start us, end us, send us
+SPAN_RECORD = struct.Struct('<64s24s24s16sBB16sqqq')
+
+# Entry types
+LEAF, SYNC_DB, ASYNC_DB, SYNC_SL, ASYNC_SL, ERROR, HOP = range(7)
+ENTRY_TYPES = ['Leaf', 'SyncDB', 'AsyncDB', 'SyncSL', 'AsyncSL', 'Error', 'Hop']
+DB_NAMES = ['', 'MongoDB', 'Redis', 'Postgres']
+DB_IDS = {name: idx for idx, name in enumerate(DB_NAMES)}
+
+
+def string_fields(record_struct):
+    '''(field index, width) of each fixed-width string field of a record struct'''
+    fields = []
+    index = 0
+    for count, code in re.findall(r'(\d*)([a-zA-Z?])', record_struct.format):
+        if code == 's':
+            fields.append((index, int(count or 1)))
+            index += 1
+        else:
+            index += int(count or 1)
+    return fields
+
+
+def now_us():
+    return time.time_ns() // 1000
+
+
+def _str(field):
+    return field.rstrip(b'\0').decode('utf-8')
+
+
+def format_csv_rows(chunk):
+    rows = []
+    for tid, nid, ts, entry_type, db, target, latency in RECORD.iter_unpack(chunk):
+        rows.append(f"{_str(tid)},{_str(nid)},{ts},{ENTRY_TYPES[entry_type]},{DB_NAMES[db]},{_str(target)},{latency}\n")
+    return ''.join(rows)
+
+
+def decode_span(fields):
+    tid, span, parent, nid, entry_type, db, target, start, end, send = fields
+    return (_str(tid), _str(span), _str(parent), _str(nid), ENTRY_TYPES[entry_type], DB_NAMES[db],
+            _str(target), start, end, send)
+
+
+def format_span_csv_rows(chunk):
+    return ''.join(','.join(str(v) for v in decode_span(fields)) + '\n' for fields in SPAN_RECORD.iter_unpack(chunk))
+
+
+def read_log_records(path, record_struct=RECORD):
+    '''Yields decoded records from a binary (.bin) request log (record_struct=SPAN_RECORD for span logs).'''
+    with open(path, 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % record_struct.size
+    for fields in record_struct.iter_unpack(data[:usable]):
+        if record_struct is SPAN_RECORD:
+            yield decode_span(fields)
+            continue
+        tid, nid, ts, entry_type, db, target, latency = fields
+        yield _str(tid), _str(nid), ts, ENTRY_TYPES[entry_type], DB_NAMES[db], _str(target), latency
+
+
+class RequestLog:
+    record_struct = RECORD
+    format_rows = staticmethod(format_csv_rows)
+
+    def __init__(self, path, fmt='csv', capacity=1 << 16, flush_interval=0.5):
+        '''path without extension; fmt: csv or bin'''
+        self.path = f"{path}.{fmt}"
+        self.fmt = fmt
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.flush_batch = capacity // 4 # wake the writer early past this backlog
+        self.buf = bytearray(capacity * self.record_struct.size)
+        self.head = 0 # records written
+        self.tail = 0 # records handed to the writer
+        self.dropped = 0
+        self.oversized = 0 # records dropped for a string longer than its field
+        self.string_fields = string_fields(self.record_struct)
+        self.file = None
+        self.wake = None
+        self.closing = False
+        self.writer_task = None
+        self.io_executor = ThreadPoolExecutor(max_workers=1) # one thread keeps appends ordered
+
+    def record(self, tid, nid, ts_us, entry_type, db='', target='', latency_us=0):
+        self.pack(tid.encode('utf-8'), nid.encode('utf-8'), ts_us, entry_type,
+                  DB_IDS.get(db, 0), target.encode('utf-8'), latency_us)
+
+    def pack(self, *fields):
+        for idx, width in self.string_fields:
+            if len(fields[idx]) > width:
+                if not self.oversized:
+                    logging.error(f"Request log {self.path}: {fields[idx]!r} longer than its {width} byte field, "
+                                  f"dropping such records")
+                self.oversized += 1
+                return
+        pending = self.head - self.tail
+        if pending >= self.capacity:
+            self.dropped += 1
+            return
+        self.record_struct.pack_into(self.buf, (self.head % self.capacity) * self.record_struct.size, *fields)
+        self.head += 1
+        if pending + 1 >= self.flush_batch and self.wake is not None:
+            self.wake.set()
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if self.fmt == 'bin':
+            self.file = open(self.path, 'ab')
+        else:
+            self.file = open(self.path, 'a', newline='')
+        self.wake = asyncio.Event()
+        self.writer_task = asyncio.create_task(self.run_writer())
+
+    def take_pending(self):
+        '''Copies pending records out of the ring (handles wrap-around).'''
+        n = self.head - self.tail
+        start = (self.tail % self.capacity) * self.record_struct.size
+        end = start + n * self.record_struct.size
+        if end <= len(self.buf):
+            chunk = bytes(self.buf[start:end])
+        else:
+            chunk = bytes(self.buf[start:]) + bytes(self.buf[:end - len(self.buf)])
+        self.tail += n
+        return chunk
+
+    def write_chunk(self, chunk):
+        try:
+            self.file.write(chunk if self.fmt == 'bin' else self.format_rows(chunk))
+            self.file.flush()
+        except Exception as e:
+            logging.error(f"Failed to write request log {self.path}: {e}")
+
+    async def flush(self):
+        if self.head == self.tail:
+            return
+        chunk = self.take_pending()
+        await asyncio.get_running_loop().run_in_executor(self.io_executor, self.write_chunk, chunk)
+
+    async def run_writer(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush()
+
+    async def close(self):
+        self.closing = True
+        if self.writer_task is not None:
+            self.wake.set()
+            await self.writer_task
+        await self.flush()
+        if self.file is not None:
+            self.file.close()
+        self.io_executor.shutdown(wait=True)
+        if self.dropped:
+            logging.error(f"Request log {self.path} dropped {self.dropped} records (ring full)")
+        if self.oversized:
+            logging.error(f"Request log {self.path} dropped {self.oversized} records with oversized fields")
+
+
+class SpanLog(RequestLog):
+    '''
+    Span records. Hop spans: span is this visit's hop id, parent the caller's
+    hop id ('' for the client), start/end the visit, send the caller's send
+    time. Call spans: span is the calling hop, type SyncDB/AsyncDB/SyncSL/AsyncSL,
+    start/end the call as seen by the caller.
+    '''
+    record_struct = SPAN_RECORD
+    format_rows = staticmethod(format_span_csv_rows)
+
+    def record(self, tid, span, parent, nid, entry_type, db='', target='', start_us=0, end_us=0, send_us=0):
+        self.pack(tid.encode('utf-8'), span.encode('utf-8'), parent.encode('utf-8'), nid.encode('utf-8'),
+                  entry_type, DB_IDS.get(db, 0), target.encode('utf-8'), start_us, end_us, send_us)
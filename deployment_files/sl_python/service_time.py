@@ -0,0 +1,112 @@
+'''
+Service time model for the simulated processing of an SL hop.
+
+Each SL container gets one distribution spec, resolved from the ServiceTime
+block of enrichment_config.yaml by container_setup.py (node class -> spec)
+and passed as JSON in SERVICE_TIME:
+    {"dist": "fixed", "ms": 10}
+    {"dist": "lognormal", "median_ms": 2, "sigma": 1.2, "max_ms": 500}
+    {"dist": "empirical", "values_ms": [0, 0, 1, ...]}     each value equally likely
+    {"dist": "empirical", "cdf": [[0, 0.2], [1, 0.4], ...]} (ms, cumulative prob), interpolated
+An empty spec is the built-in empirical table (DEFAULT_PROC_TIMES_MS).
+
+Samples are drawn TABLE_SIZE at a time into a preallocated array and handed
+out by a cursor, so a request costs an index and an increment.
+
+SERVICE_TIME_MODE picks how the time is spent:
+    sleep  asyncio.sleep, no CPU used (the old behaviour)
+    cpu    busy loop on the event loop in CPU_SLICE slices, yielding between
+           slices, so concurrent requests share (and contend for) the CPU
+'''
+import os
+import json
+import math
+import time
+import random
+import asyncio
+from array import array
+from bisect import bisect_left
+
+TABLE_SIZE = 4096
+CPU_SLICE = 0.001 # seconds of CPU burnt between yields in cpu mode
+MODES = ('sleep', 'cpu')
+# Processing time percentiles (ms), p1..p100, used when no distribution is configured
+DEFAULT_PROC_TIMES_MS = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                         1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2,
+                         2, 2, 2, 2, 2, 3, 3, 3, 3, 3, 4, 4, 4, 5, 5, 5, 6, 6, 6, 7,
+                         7, 8, 8, 9, 9, 10, 11, 11, 12, 13, 15, 16, 18, 20, 22, 25,
+                         29, 33, 39, 45, 52, 62, 70, 78, 87, 97, 111, 126, 143, 164,
+                         188, 220, 254, 289, 331, 379, 446, 3892]
+
+
+def sampler_from_spec(spec, rng):
+    '''Returns a function drawing one service time in seconds'''
+    dist = spec.get('dist', 'empirical')
+    if dist == 'fixed':
+        seconds = spec['ms'] / 1000
+        return lambda: seconds
+    if dist == 'lognormal':
+        mu = math.log(spec['median_ms'] / 1000)
+        sigma = spec['sigma']
+        max_s = spec.get('max_ms', float('inf')) / 1000
+        return lambda: min(rng.lognormvariate(mu, sigma), max_s)
+    if dist == 'empirical':
+        if 'cdf' in spec:
+            points = sorted(spec['cdf'], key=lambda point: point[1])
+            values = [ms / 1000 for ms, _ in points]
+            probs = [p / points[-1][1] for _, p in points]
+            def sample_cdf():
+                u = rng.random()
+                idx = bisect_left(probs, u)
+                if idx == 0:
+                    return values[0]
+                lo, hi = probs[idx - 1], probs[idx]
+                frac = (u - lo) / (hi - lo) if hi > lo else 1.0
+                return values[idx - 1] + frac * (values[idx] - values[idx - 1])
+            return sample_cdf
+        values = [ms / 1000 for ms in spec.get('values_ms', DEFAULT_PROC_TIMES_MS)]
+        return lambda: values[int(rng.random() * len(values))]
+    raise ValueError(f"Unsupported service time distribution: {dist}")
+
+
+class ServiceTimeModel:
+    def __init__(self, spec=None, mode='sleep', seed=None):
+        if mode not in MODES:
+            raise ValueError(f"Unsupported service time mode: {mode}")
+        self.spec = spec or {}
+        self.mode = mode
+        self.draw = sampler_from_spec(self.spec, random.Random(seed))
+        self.table = array('d', bytes(8 * TABLE_SIZE))
+        self.cursor = TABLE_SIZE # refilled on first use
+
+    @classmethod
+    def from_env(cls):
+        return cls(json.loads(os.getenv('SERVICE_TIME', '') or '{}'), os.getenv('SERVICE_TIME_MODE', 'sleep'))
+
+    def refill(self):
+        table, draw = self.table, self.draw
+        for idx in range(TABLE_SIZE):
+            table[idx] = draw()
+        self.cursor = 0
+
+    def sample(self):
+        '''Next service time in seconds'''
+        if self.cursor >= TABLE_SIZE:
+            self.refill()
+        value = self.table[self.cursor]
+        self.cursor += 1
+        return value
+
+    async def wait(self):
+        '''Spends one sampled service time, per the mode'''
+        seconds = self.sample()
+        if self.mode == 'sleep':
+            await asyncio.sleep(seconds)
+            return
+        remaining = seconds
+        while remaining > 0:
+            deadline = time.thread_time() + min(remaining, CPU_SLICE)
+            while time.thread_time() < deadline:
+                pass
+            remaining -= CPU_SLICE
+            await asyncio.sleep(0)
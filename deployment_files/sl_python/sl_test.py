@@ -1,60 +1,91 @@
 import time
 import logging
 import asyncio
-import asyncpg
 import requests
 import aiohttp
-import os, csv
-import random
-import base64
-import motor.motor_asyncio
-import redis.asyncio as redis 
+import os
+import json
+import signal
+import itertools
 from aiohttp import web
-from concurrent.futures import ThreadPoolExecutor
+from packet_store import open_packet_store, load_node_peers
+from trace_codec import CONTENT_TYPE, JSON_CONTENT_TYPE, TID_HEADER, PARENT_HOP_HEADER, SEND_TS_HEADER, COLLECTOR_HEADER, ORIGIN_TS_HEADER, decode_node_view
+from db_batcher import batching_enabled, submit_batched, record_direct_op, stats_snapshot
+from db_pools import create_pg_client, create_redis_client, create_mongo_client, pool_stats_snapshot
+from request_log import RequestLog, SpanLog, now_us, LEAF, SYNC_DB, ASYNC_DB, SYNC_SL, ASYNC_SL, HOP
+from metrics import Registry, monitor_loop_lag
+from completion import CompletionReporter
+from latency_histogram import LatencyHistogram
+from admission import AdmissionController, run_admitted, REJECT_STATUS, MAX_INFLIGHT, QUEUE_LEN
+from service_time import ServiceTimeModel
+from payload_pool import PayloadPool, DEFAULT_PAYLOAD_SIZE
+from sl_workers import worker_count, install_event_loop, run_workers, WORKER_PORT_BASE
 
 #Request sleep counter
 rq_counter = 0
 session = None
 # Initialize logging 
 logging.basicConfig(level=logging.INFO)
-# Async logging
-executor = ThreadPoolExecutor(max_workers=5)
-def log_to_csv_file(tid, this_nid, logged_time, entry_type="INFO", message=""):
-    log_directory = "./logs"
-    if not os.path.exists(log_directory):
-        os.makedirs(log_directory)  # Create the directory if it does not exist
-    
-    log_file = f"{log_directory}/{this_nid}_log.csv"  
-    try:
-        with open(log_file, mode='a+', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([tid, this_nid, logged_time, entry_type, message])
-            logging.info(f"Log entry for tid={tid}, this_nid={this_nid} written successfully")
-    except Exception as e:
-        logging.error(f"Failed to write log entry: {e}")
-
-def log_in_background(tid, this_nid, logged_time, entry_type="INFO", message=""):
-    # logging.info(f"Submitting log task for tid={tid}, this_nid={this_nid}")
-    executor.submit(log_to_csv_file, tid, this_nid, logged_time, entry_type, message)
+# Request logs (see request_log.py). logs/{nid}_log.* holds the logger node
+# rows the RCT analysis reads; per hop latencies (off unless HOP_LOG=1, a
+# ring write per hop) go to logs/hops/ so the analysis glob (logs/*.csv) does
+# not pick them up.
+REQUEST_LOG_FORMAT = os.getenv('REQUEST_LOG_FORMAT', 'csv') # csv or bin
+HOP_LOG = os.getenv('HOP_LOG', '0') == '1'
+# Span records (logs/spans/) for critical path analysis, see span_analysis.py
+SPAN_LOG = os.getenv('SPAN_LOG', '0') == '1'
+request_log = None
+hop_log = None
+span_log = None
+hop_seq = itertools.count()
+# Worker processes sharing port 5000 (see sl_workers.py): 'auto' sizes to the CPU limit
+SL_WORKERS = os.getenv('SL_WORKERS', '1')
+SL_EVENT_LOOP = os.getenv('SL_EVENT_LOOP', 'asyncio') # asyncio or uvloop
+worker_id = 0
+n_workers = 1
+hop_prefix = None # nid, plus the worker in worker mode so hop ids stay unique
+# Logger nodes push completions to the collector named in X-Mewbie-Collector (see completion.py)
+completion_reporter = None
+# Logger nodes: client intended send -> this node's completion (us), per worker, merged by /rct_histogram
+rct_hist = LatencyHistogram()
+# Bounds packets processed and queued at once (see admission.py); off unless ADMISSION_MAX_INFLIGHT > 0
+admission = None
+
+# Prometheus metrics served on /metrics (see metrics.py)
+registry = Registry()
+handler_seconds = registry.histogram('sl_handler_seconds', 'Time for call_handler to accept a trace packet')
+processing_seconds = registry.histogram('sl_processing_seconds', 'Simulated processing time per trace packet')
+db_op_seconds = registry.histogram('sl_db_op_seconds', 'Datastore op latency seen by this SL node', ['db', 'op', 'target'])
+sl_call_seconds = registry.histogram('sl_call_seconds', 'Outbound SL call latency', ['target', 'mode'])
+packets_total = registry.counter('sl_packets_total', 'Trace packets received')
+sl_calls_rejected = registry.counter('sl_calls_rejected_total', 'Outbound SL calls rejected by the callee', ['target'])
+registry.gauge('sl_inflight_packets', 'Trace packets being processed', func=lambda: rq_counter)
+registry.gauge('sl_pending_background_tasks', 'Fire-and-forget data op tasks in flight', func=lambda: len(background_tasks))
+registry.counter('sl_request_log_dropped_total', 'Request log records dropped on a full ring',
+                 func=lambda: request_log.dropped if request_log is not None else 0)
+registry.counter('sl_completions_reported_total', 'Completions delivered to a collector',
+                 func=lambda: completion_reporter.reported if completion_reporter is not None else 0)
+registry.counter('sl_completions_failed_total', 'Completions that could not be delivered to a collector',
+                 func=lambda: completion_reporter.failed if completion_reporter is not None else 0)
+registry.gauge('sl_admission_queue_length', 'Trace packets waiting for an admission slot',
+               func=lambda: len(admission.waiting) if admission is not None else 0)
+registry.counter('sl_admission_rejected_total', 'Trace packets rejected by admission control',
+                 func=lambda: admission.rejected if admission is not None else 0)
+registry.counter('sl_admission_dropped_total', 'Queued trace packets dropped for newer ones (drop_oldest)',
+                 func=lambda: admission.dropped if admission is not None else 0)
+registry.counter('sl_admission_blocked_total', 'Trace packets whose sender waited for queue space (block)',
+                 func=lambda: admission.blocked if admission is not None else 0)
+admission_wait_seconds = registry.histogram('sl_admission_wait_seconds', 'Time trace packets waited for an admission slot')
+loop_lag_seconds = registry.gauge('sl_event_loop_lag_seconds', 'Event loop lag measured by the last probe', merge='max')
 
 
 ##################### Initialization #################################
-client_map = {} # key: sf_node_id, value: db client. Used to avoid initing client everytime
-async def db_con_initializer(db_name, sf_node, dm_ip, dm_port, client_map):
-    if sf_node in client_map:
-        return client_map[sf_node]
+client_map = {} # key: (db_name, sf_node_id), value: task resolving to the pooled db client
+async def create_db_client(db_name, sf_node, dm_ip, dm_port):
     if db_name == "MongoDB":
-        client = motor.motor_asyncio.AsyncIOMotorClient(dm_ip, dm_port)
-        client_map[sf_node] = client
+        client = create_mongo_client(sf_node, dm_ip, dm_port)
     elif db_name == "Postgres":
-        client = await asyncpg.connect(
-            user = "pguser",
-            password="pgpass",
-            host=dm_ip,
-            port=dm_port,
-            database="pg_db"
-        )
-        client_map[sf_node] = client
+        client = await create_pg_client(sf_node, dm_ip, dm_port)
         create_table_query = """
         CREATE TABLE IF NOT EXISTS mewbie_table (
             id SERIAL PRIMARY KEY,
@@ -68,11 +99,23 @@ async def db_con_initializer(db_name, sf_node, dm_ip, dm_port, client_map):
         except Exception as e:
             logging.error(f"Error creating table 'mewbie_table': {e}")
     elif db_name == "Redis":
-        client = await redis.from_url(f"redis://{dm_ip}:{dm_port}")
-        client_map[sf_node] = client
-
+        client = create_redis_client(sf_node, dm_ip, dm_port)
+    else:
+        raise ValueError(f"Unsupported database: {db_name}")
     return client
 
+async def db_con_initializer(db_name, sf_node, dm_ip, dm_port, client_map):
+    # The creation task is cached, not the client, so coroutines racing on a
+    # cold node all await the same pool instead of each opening their own
+    key = (db_name, sf_node)
+    if key not in client_map:
+        client_map[key] = asyncio.ensure_future(create_db_client(db_name, sf_node, dm_ip, dm_port))
+    try:
+        return await client_map[key]
+    except Exception:
+        client_map.pop(key, None) # let the next call retry
+        raise
+
 def get_container_id():
     with open("/proc/self/cgroup", 'r') as f:
         for line in f:
@@ -82,20 +125,37 @@ def get_container_id():
 def get_container_name():
     return os.environ['CONTAINER_NAME']
 
+# Pass-by-reference mode: packets carrying only a tid are resolved against
+# this node's slice in the deployed packet store (see packet_store.py)
+PACKET_STORE_DIR = os.getenv('PACKET_STORE_DIR', './packet_store')
+packet_store = None
+
+def resolve_trace_packet(trace_packet_data, this_nid):
+    if 'node_calls_dict' in trace_packet_data: # Full packet on the wire
+        return trace_packet_data
+    if packet_store is None:
+        raise ValueError(f"Received tid-only packet but no packet store loaded for {this_nid}")
+    return packet_store.get_packet(trace_packet_data['tid'], this_nid)
+
 
 ##################### SHIM FUNCS #################################
 async def postgres_shim_func(kv, op, node_id, dm_ip="localhost", dm_port=5432):
     '''table name= mewbie_table, cols = key, value'''
-    pg_client = await db_con_initializer("Postgres", node_id, dm_ip, dm_port, client_map)
+    pg_client = await db_con_initializer("Postgres", dm_ip, dm_ip, dm_port, client_map)
     table_name = "mewbie_table"
 
     if op == "write":
         key, value = list(kv.items())[0]
         query = f"INSERT INTO {table_name} (key, value) VALUES ($1, $2)"
         try:
-            result = await pg_client.execute(query, key, value)
+            if batching_enabled(dm_ip):
+                result = await submit_batched("Postgres", dm_ip, op, pg_client, key, value)
+            else:
+                st = time.perf_counter()
+                result = await pg_client.execute(query, key, value)
+                record_direct_op("Postgres", op, (time.perf_counter() - st) * 1000)
             # logging.info(f"KV pair {key}:{value} inserted!")
-            return web.Response(text=f"KV pair {key}:{value} inserted", status=200)
+            return web.Response(text=f"KV pair {key} ({len(value)} bytes) inserted", status=200)
         except Exception as e:
             logging.error(f"Error in write to postgres: {e}")
             return web.Response(text=f"Error in write to postgres: {e}", status=500)
@@ -103,9 +163,14 @@ async def postgres_shim_func(kv, op, node_id, dm_ip="localhost", dm_port=5432):
         try:
             key, value = list(kv.items())[0]
             query = f"SELECT * FROM {table_name} WHERE key = $1"
-            result = await pg_client.fetchrow(query, key)
+            if batching_enabled(dm_ip):
+                result = await submit_batched("Postgres", dm_ip, op, pg_client, key, value)
+            else:
+                st = time.perf_counter()
+                result = await pg_client.fetchrow(query, key)
+                record_direct_op("Postgres", op, (time.perf_counter() - st) * 1000)
             # logging.info(f"KV pair {key}:{value} found!")
-            return web.Response(text=f"KV pair {key}:{value} read successfully", status=200)
+            return web.Response(text=f"KV pair {key} read successfully", status=200)
         except Exception as e:
             logging.error(f"Error in read from postgres: {e}")
             return web.Response(text=f"Error in read from postgres: {e}", status=500)
@@ -115,16 +180,29 @@ async def mongo_shim_func(kv, op, node_id, dm_ip, dm_port=27017):
     '''
     db_name= mongo, collection name= mycollection.
     '''
-    client = await db_con_initializer("MongoDB", node_id, dm_ip, dm_port, client_map)
+    client = await db_con_initializer("MongoDB", dm_ip, dm_ip, dm_port, client_map)
     db = client.mewbie_db # Name of db in container  
     collection = db.mycollection 
     if op == "write":
-        result = await collection.insert_one(kv)
-        # logging.info(f"Document inserted with id {result.inserted_id}")
+        if batching_enabled(dm_ip):
+            key, value = list(kv.items())[0]
+            inserted_id = await submit_batched("MongoDB", dm_ip, op, collection, key, value)
+        else:
+            st = time.perf_counter()
+            result = await collection.insert_one(kv)
+            record_direct_op("MongoDB", op, (time.perf_counter() - st) * 1000)
+            inserted_id = result.inserted_id
+        # logging.info(f"Document inserted with id {inserted_id}")
         return web.Response(text=f"Payload inserted with id\
-                             {result.inserted_id}", status=200)
+                             {inserted_id}", status=200)
     elif op == "read":
-        result = await collection.find_one(kv)
+        if batching_enabled(dm_ip):
+            key, value = list(kv.items())[0]
+            result = await submit_batched("MongoDB", dm_ip, op, collection, key, value)
+        else:
+            st = time.perf_counter()
+            result = await collection.find_one(kv)
+            record_direct_op("MongoDB", op, (time.perf_counter() - st) * 1000)
         if result:
             # logging.info(f"Document found: {result}")
             return web.Response(text=f"Payload inserted with id\
@@ -134,24 +212,34 @@ async def mongo_shim_func(kv, op, node_id, dm_ip, dm_port=27017):
 
 
 async def redis_shim_func(kv, op, node_id, dm_ip, dm_port=6379):
-    red_client = await db_con_initializer("Redis", node_id, dm_ip, dm_port, client_map)
+    red_client = await db_con_initializer("Redis", dm_ip, dm_ip, dm_port, client_map)
     key, value = list(kv.items())[0]
     
     if op == "write":
         try:
-            await red_client.set(key, value)
+            if batching_enabled(dm_ip):
+                await submit_batched("Redis", dm_ip, op, red_client, key, value)
+            else:
+                st = time.perf_counter()
+                await red_client.set(key, value)
+                record_direct_op("Redis", op, (time.perf_counter() - st) * 1000)
             # logging.info(f"KV pair {key}:{value} inserted!")
-            return web.Response(text=f"KV pair {key}:{value} inserted!", status=200)
+            return web.Response(text=f"KV pair {key} ({len(value)} bytes) inserted!", status=200)
         except Exception as e:
             logging.error(f"Error in write: {e}")
             return web.Response(text=f"Error in write: {e}", status=500)
     
     elif op == "read":
         try:
-            value = await red_client.get(key)
+            if batching_enabled(dm_ip):
+                value = await submit_batched("Redis", dm_ip, op, red_client, key, value)
+            else:
+                st = time.perf_counter()
+                value = await red_client.get(key)
+                record_direct_op("Redis", op, (time.perf_counter() - st) * 1000)
             if value:
                 # logging.info(f"KV pair {key}:{value} found!")
-                return web.Response(text=f"KV pair {key}:{value} found!", status=200)
+                return web.Response(text=f"KV pair {key} ({len(value)} bytes) found!", status=200)
             else:
                 return web.Response(text=f"No entry found for key {key}", status=404)
         except Exception as e:
@@ -159,24 +247,25 @@ async def redis_shim_func(kv, op, node_id, dm_ip, dm_port=6379):
             return web.Response(text=f"Error during Redis read: {e}", status=500)
 
 ###################### HELPERS ################################
-def generate_random_string(length):
-    """Generates a random string of given byte length."""
-    random_bytes = bytes(random.getrandbits(8) for _ in range(length))
-    random_string = base64.b64encode(random_bytes).decode('ascii')
-    return random_string
-
-async def make_sl_call(sl_dm_nid, async_flag, trace_packet_data):
+# Write payloads are slices of one pre-generated buffer (see payload_pool.py)
+payload_pool = PayloadPool()
+
+async def make_sl_call(sl_dm_nid, async_flag, packet_body, content_type=JSON_CONTENT_TYPE, span_headers=None):
+    '''packet_body: encoded packet as received, forwarded without re-encoding'''
+    headers = {'Content-Type': content_type}
+    if span_headers:
+        headers.update(span_headers)
     try:
         if async_flag == 0: # Call is synchronous
             # logging.info(f"Making Sync SL call to {sl_dm_nid}")
             # response = requests.post(f"http://{sl_dm_nid}:5000/", json=trace_packet_data)
-            async with session.post(f"http://{sl_dm_nid}:5000/", json=trace_packet_data) as response:
+            async with session.post(f"http://{sl_dm_nid}:5000/", data=packet_body, headers=headers) as response:
                 await response.text()
         else: # Call is Asynchronous
             # logging.info(f"Making Async SL call to {sl_dm_nid}")
-            async with session.post(f"http://{sl_dm_nid}:5000/", json=trace_packet_data) as response:
+            async with session.post(f"http://{sl_dm_nid}:5000/", data=packet_body, headers=headers) as response:
                 await response.text() 
-            response = web.Response(text="Async task created", status=200)
+            response = web.Response(text="Async task created", status=response.status)
         return response
     except requests.exceptions.RequestException as e:
         # logging.info(f"Error in Sync SL call: {e}")
@@ -186,23 +275,11 @@ async def make_sl_call(sl_dm_nid, async_flag, trace_packet_data):
         return web.Response(text="Error in Async SL call", status=500)
 
 async def execute_db_call(db_shim_func, kv, op_type, this_nid, dm_nid,\
-                         dm_port, tid, db_name, async_flag):
-    if async_flag == 0:  # Synchronous call
-        # logging.info(f"Making Sync call to {db_name}")
-        response = await db_shim_func(kv, op_type, this_nid, dm_ip=dm_nid, dm_port=dm_port)
-        # logging.info(f"Logging = {tid}:{this_nid}:{time.time()}")
-        # log_in_background(tid, this_nid, time.time(),message="Sync SF")
-    else:  # Asynchronous call (Fire and forget)
-        # logging.info(f"Making Async call to {db_name}")
-        async def async_db_task():
-            response = await db_shim_func(kv, op_type, this_nid, dm_ip=dm_nid, dm_port=dm_port)
-            # logging.info(f"Logging = {tid}:{this_nid}:{time.time()}")
-            # log_in_background(tid, this_nid, time.time(),message="Async SF")
-        asyncio.create_task(async_db_task())
-        response = web.Response(text="Async task created!", status=200)
-    return response
-
-async def make_db_call(tid, dm_nid, db_name, kv, async_flag, op_type, this_nid):
+                         dm_port, tid, db_name):
+    # Async ops are dispatched as background tasks by fan_out, so the op itself is always awaited here
+    return await db_shim_func(kv, op_type, this_nid, dm_ip=dm_nid, dm_port=dm_port)
+
+async def make_db_call(tid, dm_nid, db_name, kv, op_type, this_nid):
     if db_name == "MongoDB":
         db_shim_func = mongo_shim_func
         dm_port = 27017
@@ -216,110 +293,362 @@ async def make_db_call(tid, dm_nid, db_name, kv, async_flag, op_type, this_nid):
         return web.Response(text="Unsupported database specified", status=400)
 
     return await execute_db_call(db_shim_func, kv, op_type, this_nid, dm_nid,\
-                                 dm_port, tid, db_name, async_flag)
+                                 dm_port, tid, db_name)
+
+##################### FAN-OUT SCHEDULER #################################
+# Max async children of one node visit in flight at once
+ASYNC_FANOUT_CAP = int(os.getenv('ASYNC_FANOUT_CAP', '16'))
+# Strong refs to fire-and-forget tasks so they are not garbage collected mid-flight
+background_tasks = set()
+
+async def run_child_call(tid, this_nid, hop_headers, dm_node_call, data_ops_dict, packet_body, content_type):
+    '''
+    Performs one downstream call to completion. Errors are logged, never raised.
+    hop_headers: span context forwarded on SL calls (tid, this hop id, collector)
+    '''
+    dm_nid, data_op_id, async_flag = dm_node_call
+    dispatch_time = now_us()
+    service = ""
+    if data_op_id != -1:  # data op id is -1 for SL call
+        op_type = ""
+        try:
+            op_pkt = data_ops_dict[str(data_op_id)]
+            service = op_pkt['db']
+            op_type = op_pkt['op_type']
+            # Reads only look the key up, so only writes carry the object's bytes
+            obj_size = (op_pkt.get('op_obj_size') or DEFAULT_PAYLOAD_SIZE) if op_type == "write" else 0
+            kv = {op_pkt['op_obj_id']: payload_pool.payload_for(service, obj_size)}
+            # Wait for the op itself; async ops are already off the sync path here
+            await make_db_call(tid, dm_nid, service, kv, op_type, this_nid)
+        except Exception as e:
+            logging.info(f"Error in make_db_call: {e}")
+        done_time = now_us()
+        db_op_seconds.observe((done_time - dispatch_time) / 1e6, service, op_type, dm_nid)
+    else:
+        try:
+            span_headers = dict(hop_headers)
+            span_headers[SEND_TS_HEADER] = str(dispatch_time)
+            response = await make_sl_call(dm_nid, async_flag, packet_body, content_type, span_headers)
+            if response.status in (429, 503): # shed by the callee's admission control
+                sl_calls_rejected.inc(dm_nid)
+        except Exception as e:
+            logging.error(f"Error in make_sl_call: {e}")
+        done_time = now_us()
+        sl_call_seconds.observe((done_time - dispatch_time) / 1e6, dm_nid, "async" if async_flag else "sync")
+    if service:
+        entry_type = ASYNC_DB if async_flag else SYNC_DB
+    else:
+        entry_type = ASYNC_SL if async_flag else SYNC_SL
+    if HOP_LOG:
+        hop_log.record(tid, this_nid, dispatch_time, entry_type, service, dm_nid, done_time - dispatch_time)
+    if SPAN_LOG:
+        span_log.record(tid, hop_headers[PARENT_HOP_HEADER], '', this_nid, entry_type, service, dm_nid, dispatch_time, done_time)
+
+async def run_async_child(fanout_sem, *child_args):
+    async with fanout_sem:
+        await run_child_call(*child_args)
+
+async def fan_out(tid, this_nid, hop_headers, dm_nodes_to_call, data_ops_dict, packet_body, content_type):
+    '''
+    Walks the children in trace order. Sync children are awaited one at a time,
+    as before. Async children are dispatched when reached and run concurrently
+    (at most ASYNC_FANOUT_CAP at once). Async SL children are awaited before the
+    node completes; async data ops stay fire-and-forget.
+    '''
+    fanout_sem = asyncio.Semaphore(ASYNC_FANOUT_CAP)
+    async_sl_tasks = []
+    for dm_node_call in dm_nodes_to_call:
+        child_args = (tid, this_nid, hop_headers, dm_node_call, data_ops_dict, packet_body, content_type)
+        if dm_node_call[2] == 0: # sync
+            await run_child_call(*child_args)
+            continue
+        task = asyncio.create_task(run_async_child(fanout_sem, *child_args))
+        if dm_node_call[1] == -1:
+            async_sl_tasks.append(task)
+        else:
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+    if async_sl_tasks:
+        await asyncio.gather(*async_sl_tasks)
+
+def local_alive_count():
+    # Packets queued by admission control are still to be processed
+    return rq_counter + (len(admission.waiting) if admission is not None else 0)
+
+async def worker_state_handler(request):
+    '''This worker's state, read by sibling workers to aggregate /status, /ready and /metrics'''
+    state = {'alive': local_alive_count(), 'ready': ready, 'unwarmed_peers': unwarmed_peers}
+    if request.query.get('metrics'):
+        state['metrics'] = registry.snapshot()
+    if request.query.get('rct'):
+        state['rct'] = rct_hist.to_dict()
+    return web.json_response(state)
+
+async def sibling_states(with_metrics=False, with_rct=False):
+    '''Worker mode: states of the other workers; unreachable ones are left out'''
+    params = {}
+    if with_metrics:
+        params['metrics'] = '1'
+    if with_rct:
+        params['rct'] = '1'
+    async def fetch_state(sibling):
+        url = f"http://127.0.0.1:{WORKER_PORT_BASE + sibling}/worker_state"
+        try:
+            async with session.get(url, params=params,
+                                   timeout=aiohttp.ClientTimeout(total=2)) as response:
+                return await response.json()
+        except Exception as e:
+            logging.error(f"Worker {sibling} state unavailable: {e}")
+            return None
+    states = await asyncio.gather(*[fetch_state(sibling) for sibling in range(n_workers) if sibling != worker_id])
+    return [state for state in states if state is not None]
 
 async def status_handler(request):
-    return web.Response(text=f"Alive request count: {rq_counter}\n", status=200)
+    alive = local_alive_count() + sum(state['alive'] for state in await sibling_states())
+    return web.Response(text=f"Alive request count: {alive}\n", status=200)
+
+async def pool_stats_handler(request):
+    '''Pool size and pool wait time (ms) per db:sf_node'''
+    return web.json_response(pool_stats_snapshot())
+
+async def metrics_handler(request):
+    peer_snapshots = [state['metrics'] for state in await sibling_states(with_metrics=True)]
+    return web.Response(text=registry.render(peer_snapshots), content_type='text/plain', charset='utf-8',
+                        headers={'X-Prometheus-Format': '0.0.4'})
+
+async def rct_histogram_handler(request):
+    '''
+    Logger node RCT histogram (client intended send -> completion here, us),
+    cumulative over the run and merged over workers; diff two snapshots
+    (LatencyHistogram.difference) for the percentiles of an interval
+    '''
+    hist = rct_hist.copy()
+    for state in await sibling_states(with_rct=True):
+        hist.merge(LatencyHistogram.from_dict(state['rct']))
+    return web.json_response({'histogram': hist.to_dict(), 'summary_ms': hist.summary_ms()})
+
+async def batch_stats_handler(request):
+    '''Batch size, queueing delay and op latency, batched vs direct shim path'''
+    return web.json_response(stats_snapshot())
 
 ######################################################
-async def process_trace_packet(trace_packet_data):
+async def process_trace_packet(trace_packet_data, packet_body, content_type=JSON_CONTENT_TYPE, span_ctx=('', 0, 0, '', 0)):
+    '''
+    packet_body/content_type: the packet as received, forwarded as-is to downstream SL nodes
+    span_ctx: (parent hop id, parent send time us, receive time us, collector, origin time us) from call_handler
+    '''
+    global rq_counter
+    this_nid = get_container_name()
+    tid = trace_packet_data.get('tid')
+    hop_id = f"{hop_prefix}.{next(hop_seq)}"
+    collector, origin_us = span_ctx[3], span_ctx[4]
+    # Status Ctr, decremented in finally so a failed packet cannot leave the node looking busy
+    rq_counter += 1
     try:
-        this_nid = get_container_name()
-        tid = trace_packet_data.get('tid')
+        trace_packet_data = resolve_trace_packet(trace_packet_data, this_nid)
         node_calls_dict = trace_packet_data.get('node_calls_dict')
         data_ops_dict = trace_packet_data.get('data_ops_dict')
         logger_nodes = trace_packet_data.get('logger_nodes')
 
-        # Status Ctr
-        global rq_counter
-        rq_counter += 1
-
         dm_nodes_to_call = node_calls_dict.get(this_nid)
         
         # logging.info(f"Nodes to call for this_nid {this_nid}: {dm_nodes_to_call}\n")
-        proc_times = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,\
-                       1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2,\
-                        2, 2, 2, 2, 2, 3, 3, 3, 3, 3, 4, 4, 4, 5, 5, 5, 6, 6, 6, 7,\
-                        7, 8, 8, 9, 9, 10, 11, 11, 12, 13, 15, 16, 18, 20, 22, 25,\
-                        29, 33, 39, 45, 52, 62, 70, 78, 87, 97, 111, 126, 143, 164,\
-                        188, 220, 254, 289, 331, 379, 446, 3892] #38928
-        if this_nid in ['n1765', 'n2134', 'n4376', 'n2977', 'n942', 'n4202', 'n5015', 'n2436', 'n6952', 'n6286']:
-            await asyncio.sleep(0.01)
-        else:
-            await asyncio.sleep(random.choice(proc_times)/1000)  # Simulating processing time
+        proc_start = time.perf_counter()
+        await service_time.wait()  # Simulating processing time
+        processing_seconds.observe(time.perf_counter() - proc_start)
         
         if this_nid in logger_nodes:  # If node is leaf SL, it logs and quits
-            # log_in_background(tid, this_nid, time.time())
-            pass
+            logged_time = now_us()
+            request_log.record(tid, this_nid, logged_time, LEAF)
+            if collector:
+                completion_reporter.add(collector, tid, this_nid, logged_time)
+            if origin_us:
+                rct_hist.record(logged_time - origin_us)
 
         if not dm_nodes_to_call: # leaf node, no further nodes to call.
-            rq_counter -= 1
             return
 
-        for dm_node_call in dm_nodes_to_call:
-            dm_nid = dm_node_call[0]
-            data_op_id = dm_node_call[1]
-            async_flag = dm_node_call[2]  # 1 if async, 0 if sync
-
-            if data_op_id != -1:  # data op id is -1 for SF call
-                try: 
-                    op_pkt = data_ops_dict[str(data_op_id)]
-                    op_type = op_pkt['op_type']
-                    op_obj_id = op_pkt['op_obj_id']
-                    db_name = op_pkt['db']
-                    kv = {op_obj_id: generate_random_string(100)} 
-                    await make_db_call(tid, dm_nid, db_name, kv, async_flag, op_type, this_nid)
-                except Exception as e:
-                    logging.info(f"Error in make_db_call: {e}")
-
-            else:  # SL call
-                try: 
-                    task = await make_sl_call(dm_nid, async_flag, trace_packet_data)
-                except Exception as e:
-            #         log_in_background("Error in make_sl_call!", this_nid, logged_time=time.time()\
-            # , entry_type="ERROR", message=str(e))
-                    logging.error(f"Error in make_sl_call: {e}")
-        rq_counter -= 1
+        hop_headers = {TID_HEADER: tid, PARENT_HOP_HEADER: hop_id}
+        if collector:
+            hop_headers[COLLECTOR_HEADER] = collector
+        if origin_us:
+            hop_headers[ORIGIN_TS_HEADER] = str(origin_us)
+        await fan_out(tid, this_nid, hop_headers, dm_nodes_to_call, data_ops_dict, packet_body, content_type)
 
     except Exception as e:
         logging.error(f"Error in async processing: {e}")
+    finally:
+        rq_counter -= 1
+        if SPAN_LOG:
+            parent_hop, send_us, recv_us = span_ctx[:3]
+            span_log.record(tid, hop_id, parent_hop, this_nid, HOP, '', '', recv_us, now_us(), send_us)
 
 async def call_handler(request):
     try:
-        trace_packet_data = await request.json()
+        handler_start = time.perf_counter()
+        span_ctx = (request.headers.get(PARENT_HOP_HEADER, ''), int(request.headers.get(SEND_TS_HEADER, 0)), now_us(),
+                    request.headers.get(COLLECTOR_HEADER, ''), int(request.headers.get(ORIGIN_TS_HEADER, 0)))
+        packet_body = await request.read()
+        # Binary codec if negotiated (only this node's view is decoded), JSON otherwise
+        if request.content_type == CONTENT_TYPE:
+            content_type = CONTENT_TYPE
+            trace_packet_data = decode_node_view(packet_body, this_nid)
+        else:
+            content_type = JSON_CONTENT_TYPE
+            trace_packet_data = json.loads(packet_body)
         # logging.info(f"Received payload: {trace_packet_data}\n")
-        asyncio.create_task(process_trace_packet(trace_packet_data))
+        packets_total.inc()
+        process = process_trace_packet(trace_packet_data, packet_body, content_type, span_ctx)
+        if admission.enabled():
+            slot = await admission.admit()
+            if slot is None:
+                process.close()
+                return web.Response(text="Overloaded, trace packet rejected", status=REJECT_STATUS)
+            process = run_admitted(admission, slot, admission_wait_seconds, process)
+        asyncio.create_task(process)
+        handler_seconds.observe(time.perf_counter() - handler_start)
         return web.Response(text="Trace packet processing started!", status=200)
     except Exception as e:
         logging.error(f"Error while handling request: {e}")
-        # log_in_background("Request Handler Error!", this_nid, logged_time=time.time()\
-        #     , entry_type="ERROR", message=str(e))
         return web.Response(text="Error occurred! status:", status=500)
         
 
 this_nid = get_container_name()
-
-async def run_server(port=5000):
-    global session
+# This node's service time distribution (SERVICE_TIME, resolved per node by container_setup.py),
+# created per worker in run_server so forked workers do not share one sample sequence
+service_time = None
+
+##################### PRE-WARMING #################################
+# Peers this node calls, written by container_setup.py (packet_store.build_node_peers)
+NODE_PEERS_FILE = os.getenv('NODE_PEERS_FILE', './node_peers.json')
+PREWARM_TIMEOUT = float(os.getenv('PREWARM_TIMEOUT', '120'))
+DB_PORTS = {"MongoDB": 27017, "Redis": 6379, "Postgres": 5432}
+ready = False
+unwarmed_peers = []
+prewarm_task = None
+
+async def warm_db_peer(db_name, sf_node):
+    # Pool creation opens the first connection and runs the Postgres DDL once
+    client = await db_con_initializer(db_name, sf_node, sf_node, DB_PORTS[db_name], client_map)
+    if db_name == "Redis":
+        await client.ping()
+    elif db_name == "MongoDB":
+        await client.admin.command('ping')
+
+async def warm_sl_peer(sl_nid):
+    # Leaves a keep-alive connection to the peer in the session's pool
+    async with session.get(f"http://{sl_nid}:5000/status") as response:
+        await response.text()
+
+async def warm_with_retry(warm_coro_func, deadline, *args):
+    '''Peers may still be starting; retry with backoff until the deadline.'''
+    delay = 0.5
+    while True:
+        try:
+            await warm_coro_func(*args)
+            return True
+        except Exception as e:
+            if time.time() + delay > deadline:
+                logging.error(f"Pre-warm of {args} failed: {e}")
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5)
+
+async def prewarm(this_nid):
+    global ready, unwarmed_peers
+    peers = load_node_peers(NODE_PEERS_FILE, this_nid)
+    deadline = time.time() + PREWARM_TIMEOUT
+    names = list(peers['sf']) + peers['sl']
+    results = await asyncio.gather(
+        *[warm_with_retry(warm_db_peer, deadline, db_name, sf_node) for sf_node, db_name in peers['sf'].items()],
+        *[warm_with_retry(warm_sl_peer, deadline, sl_nid) for sl_nid in peers['sl']])
+    unwarmed_peers = [name for name, ok in zip(names, results) if not ok]
+    # Ready even if some peers never came up, so one dead peer cannot block the run; /ready lists them
+    ready = True
+    print(f"Pre-warmed {len(names) - len(unwarmed_peers)}/{len(names)} peers for {this_nid}")
+
+async def ready_handler(request):
+    states = await sibling_states()
+    # Worker mode: ready once every worker is up and warmed
+    if not ready or len(states) < n_workers - 1 or not all(state['ready'] for state in states):
+        return web.Response(text="Warming up\n", status=503)
+    unwarmed = set(unwarmed_peers).union(*[state['unwarmed_peers'] for state in states])
+    if unwarmed:
+        return web.Response(text=f"Ready, unreachable peers: {','.join(sorted(unwarmed))}\n", status=200)
+    return web.Response(text="Ready\n", status=200)
+
+async def run_server(this_worker=0, workers=1, port=5000):
+    '''One SL server process; in worker mode (workers > 1) one of the processes sharing port'''
+    global session, packet_store, prewarm_task, request_log, hop_log, span_log, completion_reporter, admission
+    global worker_id, n_workers, hop_prefix, service_time
+    worker_id, n_workers = this_worker, workers
+    # Per worker names, so workers never share a log file or hop id
+    log_name = this_nid if workers == 1 else f"{this_nid}_w{this_worker}"
+    hop_prefix = this_nid if workers == 1 else f"{this_nid}.w{this_worker}"
+    service_time = ServiceTimeModel.from_env()
     session = aiohttp.ClientSession()
+    # Admission limits are per container, split evenly over the workers
+    admission = AdmissionController(max(MAX_INFLIGHT // workers, 1) if MAX_INFLIGHT else 0,
+                                    -(-QUEUE_LEN // workers)) # ceil: at least 1 per worker when queueing is on
+    completion_reporter = CompletionReporter(session)
+    completion_reporter.start()
+    request_log = RequestLog(f"./logs/{log_name}_log", REQUEST_LOG_FORMAT)
+    request_log.start()
+    if HOP_LOG:
+        hop_log = RequestLog(f"./logs/hops/{log_name}_hops", REQUEST_LOG_FORMAT)
+        hop_log.start()
+    if SPAN_LOG:
+        span_log = SpanLog(f"./logs/spans/{log_name}_spans", REQUEST_LOG_FORMAT)
+        span_log.start()
+    packet_store = open_packet_store(PACKET_STORE_DIR, this_nid)
+    if packet_store is not None:
+        print(f"Loaded packet store with {len(packet_store)} tids for {this_nid}")
     app = web.Application()
     app.router.add_post('/', call_handler)
     app.router.add_get('/', call_handler)
     app.router.add_get('/status', status_handler)
+    app.router.add_get('/batch_stats', batch_stats_handler)
+    app.router.add_get('/pool_stats', pool_stats_handler)
+    app.router.add_get('/ready', ready_handler)
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_get('/rct_histogram', rct_histogram_handler)
+    app.router.add_get('/worker_state', worker_state_handler)
 
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', port)
-    await site.start()
-    print(f"Server started on port {port}")
+    if workers == 1:
+        await web.TCPSite(runner, '0.0.0.0', port).start()
+        print(f"Server started on port {port}")
+    else:
+        await web.TCPSite(runner, '0.0.0.0', port, reuse_port=True).start()
+        await web.TCPSite(runner, '127.0.0.1', WORKER_PORT_BASE + this_worker).start()
+        print(f"Worker {this_worker}/{workers} started on port {port} (pid {os.getpid()})")
+    # Serve /status right away (peers warm against it), gate load on /ready
+    prewarm_task = asyncio.create_task(prewarm(this_nid))
+    loop_lag_task = asyncio.create_task(monitor_loop_lag(loop_lag_seconds))
+    # docker stop sends SIGTERM; stop cleanly so buffered log records are flushed
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
     try:
-        await asyncio.Future()  # run forever
-    except KeyboardInterrupt:
+        await stop_event.wait()
         print('Shutting down...')
-        await runner.cleanup()
     finally:
-        await session.close()
         await runner.cleanup()
+        await completion_reporter.close()
+        await session.close()
+        await request_log.close()
+        if hop_log is not None:
+            await hop_log.close()
+        if span_log is not None:
+            await span_log.close()
 
 if __name__ == '__main__':
-    asyncio.run(run_server())
+    n = worker_count(SL_WORKERS)
+    if n == 1:
+        print(f"Event loop: {install_event_loop(SL_EVENT_LOOP)}")
+        asyncio.run(run_server())
+    else:
+        print(f"Starting {n} SL workers")
+        run_workers(run_server, n, SL_EVENT_LOOP)
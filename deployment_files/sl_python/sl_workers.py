@@ -0,0 +1,87 @@
+'''
+Multi-process mode for the SL server.
+
+SL_WORKERS=N (or 'auto': the container's CPU limit) starts N forked worker
+processes that all bind port 5000 with SO_REUSEPORT, so the kernel spreads
+connections across them. Each worker runs its own event loop, aiohttp
+session, datastore pools and log files. Workers also listen on
+127.0.0.1:WORKER_PORT_BASE+i, which siblings use to aggregate /status,
+/ready and /metrics.
+
+SL_EVENT_LOOP=uvloop runs the workers (or the single process) on uvloop when
+it is installed, falling back to the asyncio loop otherwise.
+'''
+import os
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+WORKER_PORT_BASE = int(os.getenv('SL_WORKER_PORT_BASE', '5100'))
+
+
+def cgroup_cpu_limit():
+    '''CPUs allowed by the container's cgroup (v2 cpu.max or v1 cfs quota), None if unlimited'''
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def worker_count(setting):
+    '''setting: 'auto' (CPU limit rounded down, at least 1) or a number'''
+    if setting != 'auto':
+        return max(int(setting), 1)
+    limit = cgroup_cpu_limit()
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    return max(int(min(limit, cpus) if limit else cpus), 1)
+
+
+def install_event_loop(name):
+    if name != 'uvloop':
+        return 'asyncio'
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning("uvloop not installed, using the asyncio event loop")
+        return 'asyncio'
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return 'uvloop'
+
+
+def worker_main(serve, worker_id, n_workers, loop_name):
+    install_event_loop(loop_name)
+    asyncio.run(serve(worker_id, n_workers))
+
+
+def run_workers(serve, n_workers, loop_name):
+    '''
+    serve: async (worker_id, n_workers) -> None, started in each forked worker.
+    Forwards SIGTERM/SIGINT to the workers and waits for them to exit.
+    '''
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=worker_main, args=(serve, worker_id, n_workers, loop_name))
+               for worker_id in range(n_workers)]
+    for worker in workers:
+        worker.start()
+
+    def stop_workers(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, stop_workers)
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,264 @@
+'''
+Compact binary wire format for trace packets.
+
+Node ids and db names are interned into a per-packet string table and
+referenced by u16 index; call lists and data ops are fixed-width arrays.
+The tid and initial node are kept up front so the client can route a
+packet (peek_header) without decoding it, and an SL hop only decodes its
+own calls and the ops they reference (decode_node_view).
+
+Packet layout (little endian), version 2:
+    magic b'MWTP', version u8
+    tid, initial_node, initial_node_type      (u16 len + utf-8 each)
+    string table: u16 blob len, NUL separated utf-8 blob
+    logger nodes: u16 count, u16 str idx each
+    callers:      u16 count, per caller <HHH (str idx, call count, first call idx)
+    calls:        u16 count, per call <HhB (callee str idx, op idx or -1 for SL, async flag)
+    data ops:     u16 count, per op <IBHII (op id, op type, db str idx, obj key, obj size)
+Version 2 added obj size (op_obj_size, 0 if the packet had none); version 1
+packets and files must be regenerated.
+
+Packet files (all_trace_packets.mwpk) are b'MWPF' + u8 version followed by
+u32 length-prefixed encoded packets.
+'''
+import struct
+
+PACKET_MAGIC = b'MWTP'
+PACKET_FILE_MAGIC = b'MWPF'
+CODEC_VERSION = 2
+CONTENT_TYPE = 'application/x-mewbie-packet'
+JSON_CONTENT_TYPE = 'application/json'
+# Span context sent with every packet (client and SL hops): tid, caller's hop id, send time in us
+TID_HEADER = 'X-Mewbie-Tid'
+PARENT_HOP_HEADER = 'X-Mewbie-Parent-Hop'
+SEND_TS_HEADER = 'X-Mewbie-Send-Ts'
+# host:port of the client collector logger nodes report completions to (see completion.py)
+COLLECTOR_HEADER = 'X-Mewbie-Collector'
+# Client's intended send time (us) of the request, forwarded unchanged by every hop
+ORIGIN_TS_HEADER = 'X-Mewbie-Origin-Ts'
+
+U8 = struct.Struct('<B')
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+CALLER = struct.Struct('<HHH')
+CALL = struct.Struct('<HhB')
+DATA_OP = struct.Struct('<IBHII')
+
+OP_TYPES = ['read', 'write']
+OP_TYPE_IDS = {name: idx for idx, name in enumerate(OP_TYPES)}
+OBJ_KEY_PREFIX = 'key_'
+STR_SEP = '\0'
+
+
+def _pack_str(s):
+    b = s.encode('utf-8')
+    return U16.pack(len(b)) + b
+
+
+def _unpack_str(buf, pos):
+    (n,) = U16.unpack_from(buf, pos)
+    pos += U16.size
+    return str(buf[pos:pos + n], 'utf-8'), pos + n
+
+
+def encode_packet(trace_packet):
+    strings = []
+    str_ids = {}
+    def intern(s):
+        idx = str_ids.get(s)
+        if idx is None:
+            idx = str_ids[s] = len(strings)
+            strings.append(s)
+        return idx
+
+    node_calls_dict = trace_packet['node_calls_dict']
+    data_ops_dict = trace_packet['data_ops_dict']
+
+    ops_part = bytearray(U16.pack(len(data_ops_dict)))
+    op_idx = {} # key: op id, value: position in data ops array
+    for op_pkt in data_ops_dict.values():
+        obj_id = op_pkt['op_obj_id']
+        if not obj_id.startswith(OBJ_KEY_PREFIX):
+            raise ValueError(f"Unsupported op_obj_id for binary codec: {obj_id}")
+        op_idx[op_pkt['op_id']] = len(op_idx)
+        ops_part += DATA_OP.pack(op_pkt['op_id'], OP_TYPE_IDS[op_pkt['op_type']],
+                                 intern(op_pkt['db']), int(obj_id[len(OBJ_KEY_PREFIX):]),
+                                 op_pkt.get('op_obj_size', 0))
+
+    logger_ids = [intern(nid) for nid in trace_packet['logger_nodes']]
+    callers_part = bytearray(U16.pack(len(node_calls_dict)))
+    calls_part = bytearray()
+    n_calls = 0
+    for caller, calls in node_calls_dict.items():
+        callers_part += CALLER.pack(intern(caller), len(calls), n_calls)
+        for dm_nid, op_id, async_flag in calls:
+            calls_part += CALL.pack(intern(dm_nid), -1 if op_id == -1 else op_idx[op_id], async_flag)
+        n_calls += len(calls)
+
+    str_blob = STR_SEP.join(strings).encode('utf-8')
+    out = bytearray(PACKET_MAGIC)
+    out += U8.pack(CODEC_VERSION)
+    out += _pack_str(trace_packet['tid'])
+    out += _pack_str(trace_packet['initial_node'])
+    out += _pack_str(trace_packet['initial_node_type'])
+    out += U16.pack(len(str_blob)) + str_blob
+    out += U16.pack(len(logger_ids)) + struct.pack(f'<{len(logger_ids)}H', *logger_ids)
+    out += callers_part
+    out += U16.pack(n_calls) + calls_part
+    out += ops_part
+    return bytes(out)
+
+
+def _check_magic(buf):
+    if bytes(buf[:4]) != PACKET_MAGIC:
+        raise ValueError("Not a binary trace packet")
+    (version,) = U8.unpack_from(buf, 4)
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported trace packet codec version {version}")
+    return 5
+
+
+def peek_header(buf):
+    '''Returns (tid, initial_node, initial_node_type) without decoding the rest.'''
+    pos = _check_magic(buf)
+    tid, pos = _unpack_str(buf, pos)
+    initial_node, pos = _unpack_str(buf, pos)
+    initial_node_type, pos = _unpack_str(buf, pos)
+    return tid, initial_node, initial_node_type
+
+
+def peek_logger_nodes(buf):
+    '''Returns the packet's logger nodes, decoding only the header and string table.'''
+    pos = _check_magic(buf)
+    for _ in range(4): # tid, initial node, initial node type, string table
+        (n,) = U16.unpack_from(buf, pos)
+        pos += U16.size + n
+    strings = str(buf[pos - n:pos], 'utf-8').split(STR_SEP)
+    (n_loggers,) = U16.unpack_from(buf, pos)
+    return [strings[i] for i in struct.unpack_from(f'<{n_loggers}H', buf, pos + U16.size)]
+
+
+def _decode_sections(buf):
+    '''Header fields, string table and section offsets shared by both decoders.'''
+    pos = _check_magic(buf)
+    tid, pos = _unpack_str(buf, pos)
+    initial_node, pos = _unpack_str(buf, pos)
+    initial_node_type, pos = _unpack_str(buf, pos)
+    blob, pos = _unpack_str(buf, pos)
+    strings = blob.split(STR_SEP)
+
+    (n_loggers,) = U16.unpack_from(buf, pos)
+    pos += U16.size
+    logger_ids = struct.unpack_from(f'<{n_loggers}H', buf, pos)
+    pos += n_loggers * U16.size
+
+    (n_callers,) = U16.unpack_from(buf, pos)
+    pos += U16.size
+    callers_pos = pos
+    pos += n_callers * CALLER.size
+    (n_calls,) = U16.unpack_from(buf, pos)
+    calls_pos = pos + U16.size
+    ops_pos = calls_pos + n_calls * CALL.size + U16.size
+    return (tid, initial_node, initial_node_type, strings, logger_ids,
+            buf[callers_pos:callers_pos + n_callers * CALLER.size], calls_pos, ops_pos)
+
+
+def _op_packet(op_id, op_type, db_idx, obj_key, obj_size, strings):
+    return {'op_id': op_id, 'op_type': OP_TYPES[op_type],
+            'op_obj_id': f"{OBJ_KEY_PREFIX}{obj_key}", 'db': strings[db_idx], 'op_obj_size': obj_size}
+
+
+def decode_packet(buf):
+    '''Decodes to the same dict shape as the JSON packet (data_ops_dict keyed by str op id).'''
+    buf = memoryview(buf)
+    (tid, initial_node, initial_node_type, strings, logger_ids,
+     callers, calls_pos, ops_pos) = _decode_sections(buf)
+
+    (n_ops,) = U16.unpack_from(buf, ops_pos - U16.size)
+    ops = list(DATA_OP.iter_unpack(buf[ops_pos:ops_pos + n_ops * DATA_OP.size]))
+    data_ops_dict = {str(op[0]): _op_packet(*op, strings) for op in ops}
+
+    calls = list(CALL.iter_unpack(buf[calls_pos:ops_pos - U16.size]))
+    node_calls_dict = {}
+    for caller_idx, n_calls, first in CALLER.iter_unpack(callers):
+        node_calls_dict[strings[caller_idx]] = [[strings[dm_idx], -1 if op_i == -1 else ops[op_i][0], async_flag]
+                                                for dm_idx, op_i, async_flag in calls[first:first + n_calls]]
+
+    return {
+        'tid': tid,
+        'node_calls_dict': node_calls_dict,
+        'data_ops_dict': data_ops_dict,
+        'initial_node': initial_node,
+        'initial_node_type': initial_node_type,
+        'logger_nodes': [strings[i] for i in logger_ids]
+    }
+
+
+def decode_node_view(buf, nid):
+    '''Decodes only what node nid needs: its calls, the ops they reference and
+    whether it logs. Same dict shape as decode_packet, restricted to nid.'''
+    buf = memoryview(buf)
+    (tid, initial_node, initial_node_type, strings, logger_ids,
+     callers, calls_pos, ops_pos) = _decode_sections(buf)
+
+    node_calls_dict = {}
+    data_ops_dict = {}
+    try:
+        nid_idx = strings.index(nid)
+    except ValueError:
+        nid_idx = -1
+    for caller_idx, n_calls, first in CALLER.iter_unpack(callers):
+        if caller_idx != nid_idx:
+            continue
+        node_calls = []
+        start = calls_pos + first * CALL.size
+        for dm_idx, op_i, async_flag in CALL.iter_unpack(buf[start:start + n_calls * CALL.size]):
+            if op_i == -1:
+                node_calls.append([strings[dm_idx], -1, async_flag])
+                continue
+            op = DATA_OP.unpack_from(buf, ops_pos + op_i * DATA_OP.size)
+            data_ops_dict[str(op[0])] = _op_packet(*op, strings)
+            node_calls.append([strings[dm_idx], op[0], async_flag])
+        node_calls_dict[nid] = node_calls
+        break
+
+    return {
+        'tid': tid,
+        'node_calls_dict': node_calls_dict,
+        'data_ops_dict': data_ops_dict,
+        'initial_node': initial_node,
+        'initial_node_type': initial_node_type,
+        'logger_nodes': [nid] if nid_idx in logger_ids else []
+    }
+
+
+##################### Packet files #################################
+def write_packet_file(file_path, trace_packets):
+    '''trace_packets: iterable of packet dicts. Returns number of packets written.'''
+    count = 0
+    with open(file_path, 'wb') as f:
+        f.write(PACKET_FILE_MAGIC + U8.pack(CODEC_VERSION))
+        for trace_packet in trace_packets:
+            data = encode_packet(trace_packet)
+            f.write(U32.pack(len(data)))
+            f.write(data)
+            count += 1
+    return count
+
+
+def read_packet_file(file_path, offset=None):
+    '''Yields encoded packets (bytes) from a packet file, from byte offset (a packet boundary) if given.'''
+    with open(file_path, 'rb') as f:
+        header = f.read(len(PACKET_FILE_MAGIC) + U8.size)
+        if header[:4] != PACKET_FILE_MAGIC:
+            raise ValueError(f"{file_path} is not a trace packet file")
+        if header[4] != CODEC_VERSION:
+            raise ValueError(f"Unsupported packet file version {header[4]}")
+        if offset is not None:
+            f.seek(offset)
+        while True:
+            size_bytes = f.read(U32.size)
+            if not size_bytes:
+                return
+            (size,) = U32.unpack(size_bytes)
+            yield f.read(size)
@@ -0,0 +1,480 @@
+'''
+Trace packet generation (the pipeline of enrichment.ipynb) as a module and CLI.
+
+Stages, each cached by artifact_cache.py under a key of its inputs and the
+config it reads, so only the stages whose inputs changed are rerun:
+    nodes    prune node details to the nodes seen in the traces and split them
+             over the Databases percentages (SF) and SL types
+             reads: traces, node details, Databases, seed
+             -> node_split_output.json
+    graph    per trace: cycle check, initial node (longest call chain) and
+             logger nodes; trace structure only
+             reads: traces, node details (SF or SL)
+             -> tid_to_logger_nodes.json (+ trace_graph.pkl for packets)
+    packets  one trace packet per acyclic trace
+             reads: traces, graph, node_split_output.json, WorkloadConfig, seed
+             -> all_trace_packets.json / .jsonl / .mwpk
+Outputs are copied from the cache to enrichment_runs/{workload}/; the traces
+pickle is only loaded when a stage that reads it has to run.
+
+Node types and db types are dict lookups, and each trace is handled in one
+pass over its edges. Traces are handed to a pool of forked workers in chunks
+of positions in the traces dict; packets come back encoded and are streamed
+to the output files in trace order, so memory does not grow with the packet
+count.
+
+Randomness depends only on the seed: the node split uses Random(seed), record
+sizes np.random.seed(seed) (as Wl_config in the notebook), and each trace its
+own Random(f"{seed}:{tid}") for async flags, op types and the uniforms its op
+keys are mapped from (one KeySampler batch per trace, see key_sampler.py).
+So the output is the same for any number of workers. The notebook draws from
+one global RNG in trace order instead, so packets differ from a notebook run
+with the same seed.
+
+Usage: python3 enrichment.py [--config enrichment_config.yaml] [--stage all|nodes|packets]
+                             [--traces T.pkl] [--node-details D.pkl] [--workload NAME]
+                             [--seed 50] [--workers N] [--chunk 1000] [--cache-dir D] [--rebuild]
+'''
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import argparse
+import functools
+import multiprocessing
+
+import yaml
+import numpy as np
+
+sys.path.append('./deployment_files/sl_python')
+from key_sampler import KeySampler, access_options
+from artifact_cache import ArtifactCache, CACHE_DIR, place
+from trace_codec import PACKET_FILE_MAGIC, CODEC_VERSION, U8, U32, encode_packet
+
+DEFAULT_TRACES = 'traces/final_500nodes_250ktraces.pkl'
+DEFAULT_NODE_DETAILS = 'node_and_trace_details/final_node_details_data.pkl' # nid: [nis, 'db' or SL type, ...]
+DEFAULT_SEED = 50
+CHUNK_SIZE = 1000 # traces per pool task
+
+
+def pkl_to_dict(file_path):
+    with open(file_path, 'rb') as pkl_file:
+        return pickle.load(pkl_file)
+
+
+def read_yaml(file):
+    with open(file, 'r') as f:
+        return yaml.safe_load(f)
+
+
+##################### Node enrichment #################################
+def prune_node_details(traces_dict, node_dets):
+    '''Keeps the nodes that appear in at least one trace'''
+    nodes_from_traces = set()
+    for e_list in traces_dict.values():
+        for caller, callee in e_list:
+            nodes_from_traces.add(caller)
+            nodes_from_traces.add(callee)
+    return {node: details for node, details in node_dets.items() if node in nodes_from_traces}
+
+
+def percent_to_count(arr, count):
+    '''arr: [[name, percentage], ...] -> [[name, node count], ...] summing to count'''
+    raw_counts = [round(count * (i[1] / 100)) for i in arr]
+    diff = count - sum(raw_counts)
+    idx = 0
+    while diff != 0:
+        raw_counts[idx] += 1 if diff > 0 else -1
+        diff += -1 if diff > 0 else 1
+        idx = (idx + 1) % len(raw_counts)
+    return [[name, raw_counts[idx]] for idx, (name, _) in enumerate(arr)]
+
+
+def assign_nodes_to_types(split_arr, sfsl_arr, node_dets, rng):
+    '''Draws split_arr counts of nodes from sfsl_arr for each type; appends the type to node_dets'''
+    remaining = list(sfsl_arr)
+    split_info = {name: {"count": count, "nodes_list": []} for name, count in split_arr}
+    for name, count in split_arr:
+        for _ in range(count):
+            nid = remaining.pop(rng.randint(0, len(remaining) - 1))
+            node_dets[nid].append(name)
+            split_info[name]["nodes_list"].append(nid)
+    return split_info
+
+
+def split_nodes(traces_dict, node_dets, databases, seed=DEFAULT_SEED):
+    '''
+    Returns node_split_output = {'sf_split': {DB1: {'count': 30, 'nodes_list': [nid1, ...]}, ...},
+                                 'sl_split': {'Python': {...}}}
+    '''
+    node_dets = prune_node_details(traces_dict, node_dets)
+    sf_arr = [nid for nid, n_info in node_dets.items() if n_info[1] == "db"]
+    sl_arr = [nid for nid, n_info in node_dets.items() if n_info[1] != "db"]
+    print(f"Nodes in traces: {len(node_dets)} (SF: {len(sf_arr)}, SL: {len(sl_arr)})")
+
+    db_split_arr = percent_to_count([[db_name, info['percentage']] for db_name, info in databases.items()],
+                                    len(sf_arr))
+    print("Database split:", db_split_arr)
+    rng = random.Random(seed)
+    return {'sf_split': assign_nodes_to_types(db_split_arr, sf_arr, node_dets, rng),
+            'sl_split': assign_nodes_to_types([['Python', len(sl_arr)]], sl_arr, node_dets, rng)}
+
+
+##################### Workload config #################################
+class Wl_config:
+    """
+    Format: record_count, record_size_dist,
+                 data_access_pattern, rw_ratio, async_sync_ratio, seed
+    """
+    def __init__(self, record_count, record_size_dist,
+                 data_access_pattern, rw_ratio, async_sync_ratio, seed, max_record_size=1 << 20,
+                 **access_opts):
+        self.record_count = record_count
+        self.record_size_dist = record_size_dist
+        self.max_record_size = max_record_size
+        self.data_access_pattern = data_access_pattern
+        self.rw_ratio = rw_ratio
+        self.async_sync_ratio = async_sync_ratio
+        self.seed = seed
+
+        np.random.seed(self.seed)
+        self.obj_ids_list = np.arange(1, self.record_count + 1)
+        self.obj_sizes = self.generate_object_sizes()
+        self.key_sampler = KeySampler(self.record_count, self.data_access_pattern, seed=self.seed, **access_opts)
+
+    @classmethod
+    def from_config(cls, wl_cfg, seed):
+        return cls(wl_cfg['record_count'], wl_cfg['record_size_dist'], wl_cfg['data_access_pattern'],
+                   wl_cfg['rw_ratio'], wl_cfg['async_sync_ratio'], seed,
+                   max_record_size=wl_cfg.get('max_record_size', 1 << 20), **access_options(wl_cfg))
+
+    def generate_object_sizes(self):
+        if self.record_size_dist == 'lognormal':
+            return np.random.lognormal(mean=np.log(self.record_count), sigma=np.log(self.record_count),
+                                       size=self.record_count)
+        if self.record_size_dist == 'uniform':
+            return np.random.uniform(low=1, high=self.record_count, size=self.record_count)
+        raise ValueError('Invalid record size distribution, only lognormal & uniform are allowed for now')
+
+    def record_sizes(self):
+        '''Record sizes in bytes indexed by obj id (index 0 unused), clamped to [1, max_record_size]'''
+        sizes = np.clip(np.rint(self.obj_sizes), 1, self.max_record_size).astype(np.int64)
+        return [0] + sizes.tolist()
+
+
+##################### Trace packets #################################
+class PacketContext:
+    '''Everything a worker needs to build packets, derived once from the node split and Wl_config'''
+    def __init__(self, node_split_output, wl_config, seed):
+        self.seed = seed
+        self.node_types = {} # key: nid, value: SL type or DB name
+        for services in node_split_output.values():
+            for service, service_data in services.items():
+                for nid in service_data['nodes_list']:
+                    self.node_types.setdefault(nid, service)
+        self.sf_db = {nid: db_name for db_name, db_info in node_split_output['sf_split'].items()
+                      for nid in db_info['nodes_list']}
+        self.key_sampler = wl_config.key_sampler
+        self.record_sizes = wl_config.record_sizes()
+        self.w_prob = wl_config.rw_ratio / (1 + wl_config.rw_ratio)
+        self.async_prob = wl_config.async_sync_ratio / (1 + wl_config.async_sync_ratio)
+
+
+def has_cycle(callees):
+    '''Kahn's algorithm; callees: node -> list of called nodes'''
+    indegree = {}
+    for node, node_callees in callees.items():
+        indegree.setdefault(node, 0)
+        for callee in node_callees:
+            indegree[callee] = indegree.get(callee, 0) + 1
+    ready = [node for node, deg in indegree.items() if deg == 0]
+    visited = 0
+    while ready:
+        node = ready.pop()
+        visited += 1
+        for callee in callees.get(node, ()):
+            indegree[callee] -= 1
+            if indegree[callee] == 0:
+                ready.append(callee)
+    return visited < len(indegree)
+
+
+def get_logger_nodes(callees, sf_nodes):
+    '''
+    Nodes that log for the request: SL leaf nodes, and the SL callers of SF
+    leaf nodes (leaves are called but never call). In first seen order.
+    '''
+    logger_nodes = {}
+    for node, node_callees in callees.items():
+        for callee in node_callees:
+            if callee not in callees:
+                logger_nodes[node if callee in sf_nodes else callee] = None
+    return list(logger_nodes)
+
+
+def find_inode_and_graph_depth(edges):
+    '''
+    Node with the longest call chain below it (first such node in edge order)
+    and that depth in nodes, ignoring self calls. The graph must be acyclic.
+    '''
+    successors = {}
+    for caller, callee in edges:
+        successors.setdefault(caller, set())
+        successors.setdefault(callee, set())
+        if caller != callee:
+            successors[caller].add(callee)
+    depth = {}
+    for root in successors:
+        if root in depth:
+            continue
+        stack = [(root, iter(successors[root]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child not in depth:
+                    stack.append((child, iter(successors[child])))
+                    break
+            else:
+                stack.pop()
+                depth[node] = 1 + max((depth[child] for child in successors[node]), default=0)
+    ini_node, max_depth = '', -1
+    for node in successors:
+        if depth[node] > max_depth:
+            ini_node, max_depth = node, depth[node]
+    return ini_node, max_depth
+
+
+def trace_graph_info(edges, sf_nodes):
+    '''(initial node, logger nodes) of a trace, or None if its call graph (without self calls) has a cycle'''
+    callees = {}
+    for caller, callee in edges:
+        node_callees = callees.setdefault(caller, [])
+        if callee != caller:
+            node_callees.append(callee)
+    if has_cycle(callees):
+        return None
+    ini_node, _ = find_inode_and_graph_depth(edges)
+    return ini_node, get_logger_nodes(callees, sf_nodes)
+
+
+def make_trace_packet(tid, edges, graph_info, ctx):
+    '''graph_info: the trace's (initial node, logger nodes) from trace_graph_info'''
+    rng = random.Random(f"{ctx.seed}:{tid}")
+    rand = rng.random
+    # node_calls_dict = Key: dm node, Value: list of [dm node, op_id (-1 for SL), async_flag]
+    node_calls_dict = {}
+    for caller, callee in edges:
+        node_calls_dict.setdefault(caller, []).append([callee, -1, 1 if rand() < ctx.async_prob else 0])
+
+    op_dbs = [] # db of each op, op id = position + 1
+    for calls in node_calls_dict.values():
+        for call in calls:
+            db_name = ctx.sf_db.get(call[0])
+            if db_name is not None:
+                op_dbs.append(db_name)
+                call[1] = len(op_dbs)
+    # Keys for all of the trace's ops in one batch (key_sampler.py)
+    obj_ids = ctx.key_sampler.keys([rand() for _ in op_dbs]).tolist() if op_dbs else []
+    data_ops_dict = {}
+    for op_id, (db_name, op_obj_id) in enumerate(zip(op_dbs, obj_ids), 1):
+        data_ops_dict[op_id] = {
+            'op_id': op_id,
+            'op_type': 'write' if rand() < ctx.w_prob else 'read',
+            'op_obj_id': f"key_{op_obj_id}",
+            'db': db_name,
+            'op_obj_size': ctx.record_sizes[op_obj_id] # bytes written by the SL shim
+        }
+
+    for node, calls in node_calls_dict.items():
+        node_calls_dict[node] = [call for call in calls if call[0] != node]
+    ini_node, logger_nodes = graph_info
+    return {
+        "tid": tid,
+        "node_calls_dict": node_calls_dict,
+        "data_ops_dict": data_ops_dict,
+        "initial_node": ini_node,
+        "initial_node_type": ctx.node_types.get(ini_node),
+        "logger_nodes": logger_nodes
+    }
+
+
+_job = {} # trace items and stage inputs, set before the pool forks (sequences are lists, sliced per chunk)
+
+
+def as_list(items):
+    return items if isinstance(items, list) else list(items)
+
+
+def graph_chunk(bounds):
+    begin, end = bounds
+    sf_nodes = _job['sf_nodes']
+    return [trace_graph_info(edges, sf_nodes) for _, edges in _job['traces'][begin:end]]
+
+
+def encode_chunk(bounds):
+    '''Encoded packets (tid, json line, binary) for trace positions [begin, end), None for traces with a cycle'''
+    begin, end = bounds
+    ctx = _job['ctx']
+    out = []
+    for (tid, edges), graph_info in zip(_job['traces'][begin:end], _job['graph'][begin:end]):
+        if graph_info is None:
+            out.append(None)
+            continue
+        trace_packet = make_trace_packet(tid, edges, graph_info, ctx)
+        out.append((tid, json.dumps(trace_packet, separators=(',', ':')), encode_packet(trace_packet)))
+    return out
+
+
+def run_chunks(func, n_items, workers, chunk_size):
+    '''Yields func((begin, end)) over n_items in order, on a pool of forked workers when workers > 1'''
+    chunks = [(begin, min(begin + chunk_size, n_items)) for begin in range(0, n_items, chunk_size)]
+    if workers <= 1:
+        yield from map(func, chunks)
+        return
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        yield from pool.imap(func, chunks)
+
+
+class PacketWriter:
+    '''Streams packets to all_trace_packets.{json,jsonl,mwpk}'''
+    def __init__(self, out_dir):
+        self.json_file = open(os.path.join(out_dir, 'all_trace_packets.json'), 'w')
+        self.lines_file = open(os.path.join(out_dir, 'all_trace_packets.jsonl'), 'w')
+        self.bin_file = open(os.path.join(out_dir, 'all_trace_packets.mwpk'), 'wb')
+        self.bin_file.write(PACKET_FILE_MAGIC + U8.pack(CODEC_VERSION))
+        self.json_file.write('{')
+        self.count = 0
+
+    def write(self, tid, line, data):
+        self.json_file.write(f"{', ' if self.count else ''}{json.dumps(tid)}: {line}")
+        self.lines_file.write(line + '\n')
+        self.bin_file.write(U32.pack(len(data)))
+        self.bin_file.write(data)
+        self.count += 1
+
+    def close(self):
+        self.json_file.write('}')
+        for f in (self.json_file, self.lines_file, self.bin_file):
+            f.close()
+
+
+def gen_trace_graph(trace_items, sf_nodes, out_dir, workers=1, chunk_size=CHUNK_SIZE):
+    '''
+    Writes trace_graph.pkl (per trace position: (initial node, logger nodes) or
+    None for a cycle) and tid_to_logger_nodes.json to out_dir; returns the list
+    '''
+    _job.update(traces=as_list(trace_items), sf_nodes=sf_nodes)
+    graph = []
+    for chunk in run_chunks(graph_chunk, len(trace_items), workers, chunk_size):
+        graph.extend(chunk)
+    _job.clear()
+    with open(os.path.join(out_dir, 'trace_graph.pkl'), 'wb') as f:
+        pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(out_dir, 'tid_to_logger_nodes.json'), 'w') as f:
+        json.dump({tid: info[1] for (tid, _), info in zip(trace_items, graph) if info is not None}, f)
+    return graph
+
+
+def gen_trace_packets(trace_items, graph, ctx, out_dir, workers=1, chunk_size=CHUNK_SIZE):
+    '''Writes the packets of the acyclic traces to out_dir; returns (packets written, traces with a cycle)'''
+    _job.update(traces=as_list(trace_items), graph=as_list(graph), ctx=ctx)
+    writer = PacketWriter(out_dir)
+    cycle_ctr = 0
+    try:
+        for chunk in run_chunks(encode_chunk, len(trace_items), workers, chunk_size):
+            for entry in chunk:
+                if entry is None:
+                    cycle_ctr += 1
+                else:
+                    writer.write(*entry)
+    finally:
+        writer.close()
+        _job.clear()
+    return writer.count, cycle_ctr
+
+
+##################### Pipeline #################################
+# Bump a stage's version when its output for the same inputs changes
+STAGE_VERSIONS = {'nodes': 1, 'graph': 1, 'packets': 1}
+PACKET_FILES = ['all_trace_packets.json', 'all_trace_packets.jsonl', 'all_trace_packets.mwpk']
+
+
+@functools.lru_cache(maxsize=None)
+def load_pickle(path):
+    st = time.time()
+    data = pkl_to_dict(path)
+    print(f"Loaded {path} in {time.time() - st:.1f}s")
+    return data
+
+
+@functools.lru_cache(maxsize=None)
+def load_trace_items(path):
+    return list(load_pickle(path).items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the node split and trace packets for a workload")
+    parser.add_argument('--config', default='enrichment_config.yaml')
+    parser.add_argument('--stage', choices=['all', 'nodes', 'packets'], default='all',
+                        help="packets alone reuses the workload's node_split_output.json")
+    parser.add_argument('--traces', default=DEFAULT_TRACES, help="pickled traces dict (tid: edge list)")
+    parser.add_argument('--node-details', default=DEFAULT_NODE_DETAILS, help="pickled node details dict")
+    parser.add_argument('--workload', help="output dir under enrichment_runs/ (default: ExpWorkloadName)")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help="traces per worker task")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="stage artifact cache (artifact_cache.py)")
+    parser.add_argument('--rebuild', action='store_true', help="rerun every stage, replacing cached artifacts")
+    args = parser.parse_args()
+
+    config = read_yaml(args.config)
+    out_dir = os.path.join('enrichment_runs', args.workload or config['ExpWorkloadName'])
+    os.makedirs(out_dir, exist_ok=True)
+    split_path = os.path.join(out_dir, 'node_split_output.json')
+    workers = max(args.workers, 1)
+    cache = ArtifactCache(args.cache_dir, rebuild=args.rebuild)
+    trace_inputs = {'traces': cache.file_digest(args.traces), 'node_details': cache.file_digest(args.node_details)}
+
+    if args.stage in ('all', 'nodes'):
+        def build_nodes(entry):
+            node_dets = {nid: list(n_info) for nid, n_info in load_pickle(args.node_details).items()}
+            node_split_output = split_nodes(load_pickle(args.traces), node_dets, config['Databases'], args.seed)
+            with open(os.path.join(entry, 'node_split_output.json'), 'w') as f:
+                json.dump(node_split_output, f)
+        _, entry = cache.run('nodes', STAGE_VERSIONS['nodes'], trace_inputs,
+                             # a list: the split assigns nodes to databases in config order
+                             {'databases': [[name, info['percentage']] for name, info in config['Databases'].items()],
+                              'seed': args.seed}, build_nodes)
+        place(entry, 'node_split_output.json', out_dir)
+        print(f"Wrote {split_path}")
+    if args.stage == 'nodes':
+        return
+
+    def build_graph(entry):
+        sf_nodes = {nid for nid, n_info in load_pickle(args.node_details).items() if n_info[1] == "db"}
+        gen_trace_graph(load_trace_items(args.traces), sf_nodes, entry, workers, args.chunk)
+    graph_key, graph_entry = cache.run('graph', STAGE_VERSIONS['graph'], trace_inputs, {}, build_graph)
+    place(graph_entry, 'tid_to_logger_nodes.json', out_dir)
+
+    def build_packets(entry):
+        with open(split_path) as f:
+            node_split_output = json.load(f)
+        with open(os.path.join(graph_entry, 'trace_graph.pkl'), 'rb') as f:
+            graph = pickle.load(f)
+        ctx = PacketContext(node_split_output, Wl_config.from_config(config['WorkloadConfig'], args.seed), args.seed)
+        st = time.time()
+        written, cycle_ctr = gen_trace_packets(load_trace_items(args.traces), graph, ctx, entry, workers, args.chunk)
+        print(f"Built {written} trace packets in {time.time() - st:.1f}s (skipped {cycle_ctr} traces with a cycle)")
+    packet_inputs = {'traces': trace_inputs['traces'], 'graph': graph_key, 'node_split': cache.file_digest(split_path)}
+    _, packets_entry = cache.run('packets', STAGE_VERSIONS['packets'], packet_inputs,
+                                 {'workload': config['WorkloadConfig'], 'seed': args.seed, 'codec': CODEC_VERSION},
+                                 build_packets)
+    for name in PACKET_FILES:
+        place(packets_entry, name, out_dir)
+    print(f"Wrote trace packets and tid_to_logger_nodes.json to {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+'''
+Key access distributions for data ops, after the YCSB request distributions.
+
+Keys are obj ids 1..record_count (op_obj_id key_{id}). A KeySampler turns
+uniform draws u in [0, 1) into obj ids by inverse CDF, vectorized with numpy,
+so a batch of ops costs one searchsorted however skewed the distribution:
+    uniform   every key equally likely
+    zipfian   P(rank r) ~ 1 / r^theta (YCSB theta 0.99); with scramble (YCSB's
+              default ScrambledZipfian) ranks are spread over the key space by
+              FNV-1a 64 hash, otherwise rank r is key r
+    latest    zipfian over recency: the last inserted key (record_count) is the
+              most popular, then record_count - 1, ... (SkewedLatest)
+    hotspot   hot_op_fraction of ops go uniformly to the first
+              hot_set_fraction of the keys, the rest uniformly to the others
+
+Enrichment draws the uniforms from the per-trace RNG and maps them in one
+batch (keys()); sample() and next_key() draw from the sampler's own seeded
+numpy generator, next_key() from a table refilled TABLE_SIZE keys at a time.
+'''
+import numpy as np
+
+PATTERNS = ('uniform', 'zipfian', 'latest', 'hotspot')
+ZIPFIAN_THETA = 0.99
+HOT_SET_FRACTION = 0.2
+HOT_OP_FRACTION = 0.8
+TABLE_SIZE = 1 << 16
+FNV_OFFSET_BASIS_64 = 0xCBF29CE484222325
+FNV_PRIME_64 = 1099511628211
+
+
+def fnv_hash64(values):
+    '''YCSB Utils.fnvhash64 over a uint64 array (FNV-1a of the 8 little endian bytes, abs as signed)'''
+    values = values.astype(np.uint64)
+    hashval = np.full(values.shape, FNV_OFFSET_BASIS_64, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for shift in range(0, 64, 8):
+            hashval ^= (values >> np.uint64(shift)) & np.uint64(0xff)
+            hashval *= np.uint64(FNV_PRIME_64)
+    return np.abs(hashval.view(np.int64)).view(np.uint64)
+
+
+def access_options(wl_cfg):
+    '''KeySampler keyword args from the WorkloadConfig block of enrichment_config.yaml'''
+    return {'theta': wl_cfg.get('zipfian_theta', ZIPFIAN_THETA),
+            'scramble': wl_cfg.get('zipfian_scramble', True),
+            'hot_set_fraction': wl_cfg.get('hotspot_set_fraction', HOT_SET_FRACTION),
+            'hot_op_fraction': wl_cfg.get('hotspot_op_fraction', HOT_OP_FRACTION)}
+
+
+class KeySampler:
+    def __init__(self, record_count, pattern='uniform', theta=ZIPFIAN_THETA, scramble=True,
+                 hot_set_fraction=HOT_SET_FRACTION, hot_op_fraction=HOT_OP_FRACTION, seed=None):
+        if pattern not in PATTERNS:
+            raise ValueError(f"Invalid data access pattern {pattern}, allowed: {', '.join(PATTERNS)}")
+        if not 0 < hot_op_fraction <= 1:
+            raise ValueError(f"hot_op_fraction must be in (0, 1], got {hot_op_fraction}")
+        self.record_count = record_count
+        self.pattern = pattern
+        self.cdf = None # zipfian/latest: cumulative probability by rank (rank 1 first)
+        self.rank_keys = None # zipfian with scramble: obj id of each rank
+        if pattern in ('zipfian', 'latest'):
+            weights = np.arange(1, record_count + 1, dtype=np.float64) ** -theta
+            self.cdf = np.cumsum(weights)
+            self.cdf /= self.cdf[-1]
+            if pattern == 'zipfian' and scramble:
+                self.rank_keys = fnv_hash64(np.arange(record_count)) % np.uint64(record_count) + np.uint64(1)
+        self.hot_keys = max(min(int(record_count * hot_set_fraction), record_count), 1)
+        self.hot_op_fraction = hot_op_fraction
+        self.rng = np.random.default_rng(seed)
+        self.table = None
+        self.cursor = TABLE_SIZE
+
+    def keys(self, uniforms):
+        '''Obj ids (int64 array) for uniform draws in [0, 1)'''
+        u = np.asarray(uniforms, dtype=np.float64)
+        n = self.record_count
+        if self.pattern == 'uniform':
+            return (u * n).astype(np.int64) + 1
+        if self.pattern == 'hotspot':
+            cold_keys = n - self.hot_keys
+            if cold_keys == 0 or self.hot_op_fraction == 1:
+                return (u * self.hot_keys).astype(np.int64) + 1
+            hot = u < self.hot_op_fraction
+            hot_ids = (u / self.hot_op_fraction * self.hot_keys).astype(np.int64) + 1
+            cold_ids = ((u - self.hot_op_fraction) / (1 - self.hot_op_fraction) * cold_keys).astype(np.int64) \
+                + self.hot_keys + 1
+            return np.minimum(np.where(hot, hot_ids, cold_ids), n)
+        ranks = np.minimum(np.searchsorted(self.cdf, u, side='right'), n - 1) # 0 based
+        if self.pattern == 'latest':
+            return n - ranks
+        if self.rank_keys is not None:
+            return self.rank_keys[ranks].astype(np.int64)
+        return ranks + 1
+
+    def sample(self, count):
+        '''count obj ids from the sampler's own generator'''
+        return self.keys(self.rng.random(count))
+
+    def next_key(self):
+        if self.cursor >= TABLE_SIZE:
+            self.table = self.sample(TABLE_SIZE).tolist()
+            self.cursor = 0
+        key = self.table[self.cursor]
+        self.cursor += 1
+        return key
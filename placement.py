@@ -0,0 +1,362 @@
+'''
+Traffic-aware placement of containers on the labeled swarm hosts.
+
+Every container is pinned to a host through `node.labels.slot == slotN`.
+Round robin over the node list (the old j % 4) ignores who talks to whom, so
+most hops cross the overlay network. This places them by traffic instead:
+    graph      one edge per (caller, callee) pair in the trace packets,
+               weighted by call count, sync calls x sync_weight and async
+               ones x async_weight (async calls are off the critical path
+               but still cost overlay bandwidth)
+    partition  two starts: largest nodes first, each to the slot it already
+               has the most traffic with among those with CPU and memory left
+               for it; and round robin. Each is refined by node moves that
+               fit and swaps of same-size nodes while they lower the
+               cross-slot weight (Kernighan-Lin style, greedy, no negative
+               gain steps), and the lower cut wins, so the result is never
+               worse than round robin when round robin fits
+    capacity   a node's demand is its container's CPU and memory limit; a
+               slot's capacity is the configured host size, or by default
+               an equal share of the total demand plus `imbalance` slack
+The report gives the expected fraction of cross-host calls (and of weight)
+for this placement and for round robin.
+
+container_setup.py places the containers it generates this way (Placement
+block of enrichment_config.yaml). Run standalone, this reports what the
+placement would be for the containers and limits of an existing compose file.
+
+Usage: python3 placement.py [--workload cons_exp] [--compose docker-compose.yml] [--slots 4] [--out placement.json]
+'''
+import os
+import json
+import argparse
+
+import yaml
+
+SYNC_WEIGHT = 1.0
+ASYNC_WEIGHT = 0.5
+IMBALANCE = 0.1 # slot capacity slack over an equal share when host sizes are not given
+REFINE_PASSES = 10
+STRATEGIES = ('traffic', 'round_robin')
+
+
+def slot_label(slot_index):
+    return f"slot{slot_index}"
+
+
+def placement_constraint(slot):
+    return f'node.labels.slot == {slot}'
+
+
+def iter_trace_packets(workload_dir):
+    '''Packets of an enrichment run, streamed from the jsonl output when there is one'''
+    jsonl_path = os.path.join(workload_dir, 'all_trace_packets.jsonl')
+    if os.path.exists(jsonl_path):
+        with open(jsonl_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    with open(os.path.join(workload_dir, 'all_trace_packets.json')) as f:
+        yield from json.load(f).values()
+
+
+def comm_graph(trace_packets, sync_weight=SYNC_WEIGHT, async_weight=ASYNC_WEIGHT):
+    '''
+    Returns (weights, calls): key (a, b) with a < b, value summed edge weight
+    and call count, over every call in every packet, both directions merged
+    '''
+    weights = {}
+    calls = {}
+    for trace_packet in trace_packets:
+        for nid, node_calls in trace_packet['node_calls_dict'].items():
+            for dm_nid, _, async_flag in node_calls:
+                if dm_nid == nid:
+                    continue
+                edge = (nid, dm_nid) if nid < dm_nid else (dm_nid, nid)
+                weights[edge] = weights.get(edge, 0) + (async_weight if async_flag else sync_weight)
+                calls[edge] = calls.get(edge, 0) + 1
+    return weights, calls
+
+
+def adjacency(weights):
+    adj = {}
+    for (a, b), w in weights.items():
+        adj.setdefault(a, {})[b] = w
+        adj.setdefault(b, {})[a] = w
+    return adj
+
+
+def slot_capacities(demands, n_slots, slot_cpus=None, slot_memory=None, imbalance=IMBALANCE):
+    '''
+    demands: nid -> (cpus, memory GB). Capacity per slot as [cpus, memory GB]:
+    the given host sizes, or an equal share of the total demand plus imbalance
+    '''
+    total_cpus = sum(cpus for cpus, _ in demands.values())
+    total_memory = sum(memory for _, memory in demands.values())
+    cpus = slot_cpus if slot_cpus else total_cpus / n_slots * (1 + imbalance)
+    memory = slot_memory if slot_memory else total_memory / n_slots * (1 + imbalance)
+    return [[cpus, memory] for _ in range(n_slots)]
+
+
+class Placement:
+    '''
+    Partitions nodes over n_slots slots. demands: nid -> (cpus, memory GB),
+    every container to place; weights: comm_graph edge weights.
+    conn[nid][slot] is the traffic weight between nid and the nodes placed on
+    slot, kept up to date on every assign/unassign so move gains are O(1).
+    '''
+    def __init__(self, demands, weights, n_slots, capacities):
+        self.demands = demands
+        self.adj = adjacency({edge: w for edge, w in weights.items() if edge[0] in demands and edge[1] in demands})
+        self.n_slots = n_slots
+        self.capacities = capacities
+        self.reset()
+
+    def reset(self):
+        self.used = [[0.0, 0.0] for _ in range(self.n_slots)]
+        self.conn = {nid: [0.0] * self.n_slots for nid in self.demands}
+        self.slot_of = {} # key: nid, value: slot index
+        self.overflow = [] # nodes placed on a slot without room for them
+
+    def fits(self, nid, slot):
+        cpus, memory = self.demands[nid]
+        used, capacity = self.used[slot], self.capacities[slot]
+        return used[0] + cpus <= capacity[0] + 1e-9 and used[1] + memory <= capacity[1] + 1e-9
+
+    def load(self, slot):
+        '''Fraction of the slot's tighter resource in use'''
+        used, capacity = self.used[slot], self.capacities[slot]
+        return max(used[0] / capacity[0] if capacity[0] else 0, used[1] / capacity[1] if capacity[1] else 0)
+
+    def assign(self, nid, slot):
+        cpus, memory = self.demands[nid]
+        self.used[slot][0] += cpus
+        self.used[slot][1] += memory
+        self.slot_of[nid] = slot
+        for peer, w in self.adj.get(nid, {}).items():
+            self.conn[peer][slot] += w
+
+    def unassign(self, nid):
+        cpus, memory = self.demands[nid]
+        slot = self.slot_of.pop(nid)
+        self.used[slot][0] -= cpus
+        self.used[slot][1] -= memory
+        for peer, w in self.adj.get(nid, {}).items():
+            self.conn[peer][slot] -= w
+        return slot
+
+    def cut(self):
+        return sum(w for nid, peers in self.adj.items() for peer, w in peers.items()
+                   if nid < peer and self.slot_of[nid] != self.slot_of[peer])
+
+    def initial(self):
+        '''
+        Largest containers first (first fit decreasing, so small ones fill the
+        gaps), by traffic within a size; each to the fitting slot it has the
+        most traffic with, ties to the least loaded
+        '''
+        degree = {nid: sum(self.adj.get(nid, {}).values()) for nid in self.demands}
+        capacity = self.capacities[0]
+        size = {nid: max(cpus / capacity[0] if capacity[0] else 0, memory / capacity[1] if capacity[1] else 0)
+                for nid, (cpus, memory) in self.demands.items()}
+        for nid in sorted(self.demands, key=lambda nid: (-size[nid], -degree[nid], nid)):
+            to_slot = self.conn[nid]
+            fitting = [slot for slot in range(self.n_slots) if self.fits(nid, slot)]
+            if fitting:
+                slot = max(fitting, key=lambda slot: (to_slot[slot], -self.load(slot), -slot))
+            else:
+                slot = min(range(self.n_slots), key=self.load)
+                self.overflow.append(nid)
+            self.assign(nid, slot)
+
+    def start_from(self, slot_of):
+        for nid in sorted(self.demands):
+            slot = slot_of[nid]
+            if not self.fits(nid, slot):
+                self.overflow.append(nid)
+            self.assign(nid, slot)
+
+    def refine(self, passes=REFINE_PASSES):
+        '''
+        Per node, the best of: a move to a slot with room, or a swap with a node
+        of the same size on another slot (always fits), if it lowers the cut.
+        Repeats while a pass improves anything.
+        '''
+        by_size = {} # key: (slot, demand), value: nids
+        for nid, slot in self.slot_of.items():
+            by_size.setdefault((slot, self.demands[nid]), set()).add(nid)
+        for _ in range(passes):
+            improved = 0
+            for nid in sorted(self.adj):
+                current = self.slot_of[nid]
+                to_slot = self.conn[nid]
+                demand = self.demands[nid]
+                best_gain, best_slot, best_peer = 1e-9, None, None
+                for slot in range(self.n_slots):
+                    gain = to_slot[slot] - to_slot[current]
+                    if slot == current or gain <= 0:
+                        continue # a swap cannot make up for a move that loses weight (gain <= 0) by itself
+                    if gain > best_gain and self.fits(nid, slot):
+                        best_gain, best_slot, best_peer = gain, slot, None
+                    peers = self.adj[nid]
+                    for other in by_size.get((slot, demand), ()):
+                        conn = self.conn[other]
+                        swap_gain = gain + conn[current] - conn[slot] - 2 * peers.get(other, 0)
+                        if swap_gain > best_gain:
+                            best_gain, best_slot, best_peer = swap_gain, slot, other
+                if best_slot is None:
+                    continue
+                self.unassign(nid)
+                by_size[(current, demand)].discard(nid)
+                if best_peer is not None:
+                    self.unassign(best_peer)
+                    by_size[(best_slot, demand)].discard(best_peer)
+                    self.assign(best_peer, current)
+                    by_size[(current, demand)].add(best_peer)
+                self.assign(nid, best_slot)
+                by_size.setdefault((best_slot, demand), set()).add(nid)
+                improved += 1
+            if not improved:
+                break
+
+    def solve(self, baseline, passes=REFINE_PASSES):
+        '''
+        Refines two starts, the traffic greedy one and baseline (a placement to
+        improve on, e.g. round robin), and keeps the one with the lower cut,
+        preferring one where every node fits
+        '''
+        best = None
+        for start in (self.initial, lambda: self.start_from(baseline)):
+            self.reset()
+            start()
+            self.refine(passes)
+            result = (len(self.overflow) > 0, self.cut(), dict(self.slot_of), list(self.overflow))
+            if best is None or result[:2] < best[:2]:
+                best = result
+        self.slot_of, self.overflow = best[2], best[3]
+        return self.slot_of
+
+
+def cross_host(slot_of, weights, calls):
+    '''Fraction of calls and of edge weight between nodes on different slots (edges with an unplaced end skipped)'''
+    total_calls = total_weight = cut_calls = cut_weight = 0
+    for edge, w in weights.items():
+        a, b = slot_of.get(edge[0]), slot_of.get(edge[1])
+        if a is None or b is None:
+            continue
+        total_calls += calls[edge]
+        total_weight += w
+        if a != b:
+            cut_calls += calls[edge]
+            cut_weight += w
+    return {'calls': total_calls, 'cross_host_calls': cut_calls,
+            'cross_host_call_fraction': cut_calls / total_calls if total_calls else 0,
+            'cross_host_weight_fraction': cut_weight / total_weight if total_weight else 0}
+
+
+def round_robin(node_groups, n_slots):
+    '''The old placement: j % n_slots by index in each service's node list'''
+    return {nid: j % n_slots for nodes in node_groups for j, nid in enumerate(nodes)}
+
+
+def place_nodes(node_groups, demands, trace_packets, placement_cfg):
+    '''
+    node_groups: per service node lists (round robin order), demands: nid ->
+    (cpus, memory GB), placement_cfg: the Placement block of
+    enrichment_config.yaml. Returns (slot label per nid, report dict).
+    '''
+    n_slots = placement_cfg.get('slots', 4)
+    strategy = placement_cfg.get('strategy', 'traffic')
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Invalid placement strategy {strategy}, allowed: {', '.join(STRATEGIES)}")
+    weights, calls = comm_graph(trace_packets, placement_cfg.get('sync_weight', SYNC_WEIGHT),
+                                placement_cfg.get('async_weight', ASYNC_WEIGHT))
+    baseline = round_robin(node_groups, n_slots)
+    report = {'strategy': strategy, 'slots': n_slots, 'round_robin': cross_host(baseline, weights, calls)}
+    if strategy == 'round_robin':
+        slot_of = baseline
+    else:
+        capacities = slot_capacities(demands, n_slots, placement_cfg.get('slot_cpus'),
+                                     placement_cfg.get('slot_memory_gb'), placement_cfg.get('imbalance', IMBALANCE))
+        placement = Placement(demands, weights, n_slots, capacities)
+        slot_of = placement.solve(baseline, placement_cfg.get('refine_passes', REFINE_PASSES))
+        report['capacity'] = capacities[0]
+        report['overflow'] = placement.overflow
+    report['placement'] = cross_host(slot_of, weights, calls)
+    report['slot_usage'] = {slot_label(slot): [0, 0] for slot in range(n_slots)}
+    for nid, slot in slot_of.items():
+        usage = report['slot_usage'][slot_label(slot)]
+        usage[0] += demands[nid][0]
+        usage[1] += demands[nid][1]
+    return {nid: slot_label(slot) for nid, slot in slot_of.items()}, report
+
+
+def parse_memory_gb(memory):
+    '''Compose memory limit ('4G', '512M', bytes) in GB'''
+    memory = str(memory).strip().upper().rstrip('B')
+    scale = {'K': 1 / (1 << 20), 'M': 1 / 1024, 'G': 1, 'T': 1024}
+    if memory and memory[-1] in scale:
+        return float(memory[:-1]) * scale[memory[-1]]
+    return float(memory) / (1 << 30)
+
+
+def compose_demands(compose_file):
+    '''(cpus, memory GB) limits of the slot-placed containers of a compose file, by container name'''
+    with open(compose_file) as f:
+        services = yaml.safe_load(f)['services']
+    demands = {}
+    for service in services.values():
+        deploy = service.get('deploy', {})
+        if not any('node.labels.slot' in c for c in deploy.get('placement', {}).get('constraints', [])):
+            continue
+        limits = deploy.get('resources', {}).get('limits', {})
+        demands[service['container_name']] = (float(limits.get('cpus', 0)), parse_memory_gb(limits.get('memory', 0)))
+    return demands
+
+
+def print_report(report):
+    rr, placed = report['round_robin'], report['placement']
+    print(f"Placement ({report['strategy']}, {report['slots']} slots): "
+          f"{placed['cross_host_call_fraction']:.1%} of {placed['calls']} calls cross hosts "
+          f"(round robin: {rr['cross_host_call_fraction']:.1%}), "
+          f"cross-host weight {placed['cross_host_weight_fraction']:.1%} (round robin: {rr['cross_host_weight_fraction']:.1%})")
+    for slot, (cpus, memory) in report['slot_usage'].items():
+        print(f"  {slot}: {cpus:g} CPUs, {memory:g}G memory")
+    if report.get('overflow'):
+        print(f"Nodes over their slot's capacity: {','.join(report['overflow'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Traffic-aware placement of an enrichment run's containers")
+    parser.add_argument('--workload', help="enrichment_runs/ dir (default: ExpWorkloadName of enrichment_config.yaml)")
+    parser.add_argument('--compose', default='docker-compose.yml', help="compose file with the containers' limits")
+    parser.add_argument('--slots', type=int, help="number of slot labels (default: Placement.slots or 4)")
+    parser.add_argument('--strategy', choices=STRATEGIES, help="default: Placement.strategy or traffic")
+    parser.add_argument('--out', help="slot label per node as JSON (default: print the report only)")
+    args = parser.parse_args()
+
+    config = yaml.safe_load(open('enrichment_config.yaml'))
+    placement_cfg = dict(config.get('Placement') or {})
+    if args.slots:
+        placement_cfg['slots'] = args.slots
+    if args.strategy:
+        placement_cfg['strategy'] = args.strategy
+    workload_dir = f"enrichment_runs/{args.workload or config['ExpWorkloadName']}"
+    with open(os.path.join(workload_dir, 'node_split_output.json')) as f:
+        node_split = json.load(f)
+    demands = compose_demands(args.compose)
+    # Same service order as container_setup.py, round robin restarts at slot0 per service
+    node_groups = [[nid for nid in nodes if nid in demands] for nodes in
+                   [node_split['sf_split'][db]['nodes_list'] for db in ['MongoDB', 'Redis', 'Postgres']] +
+                   [[nid for sl_type in node_split['sl_split'] for nid in node_split['sl_split'][sl_type]['nodes_list']]]]
+    slots, report = place_nodes(node_groups, demands, iter_trace_packets(workload_dir), placement_cfg)
+    print_report(report)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'slots': slots, 'report': report}, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+'''
+Request completion time (RCT) analysis of an experiment's logs, vectorized.
+
+Same results as the analysis notebook (analysis_new.ipynb) loop, without a
+Python callback per tid:
+    logs       every *.csv in the log dir (SL request logs, SL worker logs and
+               client_log.csv; subdirs such as hops/, spans/ and errors/ are not
+               read) plus binary SL request logs (*_log.bin), parsed in parallel
+               into (tid, this_nid, logged_time) columns
+    window     the client's first to last logged (intended send) time;
+               tids sent in [start + WARMUP, start + COOLDOWN] of it count
+    complete   a tid counts if every one of its logger nodes
+               (tid_to_logger_nodes.json) logged it: one join of the
+               distinct (tid, nid) pairs with the expected ones, compared
+               with the expected count per tid
+    RCT        last logged time of the tid - client time, in ms
+The RCT list is written to results/<exp>_rct_new.json with the trailing
+number of <exp> replaced by the completion rate, as the notebook does, and
+gen_percentile_values (np.median, np.percentile 90/99) summarizes it.
+
+--columnar keeps a parquet copy of the parsed logs (.columnar/ in the log
+dir, needs pyarrow) and reuses it while the log files are unchanged.
+
+Usage: python3 rct_analysis.py <log dir> [--workload cons_exp] [--workers N] [--columnar] [--out rct.json]
+'''
+import os
+import re
+import sys
+import json
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+import numpy as np
+import pandas as pd
+
+sys.path.append('./deployment_files/sl_python')
+from request_log import RECORD
+
+CLIENT_NID = 'mewbie_client'
+WARMUP = 0.20 # fraction of the test time skipped at the start
+COOLDOWN = 0.90 # fraction of the test time after which tids are not counted
+COLUMNS = ['tid', 'this_nid', 'logged_time']
+COLUMNAR_DIR = '.columnar'
+# numpy view of request_log.RECORD (packed, little endian)
+RECORD_DTYPE = np.dtype([('tid', 'S64'), ('nid', 'S16'), ('ts', '<i8'), ('type', 'u1'), ('db', 'u1'),
+                         ('target', 'S16'), ('latency', '<i8')])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+def list_log_files(log_dir):
+    return sorted(glob.glob(os.path.join(log_dir, '*.csv')) + glob.glob(os.path.join(log_dir, '*_log.bin')))
+
+
+def read_log_file(path):
+    '''(tid, this_nid, logged_time) columns of one log file'''
+    if path.endswith('.bin'):
+        with open(path, 'rb') as f:
+            data = f.read()
+        records = np.frombuffer(data[:len(data) - len(data) % RECORD_DTYPE.itemsize], dtype=RECORD_DTYPE)
+        return pd.DataFrame({'tid': np.char.decode(records['tid'], 'utf-8').astype(object),
+                             'this_nid': np.char.decode(records['nid'], 'utf-8').astype(object),
+                             'logged_time': records['ts']})
+    df = pd.read_csv(path, names=COLUMNS, usecols=[0, 1, 2], dtype={'tid': str, 'this_nid': str})
+    df['logged_time'] = pd.to_numeric(df['logged_time'], errors='coerce')
+    return df
+
+
+def read_logs(log_dir, workers=None):
+    '''All logs of a run as one frame, files parsed in parallel'''
+    files = list_log_files(log_dir)
+    if not files:
+        raise FileNotFoundError(f"No log files in {log_dir}")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        frames = list(executor.map(read_log_file, files))
+    df = pd.concat(frames, ignore_index=True)
+    if df['logged_time'].dtype == object: # mixed int/float files
+        df['logged_time'] = pd.to_numeric(df['logged_time'], errors='coerce')
+    return df
+
+
+def log_manifest(log_dir):
+    return [[os.path.basename(path), os.path.getsize(path), os.path.getmtime(path)] for path in list_log_files(log_dir)]
+
+
+def load_logs(log_dir, workers=None, columnar=False):
+    '''read_logs, through a parquet copy of the parsed logs when columnar is set'''
+    if not columnar:
+        return read_logs(log_dir, workers)
+    cache_dir = os.path.join(log_dir, COLUMNAR_DIR)
+    parquet_path = os.path.join(cache_dir, 'logs.parquet')
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    manifest = log_manifest(log_dir)
+    try:
+        with open(manifest_path) as f:
+            if json.load(f) == manifest:
+                return pd.read_parquet(parquet_path)
+    except (OSError, ValueError):
+        pass
+    df = read_logs(log_dir, workers)
+    os.makedirs(cache_dir, exist_ok=True)
+    df.to_parquet(parquet_path, index=False)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    return df
+
+
+def expected_logger_nodes(tid_logger_nodes):
+    '''(tid, this_nid) pairs every tid must have been logged by, deduplicated'''
+    expected = pd.Series(tid_logger_nodes, dtype=object).explode().dropna()
+    return pd.DataFrame({'tid': expected.index, 'this_nid': expected.values}).drop_duplicates()
+
+
+def test_window(df, warmup=WARMUP, cooldown=COOLDOWN):
+    '''(lower cutoff, upper cutoff, window seconds) from the client's logged times'''
+    client_times = df.loc[df['this_nid'] == CLIENT_NID, 'logged_time']
+    start, end = client_times.min(), client_times.max()
+    total = end - start
+    lower, upper = start + warmup * total, start + cooldown * total
+    return lower, upper, (upper - lower) / 1000000
+
+
+def compute_rct(df, tid_logger_nodes, warmup=WARMUP, cooldown=COOLDOWN):
+    '''
+    Returns (RCTs in ms ordered by tid, summary dict). A tid is valid when all
+    of its logger nodes logged it and it has a client entry inside the window.
+    '''
+    lower, upper, window_s = test_window(df, warmup, cooldown)
+    client = df[df['this_nid'] == CLIENT_NID]
+    client_start = client.groupby('tid', sort=False)['logged_time'].min()
+    in_window = pd.Index(client.loc[client['logged_time'].between(lower, upper), 'tid'].unique())
+
+    expected = expected_logger_nodes(tid_logger_nodes)
+    seen = df[['tid', 'this_nid']].drop_duplicates()
+    matched = seen.merge(expected, on=['tid', 'this_nid']).groupby('tid', sort=False).size()
+    n_expected = expected.groupby('tid', sort=False).size()
+    complete = matched.index[matched.to_numpy() == n_expected.reindex(matched.index).to_numpy()]
+
+    valid = complete.intersection(in_window).sort_values()
+    last_logged = df[df['tid'].isin(valid)].groupby('tid')['logged_time'].max()
+    rct = (last_logged.loc[valid] - client_start.loc[valid]) / 1000
+
+    n_tids = df['tid'].nunique()
+    summary = {'n_tids': n_tids, 'valid_tids': len(valid), 'invalid_tids': n_tids - len(valid),
+               'lower_cutoff': lower, 'upper_cutoff': upper, 'window_seconds': window_s,
+               'completion_rate': len(valid) / window_s}
+    return rct.tolist(), summary
+
+
+def read_rct_data(dir_name, exp_name):
+    '''
+    return: (exp_name, dict; key: exp_thr, value: list of rct results)
+    '''
+    # eg: dir_name = 'pg_heavy_results', eg: file_name = 'pgh_thr100_rct.json'
+    rct_results = {}
+    for file in os.listdir(dir_name):
+        if file.endswith('.json'):
+            exp_thr = re.search(r'thr(\d+)_', file).group(1)
+            with open(os.path.join(dir_name, file), 'r') as f:
+                rct_results[exp_thr] = json.load(f)
+    return (exp_name, rct_results)
+
+
+def gen_percentile_values(rct_vs_thr_exp_input):
+    '''key: exp (eg: pg_heavy), value: dict; key: thr, value: {median, p90, p99}'''
+    exp_output = {}
+    for exp, dets in rct_vs_thr_exp_input:
+        exp_output[exp] = {}
+        for thr, rct_vals in dets.items():
+            rct_vals = np.asarray(rct_vals, dtype=np.float64)
+            p90, p99 = np.percentile(rct_vals, [90, 99])
+            exp_output[exp][thr] = {'median': np.median(rct_vals), 'p90': p90, 'p99': p99}
+    return exp_output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RCT and completion rate of one experiment's logs")
+    parser.add_argument('log_dir', help="eg: results/cons_exp_results/pgStrong_mnEventual/pgS_mnE_thr2400")
+    parser.add_argument('--workload', help="enrichment_runs/ dir with tid_to_logger_nodes.json "
+                                           "(default: ExpWorkloadName of enrichment_config.yaml)")
+    parser.add_argument('--workers', type=int, default=None, help="log parsing processes (default: CPUs)")
+    parser.add_argument('--columnar', action='store_true', help="keep and reuse a parquet copy of the parsed logs")
+    parser.add_argument('--warmup', type=float, default=WARMUP)
+    parser.add_argument('--cooldown', type=float, default=COOLDOWN)
+    parser.add_argument('--out', help="RCT list path (default: <log dir with the completion rate>_rct_new.json)")
+    args = parser.parse_args()
+
+    workload = args.workload or yaml.safe_load(open('enrichment_config.yaml'))['ExpWorkloadName']
+    with open(f"enrichment_runs/{workload}/tid_to_logger_nodes.json") as f:
+        tid_logger_nodes = json.load(f)
+
+    st = time.time()
+    df = load_logs(args.log_dir, args.workers, args.columnar)
+    print(f"Read {len(df)} log rows in {time.time() - st:.1f}s")
+    st = time.time()
+    rct_results, summary = compute_rct(df, tid_logger_nodes, args.warmup, args.cooldown)
+    print(f"Computed RCT in {time.time() - st:.1f}s")
+    print(f"Time window (seconds): {summary['window_seconds']}")
+    print(f"Number of tids after filtering: {summary['valid_tids']}")
+    print(f"Number of invalid tids: {summary['invalid_tids']}")
+    print(f"Completion rate throughput: {summary['completion_rate']}")
+
+    out = args.out or re.sub(r'\d+$', str(int(summary['completion_rate'])), args.log_dir.rstrip('/')) + "_rct_new.json"
+    with open(out, 'w') as f:
+        json.dump(rct_results, f)
+    print(f"Wrote {out}")
+    if rct_results:
+        for name, value in gen_percentile_values([('rct', {'run': rct_results})])['rct']['run'].items():
+            print(f"{name}: {value:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+'''
+Per-node load and resource limits from the trace packets.
+
+The client sends the packets in file order at the target rps, one trace per
+packet, so a node's rate is its count per packet x rps:
+    SL node   requests/s (initial node of a packet or callee of an SL call)
+              and calls/s (SL and datastore calls it makes)
+    SF node   ops/s, reads and writes, the distinct keys it holds (working
+              set, from op_obj_size) and the SL nodes that call it
+Limits at that load, for container_setup.py to write into the compose file:
+    cpus              SL: requests x request_cpu_ms + calls x call_cpu_ms,
+                      SF: ops x op_cpu_ms of its db; x headroom, rounded up
+                      to cpu_step, within [min_cpus, max_cpus]
+    memory_gb         SL: base_memory_gb + cpus x memory_gb_per_cpu,
+                      SF: base_memory_gb of its db + working set x
+                      data_overhead; within [min_memory_gb, max_memory_gb]
+    workers           SL: server processes it runs (SL_WORKERS): one per whole
+                      CPU for 'sized' and 'auto', else SlServer.workers
+    max_connections   Postgres: pool size (DbPools) x workers summed over the
+                      SL nodes calling it, plus reserved_connections
+    hot               SF nodes with ops/s >= hot_factor x the mean of their
+                      db (the larger hot_node_size pool, DbBatching 'hot')
+With a cluster budget (total_cpus, total_memory_gb), limits adding up to
+more are cut back: the part of every limit above its minimum is scaled by
+the same factor.
+
+Usage: python3 sizing.py [--workload cons_exp] [--rps 2000] [--out sizing.json]
+'''
+import os
+import json
+import math
+import argparse
+
+import yaml
+
+from placement import iter_trace_packets
+
+DEFAULT_SIZING = {
+    'target_rps': 0, # 0: Client rps, or the top rate of a sweep
+    'headroom': 2.0,
+    'cpu_step': 0.25,
+    'memory_step_gb': 0.25,
+    'total_cpus': 0, # 0: no budget
+    'total_memory_gb': 0,
+    'hot_factor': 4.0,
+    'reserved_connections': 10,
+    'sl': {'request_cpu_ms': 2.0, 'call_cpu_ms': 0.5, 'min_cpus': 1, 'max_cpus': 8,
+           'base_memory_gb': 1, 'memory_gb_per_cpu': 0.5, 'min_memory_gb': 1, 'max_memory_gb': 8},
+    'sf': {'op_cpu_ms': {'Postgres': 0.5, 'Redis': 0.05, 'MongoDB': 0.3}, 'min_cpus': 0.5, 'max_cpus': 4,
+           'base_memory_gb': {'Postgres': 1, 'Redis': 0.25, 'MongoDB': 1}, 'data_overhead': 3,
+           'min_memory_gb': 0.5, 'max_memory_gb': 8}
+}
+DEFAULT_POOL_SIZES = {'Postgres': 4, 'Redis': 8, 'MongoDB': 8} # as db_pools.py
+
+
+def merge_options(defaults, overrides):
+    '''defaults overlaid with overrides (e.g. the Sizing block of enrichment_config.yaml), nested dicts merged'''
+    merged = dict(defaults)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(defaults.get(key), dict):
+            merged[key] = merge_options(defaults[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def target_rps(config):
+    '''Sizing.target_rps, else the highest rate the client offers: the top sweep rate or Client rps'''
+    if (config.get('Sizing') or {}).get('target_rps'):
+        return config['Sizing']['target_rps']
+    client_cfg = config.get('Client', {})
+    sweep = str(client_cfg.get('sweep') or '')
+    if ':' in sweep:
+        start, stop, step = (int(x) for x in sweep.split(':'))
+        return max(range(start, stop + 1, step))
+    if sweep:
+        return max(int(x) for x in sweep.split(',') if x)
+    return client_cfg.get('rps', 500)
+
+
+def node_load(trace_packets):
+    '''
+    Counts over all packets: returns (n packets, SL counts, SF counts).
+    SL: nid -> [requests, calls]; SF: nid -> {'reads', 'writes', 'keys': {key: size}, 'callers': set}
+    '''
+    n_packets = 0
+    sl = {}
+    sf = {}
+    for trace_packet in trace_packets:
+        n_packets += 1
+        data_ops_dict = trace_packet['data_ops_dict']
+        sl.setdefault(trace_packet['initial_node'], [0, 0])[0] += 1
+        for nid, calls in trace_packet['node_calls_dict'].items():
+            sl.setdefault(nid, [0, 0])[1] += len(calls)
+            for dm_nid, op_id, _ in calls:
+                if op_id == -1:
+                    sl.setdefault(dm_nid, [0, 0])[0] += 1
+                    continue
+                op = data_ops_dict[str(op_id)]
+                load = sf.setdefault(dm_nid, {'reads': 0, 'writes': 0, 'keys': {}, 'callers': set()})
+                load['writes' if op['op_type'] == 'write' else 'reads'] += 1
+                load['keys'][op['op_obj_id']] = op.get('op_obj_size', 0)
+                load['callers'].add(nid)
+    return n_packets, sl, sf
+
+
+def worker_count(setting, cpus):
+    '''SL server processes under SlServer.workers = setting; 'auto' is the CPU limit rounded down, as sl_workers.py'''
+    if setting in ('sized', 'auto'):
+        return max(int(cpus), 1)
+    return max(int(setting), 1)
+
+
+def round_up(value, step):
+    return math.ceil(value / step - 1e-9) * step
+
+
+def round_down(value, step):
+    return math.floor(value / step + 1e-9) * step
+
+
+def clamp(value, low, high):
+    return min(max(value, low), high)
+
+
+def fit_budget(sizes, field, minimum, budget, step):
+    '''Scales the part of sizes[*][field] above minimum[nid] down to fit budget; returns the factor'''
+    if not budget:
+        return 1.0
+    total = sum(size[field] for size in sizes.values())
+    floor_total = sum(minimum.values())
+    if total <= budget:
+        return 1.0
+    if floor_total >= budget:
+        print(f"Sizing: minimum {field} ({floor_total:g}) exceeds the budget ({budget:g}), using minimums")
+        factor = 0.0
+    else:
+        factor = (budget - floor_total) / (total - floor_total)
+    for nid, size in sizes.items():
+        size[field] = max(round_down(minimum[nid] + (size[field] - minimum[nid]) * factor, step), minimum[nid])
+    return factor
+
+
+def size_nodes(sl_nodes, sf_db, trace_packets, rps, sizing_cfg=None, db_pools=None, sl_workers='sized'):
+    '''
+    sl_nodes: SL node ids, sf_db: SF node id -> db name, rps: target load,
+    sl_workers: the SlServer.workers setting the SL containers run with.
+    Returns {'rps', 'nodes': nid -> sizes, 'hot_sf_nodes', 'budget'}.
+    '''
+    opts = merge_options(DEFAULT_SIZING, sizing_cfg)
+    sl_opts, sf_opts = opts['sl'], opts['sf']
+    db_pools = db_pools or {}
+    n_packets, sl_counts, sf_counts = node_load(trace_packets)
+    per_packet = rps / n_packets if n_packets else 0
+    sizes = {}
+    for nid in sl_nodes:
+        requests, calls = sl_counts.get(nid, [0, 0])
+        cpu_need = (requests * sl_opts['request_cpu_ms'] + calls * sl_opts['call_cpu_ms']) * per_packet / 1000
+        cpus = clamp(round_up(cpu_need * opts['headroom'], opts['cpu_step']), sl_opts['min_cpus'], sl_opts['max_cpus'])
+        sizes[nid] = {'type': 'Python', 'requests_per_s': requests * per_packet, 'calls_per_s': calls * per_packet,
+                      'cpu_need': cpu_need, 'cpus': cpus}
+
+    ops_by_db = {}
+    for nid, db_name in sf_db.items():
+        load = sf_counts.get(nid, {'reads': 0, 'writes': 0, 'keys': {}, 'callers': set()})
+        ops = (load['reads'] + load['writes']) * per_packet
+        ops_by_db.setdefault(db_name, []).append(ops)
+        cpu_need = ops * sf_opts['op_cpu_ms'].get(db_name, 0.5) / 1000
+        cpus = clamp(round_up(cpu_need * opts['headroom'], opts['cpu_step']), sf_opts['min_cpus'], sf_opts['max_cpus'])
+        working_set_gb = sum(load['keys'].values()) / (1 << 30)
+        memory = clamp(round_up(sf_opts['base_memory_gb'].get(db_name, 1) + working_set_gb * sf_opts['data_overhead'],
+                                opts['memory_step_gb']), sf_opts['min_memory_gb'], sf_opts['max_memory_gb'])
+        sizes[nid] = {'type': db_name, 'ops_per_s': ops, 'reads_per_s': load['reads'] * per_packet,
+                      'writes_per_s': load['writes'] * per_packet, 'keys': len(load['keys']),
+                      'working_set_gb': working_set_gb, 'callers': sorted(load['callers']),
+                      'cpu_need': cpu_need, 'cpus': cpus, 'memory_gb': memory}
+
+    budget = {}
+    minimum = {nid: sl_opts['min_cpus'] if nid in sl_nodes else sf_opts['min_cpus'] for nid in sizes}
+    budget['cpu_factor'] = fit_budget(sizes, 'cpus', minimum, opts['total_cpus'], opts['cpu_step'])
+    for nid in sl_nodes: # SL memory follows the CPU limit it ends up with
+        sizes[nid]['memory_gb'] = clamp(round_up(sl_opts['base_memory_gb'] + sizes[nid]['cpus'] * sl_opts['memory_gb_per_cpu'],
+                                                 opts['memory_step_gb']), sl_opts['min_memory_gb'], sl_opts['max_memory_gb'])
+    minimum = {nid: sl_opts['min_memory_gb'] if nid in sl_nodes else sf_opts['min_memory_gb'] for nid in sizes}
+    budget['memory_factor'] = fit_budget(sizes, 'memory_gb', minimum, opts['total_memory_gb'], opts['memory_step_gb'])
+    budget['total_cpus'] = sum(size['cpus'] for size in sizes.values())
+    budget['total_memory_gb'] = sum(size['memory_gb'] for size in sizes.values())
+
+    for nid in sl_nodes:
+        sizes[nid]['workers'] = worker_count(sl_workers, sizes[nid]['cpus'])
+
+    mean_ops = {db_name: sum(ops) / len(ops) for db_name, ops in ops_by_db.items()}
+    hot_sf_nodes = sorted((nid for nid, db_name in sf_db.items()
+                           if mean_ops[db_name] and sizes[nid]['ops_per_s'] >= opts['hot_factor'] * mean_ops[db_name]),
+                          key=lambda nid: -sizes[nid]['ops_per_s'])
+    hot_pool_size = db_pools.get('hot_node_size', 0)
+    for nid, db_name in sf_db.items():
+        if db_name != 'Postgres':
+            continue
+        pool_size = hot_pool_size if nid in hot_sf_nodes and hot_pool_size > 0 else \
+            db_pools.get('Postgres', DEFAULT_POOL_SIZES['Postgres'])
+        sizes[nid]['max_connections'] = opts['reserved_connections'] + pool_size * sum(
+            sizes[caller]['workers'] for caller in sizes[nid]['callers'] if caller in sizes)
+    return {'rps': rps, 'packets': n_packets, 'nodes': sizes, 'hot_sf_nodes': hot_sf_nodes, 'budget': budget}
+
+
+def print_sizing(sizing, top=5):
+    nodes = sizing['nodes']
+    budget = sizing['budget']
+    print(f"Sizing at {sizing['rps']} rps: {budget['total_cpus']:g} CPUs, {budget['total_memory_gb']:g}G memory "
+          f"over {len(nodes)} containers")
+    if budget['cpu_factor'] < 1 or budget['memory_factor'] < 1:
+        print(f"  cut to the budget: CPU above minimum x{budget['cpu_factor']:.2f}, "
+              f"memory above minimum x{budget['memory_factor']:.2f}")
+    for node_type, rate in [('Python', 'requests_per_s'), ('Postgres', 'ops_per_s'), ('Redis', 'ops_per_s'),
+                            ('MongoDB', 'ops_per_s')]:
+        busiest = sorted((nid for nid in nodes if nodes[nid]['type'] == node_type), key=lambda nid: -nodes[nid][rate])
+        if busiest:
+            print(f"  {node_type} busiest: " + ", ".join(
+                f"{nid} {nodes[nid][rate]:.0f}/s {nodes[nid]['cpus']:g} CPUs" for nid in busiest[:top]))
+    print(f"  hot SF nodes: {','.join(sizing['hot_sf_nodes']) or 'none'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-node load and resource limits of an enrichment run")
+    parser.add_argument('--workload', help="enrichment_runs/ dir (default: ExpWorkloadName of enrichment_config.yaml)")
+    parser.add_argument('--rps', type=int, help="target load (default: Sizing.target_rps, Client rps or top sweep rate)")
+    parser.add_argument('--out', help="sizes as JSON (default: print the summary only)")
+    args = parser.parse_args()
+
+    config = yaml.safe_load(open('enrichment_config.yaml'))
+    workload_dir = f"enrichment_runs/{args.workload or config['ExpWorkloadName']}"
+    with open(os.path.join(workload_dir, 'node_split_output.json')) as f:
+        node_split = json.load(f)
+    sl_nodes = [nid for sl_type in node_split['sl_split'] for nid in node_split['sl_split'][sl_type]['nodes_list']]
+    sf_db = {nid: db_name for db_name in node_split['sf_split'] for nid in node_split['sf_split'][db_name]['nodes_list']}
+    sizing = size_nodes(sl_nodes, sf_db, iter_trace_packets(workload_dir), args.rps or target_rps(config),
+                        config.get('Sizing'), config.get('DbPools'), config.get('SlServer', {}).get('workers', 1))
+    print_sizing(sizing)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(sizing, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
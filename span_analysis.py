@@ -0,0 +1,178 @@
+'''
+Critical path breakdown of request completion time from SL span logs.
+
+SL containers started with SPAN_LOG=1 (RequestLog.spans: 1, which also turns
+on the per hop latency log HOP_LOG) write logs/spans/{nid}_spans.csv (or
+.bin): one Hop span per node visit (hop id, parent hop id, receive/end time,
+caller's send time) and one span per downstream call. For each tid this
+rebuilds the hop tree and walks the critical path back from the hop that
+finished last:
+    net:<nid>        caller send -> receive at nid (network + queueing)
+    db:<db>:<nid>    sync datastore calls on the path
+    node:<nid>       everything else the hop did before calling the next
+                     hop on the path (simulated processing, SL hand-offs)
+It then reports how much each component contributes to the critical path,
+over all requests and over the tail (requests at or above --tail-pct).
+
+Usage: python3 span_analysis.py <spans dir> [--tail-pct 99] [--top 20] [--tid T] [--out breakdown.json]
+'''
+import os
+import sys
+import csv
+import json
+import glob
+import argparse
+
+sys.path.append('./deployment_files/sl_python')
+from request_log import read_log_records, SPAN_RECORD
+
+
+def read_csv_spans(path):
+    with open(path, newline='') as f:
+        yield from csv.reader(f)
+
+
+def read_spans(spans_dir):
+    '''Returns hops and calls grouped by tid'''
+    hops = {} # key: tid, value: {hop id: (nid, parent, start, end, send)}
+    calls = {} # key: tid, value: {hop id: [(type, db, target, start, end)]}
+    files = glob.glob(os.path.join(spans_dir, '*_spans.csv')) + glob.glob(os.path.join(spans_dir, '*_spans.bin'))
+    for path in files:
+        if path.endswith('.bin'):
+            rows = read_log_records(path, SPAN_RECORD)
+        else:
+            rows = read_csv_spans(path)
+        for tid, span, parent, nid, entry_type, db, target, start, end, send in rows:
+            start, end, send = int(start), int(end), int(send)
+            if entry_type == 'Hop':
+                hops.setdefault(tid, {})[span] = (nid, parent, start, end, send)
+            else:
+                calls.setdefault(tid, {}).setdefault(span, []).append((entry_type, db, target, start, end))
+    return hops, calls
+
+
+def split_window(nid, hop_calls, window_start, window_end, parts):
+    '''Attributes [window_start, window_end] of a hop to its sync datastore calls and the node itself'''
+    in_db = 0
+    for entry_type, db, target, start, end in hop_calls:
+        if entry_type != 'SyncDB':
+            continue
+        overlap = min(end, window_end) - max(start, window_start)
+        if overlap > 0:
+            key = f"db:{db}:{target}"
+            parts[key] = parts.get(key, 0) + overlap
+            in_db += overlap
+    parts[f"node:{nid}"] = parts.get(f"node:{nid}", 0) + max(window_end - window_start - in_db, 0)
+
+
+def critical_path(tid_hops, tid_calls):
+    '''
+    Returns (path as list of hop ids from root, {component: us}, total us), or
+    None if the chain back to the root is broken (missing span records).
+    '''
+    if not tid_hops:
+        return None
+    last_hop = max(tid_hops, key=lambda hop_id: tid_hops[hop_id][3])
+    path = [last_hop]
+    while tid_hops[path[-1]][1]:
+        parent = tid_hops[path[-1]][1]
+        if parent not in tid_hops or parent in path:
+            return None
+        path.append(parent)
+    path.reverse()
+
+    parts = {}
+    for idx, hop_id in enumerate(path):
+        nid, _, start, end, send = tid_hops[hop_id]
+        if send:
+            parts[f"net:{nid}"] = parts.get(f"net:{nid}", 0) + max(start - send, 0)
+        if idx + 1 < len(path):
+            window_end = tid_hops[path[idx + 1]][4] or tid_hops[path[idx + 1]][2]
+        else:
+            window_end = end
+        split_window(nid, tid_calls.get(hop_id, []), start, window_end, parts)
+    root = tid_hops[path[0]]
+    total = tid_hops[last_hop][3] - (root[4] or root[2])
+    return path, parts, total
+
+
+def percentile_threshold(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def aggregate(results, tail_pct):
+    '''results: {tid: (path, parts, total)}. Returns breakdown over all requests and over the tail.'''
+    threshold = percentile_threshold([total for _, _, total in results.values()], tail_pct)
+    breakdown = {}
+    for label, selected in [('all', results), ('tail', {tid: r for tid, r in results.items() if r[2] >= threshold})]:
+        sums = {}
+        path_total = 0
+        for _, parts, total in selected.values():
+            path_total += total
+            for key, us in parts.items():
+                sums[key] = sums.get(key, 0) + us
+        n = len(selected)
+        by_class = {}
+        for key, us in sums.items():
+            by_class[key.split(':')[0]] = by_class.get(key.split(':')[0], 0) + us
+        breakdown[label] = {
+            'requests': n,
+            'mean_critical_path_ms': path_total / n / 1000 if n else 0,
+            'by_class_share': {k: v / path_total for k, v in by_class.items()} if path_total else {},
+            'components': sorted(
+                [{'component': key, 'mean_ms': us / n / 1000, 'share': us / path_total if path_total else 0}
+                 for key, us in sums.items()], key=lambda c: -c['share'])
+        }
+    breakdown['tail_threshold_ms'] = threshold / 1000
+    return breakdown
+
+
+def print_breakdown(breakdown, top):
+    print(f"Tail threshold: {breakdown['tail_threshold_ms']:.2f} ms")
+    for label in ['all', 'tail']:
+        dets = breakdown[label]
+        print(f"\n== {label}: {dets['requests']} requests, mean critical path {dets['mean_critical_path_ms']:.2f} ms")
+        print("   " + ", ".join(f"{k} {v:.1%}" for k, v in sorted(dets['by_class_share'].items())))
+        print(f"   {'component':32}{'mean ms':>10}{'share':>8}")
+        for comp in dets['components'][:top]:
+            print(f"   {comp['component']:32}{comp['mean_ms']:10.3f}{comp['share']:8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Critical path RCT breakdown from SL span logs")
+    parser.add_argument('spans_dir', help="directory with *_spans.csv / *_spans.bin (e.g. results/<exp>/spans)")
+    parser.add_argument('--tail-pct', type=float, default=99)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--tid', default=None, help="print the critical path of one request")
+    parser.add_argument('--out', default=None, help="write the breakdown as JSON")
+    args = parser.parse_args()
+
+    hops, calls = read_spans(args.spans_dir)
+    results = {}
+    broken = 0
+    for tid, tid_hops in hops.items():
+        result = critical_path(tid_hops, calls.get(tid, {}))
+        if result is None:
+            broken += 1
+            continue
+        results[tid] = result
+    print(f"Requests with spans: {len(hops)}, complete critical paths: {len(results)}, broken chains: {broken}")
+    if not results:
+        return
+
+    if args.tid:
+        path, parts, total = results[args.tid]
+        print(f"{args.tid}: {total / 1000:.3f} ms, path {' -> '.join(hops[args.tid][h][0] for h in path)}")
+        for key, us in sorted(parts.items(), key=lambda kv: -kv[1]):
+            print(f"   {key:32}{us / 1000:10.3f}")
+
+    breakdown = aggregate(results, args.tail_pct)
+    print_breakdown(breakdown, args.top)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(breakdown, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()